@@ -1,24 +1,40 @@
 import random
 import numpy as np # pyright: ignore[reportMissingImports]
-from collections import deque
 from tensorflow.keras.models import Sequential, load_model # pyright: ignore[reportMissingImports]
 from tensorflow.keras.layers import Dense, Input # pyright: ignore[reportMissingImports]
 from tensorflow.keras.optimizers import Adam # pyright: ignore[reportMissingImports]
 from tensorflow.keras.metrics import MeanSquaredError # pyright: ignore[reportMissingImports]
 import tensorflow as tf # pyright: ignore[reportMissingImports]
-# 為了穩定性，我們在這裡保留急切執行 (Eager Execution) 的設定
-tf.config.run_functions_eagerly(True) 
-tf.data.experimental.enable_debug_mode() # 這個可以移除，不影響模型訓練
- # <--- 【新增或確認】
 import os # 新增：用於檢查檔案是否存在
+import json
+import threading
+import time
+from atomic_file import atomic_write
+from numpy_policy import NumpyPolicy, DecisionLatencyStats, QValueCache
+from checkpoint_writer import CheckpointWriter, latest_checkpoint
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
 
-class DQNAgent:
+# 【除錯用】急切執行 (Eager Execution) 改為選用：設定環境變數 DQN_EAGER_DEBUG=1 才開啟。
+# 開啟後 replay 的 tf.function 會逐行執行，方便除錯，但訓練速度會慢一個數量級。
+DEBUG_EAGER = os.environ.get("DQN_EAGER_DEBUG", "0") == "1"
+
+
+def enable_eager_debug():
+    tf.config.run_functions_eagerly(True)
+    tf.data.experimental.enable_debug_mode()
+
+class DQNAgent(DecisionLatencyStats):
     # --- 【修正點 1：新增 instance_id 參數】---
-    def __init__(self, state_size, action_space, instance_id="default_rl"):
+    def __init__(self, state_size, action_space, instance_id="default_rl", debug_eager=DEBUG_EAGER,
+                 prioritized=False, q_cache_size=4096, policy_sync_interval=1):
         self.state_size = state_size
         self.action_space = action_space
         self.action_size = len(action_space)
-        self.memory = deque(maxlen=20000)
+        # 【陣列式記憶庫】預先配置的 NumPy 環狀緩衝區 (取代 deque of tuples)
+        # prioritized=True 時改用 sum-tree 優先回放，依 TD 誤差取樣
+        self.memory_capacity = 20000
+        self.prioritized = prioritized
+        self.memory = self._new_memory(state_size)
 
         # 超參數 - 命名已統一
         self.discount_factor = 0.95
@@ -32,18 +48,90 @@ class DQNAgent:
         # --- 檔案名稱設定 (使用 ID 隔離) ---
         self.instance_id = instance_id
         self.model_filename = f"model_{self.instance_id}.h5"
+        # 匯出的主網路權重 (測試模式可不 import TensorFlow 直接推論)
+        self.policy_filename = f"policy_{self.instance_id}.npz"
         self.target_model_filename = f"target_model_{self.instance_id}.h5"
+        # 【持久化記憶庫】記憶體映射的記憶庫目錄，以及訓練進度 (train_counter / epsilon)
+        self.memory_dir = f"replay_{self.instance_id}"
+        self.state_filename = f"agent_state_{self.instance_id}.json"
+        # 【背景檢查點】每 checkpoint_every 次訓練交出一份權重快照，每 full_checkpoint_every 份寫一次完整檢查點
+        self.checkpoint_writer = None
+        self.checkpoint_every = 0
+        self.full_checkpoint_every = 10
+        self._checkpoints_submitted = 0
 
         # 【修正】: 將模型初始化為 None，延遲建立
         self.model = None
         self.target_model = None
+        # 【圖模式訓練】編譯後的單次訓練函式，在模型建立/載入後產生
+        self._train_step = None
+        self.debug_eager = debug_eager
+        if debug_eager:
+            enable_eager_debug()
+
+        # 【低延遲推論】單一狀態決策使用 NumPy 前向傳播；主網路權重每次改變時版本號 +1，
+        # NumPy 副本在下一次決策時才重新載入權重
+        self._weights_version = 0
+        self._policy = NumpyPolicy()
+        self._policy_version = -1
+        # 【Q 值快取】以狀態 tuple 為鍵的 LRU 快取，NumPy 副本重新載入權重時清空。
+        # policy_sync_interval：權重每更新幾次才同步一次 (1 = 每次 replay 後都同步)
+        self.q_cache = QValueCache(q_cache_size)
+        self.policy_sync_interval = policy_sync_interval
+        # 決策延遲統計 (秒)
+        self.decision_count = 0
+        self.decision_time_total = 0.0
+        self.decision_time_max = 0.0
+
+        # 【非同步學習】記憶庫的新增/取樣以 _memory_cond 保護；訓練、存檔與載入以 _train_lock 串行化
+        self._memory_cond = threading.Condition()
+        self._train_lock = threading.RLock()
+        self._learner = None # 背景學習執行緒 (None 表示在 learn() 中同步訓練)
+        self._learner_stop = threading.Event()
+        self._learner_error = None
+        self.replay_ratio = 1.0 # 每個決策步對應的學習更新次數 (None 表示不限制，持續訓練)
+        self.learner_batch_size = 64
+        self.publish_interval = 10 # 學習執行緒每幾次更新發布一次權重給控制迴圈
+        self.transitions_added = 0
+        # 決策步數：learn() / learn_batch() 各算一步 (多路口時一步會存入多筆經驗)
+        self.decision_steps = 0
+        self.learner_updates = 0
+        # 發布給控制迴圈的主網路權重副本 (以 _weights_lock 保護)
+        self._weights_lock = threading.Lock()
+        self._published_weights = None
+        self._published_version = -1
+
+    def _new_memory(self, state_size, storage_dir=None):
+        if self.prioritized:
+            return PrioritizedReplayBuffer(self.memory_capacity, state_size, storage_dir=storage_dir)
+        return ReplayBuffer(self.memory_capacity, state_size, storage_dir=storage_dir)
+
+    def attach_persistent_memory(self):
+        """
+        改用 memory_dir 中記憶體映射的記憶庫 (需在確定 state_size 後呼叫)。
+        上次 save_model 時的經驗會直接接續使用，不需重新累積 64 筆才開始學習。
+        """
+        if self.memory.storage_dir == self.memory_dir:
+            return
+        if len(self.memory) > 0:
+            print("⚠️ 記憶庫已有經驗，不切換為持久化記憶庫。")
+            return
+        with self._memory_cond:
+            self.memory = self._new_memory(self.state_size, storage_dir=self.memory_dir)
+        if len(self.memory) > 0:
+            print(f"✅ 已接續記憶庫 {self.memory_dir}: {len(self.memory)} 筆經驗")
 
     def build_models(self):
         """根據 self.state_size 建立主網路和目標網路。"""
+        if self.memory.state_size != self.state_size and len(self.memory) == 0:
+            # state_size 在 SUMO 啟動後才確定，依真實維度重新配置記憶庫
+            self.memory = self._new_memory(self.state_size)
         if self.model is None: # 只有在模型尚未建立時才建立
             self.model = self._build_model()
             self.target_model = self._build_model()
             self.update_target_model()
+            self._train_step = self._make_train_step()
+            self._weights_version += 1
             # 【修正點 A：編譯時使用物件而非字串】
         # 建立主網路
         # self.model.compile(
@@ -68,11 +156,50 @@ class DQNAgent:
         model.compile(loss='mse', optimizer=Adam(learning_rate=self.learning_rate), metrics=['mse'])
         return model
     
+    def _make_train_step(self):
+        """
+        【圖模式訓練】建立一個 tf.function：在同一次圖呼叫中完成
+        目標網路 Q 值、主網路 Q 值、Bellman 目標與梯度更新。
+        損失與原本 model.fit(states, target_f) 相同 (對所有動作取平均的 MSE，
+        未採取的動作目標等於自身預測，梯度為 0)；weights 是每筆樣本的
+        重要性取樣權重 (均勻回放時全為 1，損失與原本完全相同)。
+        """
+        model = self.model
+        target_model = self.target_model
+        optimizer = model.optimizer
+        if not getattr(optimizer, "built", True):
+            # 先在急切模式建立優化器變數，避免在 tf.function 內建立變數
+            optimizer.build(model.trainable_variables)
+        discount_factor = self.discount_factor
+        action_size = self.action_size
+
+        @tf.function
+        def train_step(states, actions, rewards, next_states, dones, weights):
+            # target = reward + discount_factor * max_Q(S') * (1 - done)
+            q_next = target_model(next_states, training=False)
+            targets = rewards + discount_factor * (1.0 - dones) * tf.reduce_max(q_next, axis=1)
+            mask = tf.one_hot(actions, action_size)
+            with tf.GradientTape() as tape:
+                q_values = model(states, training=True)
+                # 只更新實際採取的 action 對應的 Q 值
+                target_f = tf.stop_gradient(mask * targets[:, None] + (1.0 - mask) * q_values)
+                loss = tf.reduce_mean(weights[:, None] * tf.square(target_f - q_values))
+            grads = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(grads, model.trainable_variables))
+            # 回傳 TD 誤差 (目標 - 預測)，供統計或優先回放使用
+            td_errors = targets - tf.reduce_sum(mask * q_values, axis=1)
+            return loss, td_errors
+
+        return train_step
+
     def update_target_model(self):
         self.target_model.set_weights(self.model.get_weights())
 
     def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+        with self._memory_cond:
+            self.memory.add(state, action, reward, next_state, done)
+            self.transitions_added += 1
+            self._memory_cond.notify()
 
     def choose_action(self, state):
         # 【修正】: 確保模型已建立
@@ -82,9 +209,63 @@ class DQNAgent:
         if np.random.rand() <= self.exploration_rate:
             return random.choice(self.action_space)
         
-        state_tensor = np.array([state])
-        act_values = self.model.predict(state_tensor, verbose=0)
-        return np.argmax(act_values[0])
+        # 【低延遲推論】不使用 model.predict (每次呼叫都會建立資料管線，需數毫秒)
+        start = time.perf_counter()
+        action = int(np.argmax(self.q_values(state)))
+        self._record_decision_latency(time.perf_counter() - start)
+        return action
+
+    def _sync_policy(self):
+        """主網路權重改變過才重新載入 NumPy 推論用的權重"""
+        if self._learner is not None:
+            # 非同步學習時只讀學習執行緒發布的權重副本，不碰正在訓練的 Keras 模型
+            with self._weights_lock:
+                version, weights = self._published_version, self._published_weights
+            if self._policy_stale(version):
+                self._policy.set_weights(weights)
+                self._policy_version = version
+                self.q_cache.clear()
+            return self._policy
+        if self._policy_stale(self._weights_version):
+            self._policy.set_weights(self.model.get_weights())
+            self._policy_version = self._weights_version
+            self.q_cache.clear()
+        return self._policy
+
+    def _policy_stale(self, version):
+        if self._policy_version == version:
+            return False
+        # 第一次載入或版本往回跳 (例如重新載入模型) 時一律同步
+        if self._policy_version < 0 or version < self._policy_version:
+            return True
+        return version - self._policy_version >= self.policy_sync_interval
+
+    def q_values(self, state):
+        """單一狀態的 Q 值 (NumPy 前向傳播，相同狀態直接取快取)"""
+        return self.q_cache.q_values_batch(self._sync_policy(), [state])[0]
+
+    def cache_report(self):
+        return self.q_cache.report()
+
+    def choose_actions(self, states):
+        """
+        【多路口批次推論】一次為多個號誌選擇動作。
+        每一列各自做 epsilon 探索；需要利用 (exploitation) 的列只做一次前向傳播。
+        """
+        if self.model is None:
+            raise RuntimeError("模型尚未建立。請在初始化 Agent 後呼叫 build_models()。")
+
+        n = len(states)
+        actions = np.asarray(self.action_space)[np.random.randint(self.action_size, size=n)]
+        greedy = np.random.rand(n) > self.exploration_rate
+        if greedy.any():
+            # NumPy 前向傳播 (不經過 predict 的資料管線)，快取未命中的狀態整批只算一次
+            start = time.perf_counter()
+            rows = [states[i] for i in np.flatnonzero(greedy)]
+            q_values = self.q_cache.q_values_batch(self._sync_policy(), rows)
+            actions[greedy] = np.argmax(q_values, axis=1)
+            self._record_decision_latency(time.perf_counter() - start)
+        return [int(a) for a in actions]
 
     # def replay(self, batch_size):
     #     if len(self.memory) < batch_size:
@@ -126,68 +307,259 @@ class DQNAgent:
         if self.model is None: # 增加安全檢查
             return
             
-        minibatch = random.sample(self.memory, batch_size)
-        
-        # --- 【優化點：將樣本轉換為批次陣列】 ---
-        # 1. 從記憶庫中分離出所有元素，並轉換為 NumPy 陣列
-        # *minibatch: 將 list of tuples 展開
-        # map(np.array, zip(...)): 高效地將所有元素打包成獨立的 NumPy 陣列
-        states, actions, rewards, next_states, dones = map(np.array, zip(*minibatch))
-
-        # 2. 【單次呼叫】使用 Target Model 預測所有下一狀態的 Q 值
-        # target_q_next 的 shape: (batch_size, action_size)
-        target_q_next = self.target_model.predict(next_states, verbose=0)
-        
-        # 3. 計算 DQN 的 Target Q 值
-        # 找出每個 next_state 的最大 Q 值 (np.amax(..., axis=1))
-        # dones (布林值) 轉換為 (0 或 1) 後，用於判斷是否要加上未來獎勵
-        q_max = np.amax(target_q_next, axis=1) 
-        
-        # target = reward + discount_factor * max_Q(S') * (1 - done)
-        targets = rewards + self.discount_factor * (1 - dones) * q_max
-        
-        # 4. 【單次呼叫】使用 Main Model 獲取當前所有狀態的 Q 值預測
-        # target_f 的 shape: (batch_size, action_size)
-        target_f = self.model.predict(states, verbose=0)
-        
-        # 5. 僅更新實際採取的 action 對應的 Q 值
-        # np.arange(batch_size) 產生 [0, 1, 2, ...] 的索引
-        # actions 陣列提供要更新的欄位索引
-        batch_indices = np.arange(batch_size)
-        target_f[batch_indices, actions] = targets
-        
-        # 6. 【單次呼叫】訓練整個批次
-        self.model.fit(states, target_f, epochs=1, verbose=0)
+        with self._train_lock:
+            self._replay_locked(batch_size)
+
+    def _replay_locked(self, batch_size):
+        # 1. 【陣列式記憶庫】一次向量化索引取出整個批次 (fancy indexing 會複製，取出後即可放開鎖)
+        with self._memory_cond:
+            if self.prioritized:
+                states, actions, rewards, next_states, dones, indices, weights = self.memory.sample(batch_size)
+            else:
+                states, actions, rewards, next_states, dones = self.memory.sample(batch_size)
+                weights = np.ones(batch_size, dtype=np.float32)
+
+        # 2. 【單次圖呼叫】目標 Q 值、Bellman 目標與梯度更新全部在編譯後的 train_step 中完成
+        # (取代原本的兩次 predict + 一次 fit，沒有 Keras callback 與資料管線的開銷)
+        # 固定 dtype，避免 tf.function 因輸入型別不同而重新追蹤
+        _, td_errors = self._train_step(
+            np.asarray(states, dtype=np.float32),
+            np.asarray(actions, dtype=np.int32),
+            np.asarray(rewards, dtype=np.float32),
+            np.asarray(next_states, dtype=np.float32),
+            np.asarray(dones, dtype=np.float32),
+            np.asarray(weights, dtype=np.float32),
+        )
+        self._weights_version += 1 # 主網路權重已更新
+        if self.prioritized:
+            # 【優先回放】以這次訓練的 TD 誤差更新被抽到的樣本優先度 (O(log n))
+            with self._memory_cond:
+                self.memory.update_priorities(indices, td_errors.numpy())
         
         # ---------------------------------------------
 
         # (將所有學習後的更新都放在 replay 中)
         self.train_counter += 1
+        if self.checkpoint_every and self.train_counter % self.checkpoint_every == 0:
+            self._submit_checkpoint()
         if self.train_counter % self.update_target_freq == 0:
             self.update_target_model()
             print(f"*** 目標網路已在第 {self.train_counter} 步訓練後更新 ***")
         
         if self.exploration_rate > self.min_exploration:
             self.exploration_rate *= self.exploration_decay
+    def _count_decision_step(self):
+        with self._memory_cond:
+            self.decision_steps += 1
+            self._memory_cond.notify()
+
     def learn(self, state, action, reward, next_state):
         self.remember(state, action, reward, next_state, False)
+        self._count_decision_step()
+        if self._learner is not None:
+            self._check_learner()
+            return # 背景學習執行緒負責訓練
         # 在記憶庫足夠大時才開始學習
         if len(self.memory) > 64: 
             self.replay(batch_size=64)
 
+    def learn_batch(self, transitions):
+        """
+        【多路口】一次存入多筆 (state, action, reward, next_state)，只訓練一次。
+        控制的號誌越多，每個決策點的訓練成本也不會跟著線性增加。
+        """
+        for state, action, reward, next_state in transitions:
+            self.remember(state, action, reward, next_state, False)
+        self._count_decision_step()
+        if self._learner is not None:
+            self._check_learner()
+            return # 背景學習執行緒負責訓練
+        if len(self.memory) > 64:
+            self.replay(batch_size=64)
+
+    # --- 【非同步學習】控制迴圈只存經驗與讀權重副本，訓練在背景執行緒持續進行 ---
+    def start_async_learner(self, replay_ratio=1.0, batch_size=64, publish_interval=10):
+        """
+        啟動背景學習執行緒。replay_ratio 為每個決策步 (learn / learn_batch 呼叫一次) 對應的學習更新次數，
+        與控制的號誌數量無關
+        (學習超前時會等待新經驗；None 表示不等待、持續訓練)。
+        TensorFlow 運算與 TraCI socket 等待都會釋放 GIL，模擬與訓練得以重疊。
+        """
+        if self.model is None:
+            raise RuntimeError("模型尚未建立。請在初始化 Agent 後呼叫 build_models()。")
+        if self._learner is not None:
+            return
+        self.replay_ratio = replay_ratio
+        self.learner_batch_size = batch_size
+        self.publish_interval = publish_interval
+        self.learner_updates = 0
+        with self._memory_cond:
+            self.decision_steps = 0 # 已有的經驗不計入比例
+        self._learner_error = None
+        self._learner_stop.clear()
+        self._publish_weights()
+        self._learner = threading.Thread(target=self._learner_loop, name=f"dqn-learner-{self.instance_id}",
+                                         daemon=True)
+        self._learner.start()
+
+    def stop_async_learner(self):
+        """停止背景學習執行緒並回到同步訓練；學習執行緒發生的例外會在此重新拋出"""
+        learner = self._learner
+        if learner is None:
+            return
+        self._learner_stop.set()
+        with self._memory_cond:
+            self._memory_cond.notify_all()
+        learner.join()
+        self._learner = None
+        self._weights_version += 1 # 讓同步模式下一次決策重新載入最新權重
+        if self._learner_error is not None:
+            raise RuntimeError("背景學習執行緒發生錯誤") from self._learner_error
+
+    def _learner_should_train(self):
+        if len(self.memory) <= self.learner_batch_size:
+            return False
+        if self.replay_ratio is None:
+            return True
+        return self.learner_updates < self.replay_ratio * self.decision_steps
+
+    def _learner_loop(self):
+        try:
+            while not self._learner_stop.is_set():
+                with self._memory_cond:
+                    while not self._learner_stop.is_set() and not self._learner_should_train():
+                        self._memory_cond.wait(0.1)
+                if self._learner_stop.is_set():
+                    break
+                self.replay(self.learner_batch_size)
+                self.learner_updates += 1
+                if self.learner_updates % self.publish_interval == 0:
+                    self._publish_weights()
+            self._publish_weights()
+        except Exception as e:
+            self._learner_error = e
+            print(f"❌ 背景學習執行緒停止: {e}", flush=True)
+
+    def _publish_weights(self):
+        with self._train_lock:
+            weights = self.model.get_weights()
+            version = self._weights_version
+        with self._weights_lock:
+            self._published_weights = weights
+            self._published_version = version
+
+    def _check_learner(self):
+        if self._learner_error is not None:
+            raise RuntimeError("背景學習執行緒發生錯誤") from self._learner_error
+
+    # --- 【背景檢查點】控制迴圈只取權重快照，寫檔在 CheckpointWriter 的執行緒進行 ---
+    def enable_checkpoints(self, every=500, keep=5, full_every=10, keep_full=2):
+        """每 every 次訓練更新交出一份檢查點；0 表示停用"""
+        self.checkpoint_every = every
+        self.full_checkpoint_every = full_every
+        if every and self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter(self.instance_id, keep=keep, keep_full=keep_full)
+
+    def close_checkpoints(self):
+        """等待背景寫入完成並停止寫入執行緒"""
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+            print(f"💾 檢查點：寫入 {self.checkpoint_writer.written} 個，因寫入較慢略過 {self.checkpoint_writer.dropped} 個")
+            self.checkpoint_writer = None
+
+    def _submit_checkpoint(self):
+        # 呼叫時持有 _train_lock，取得的是同一次更新後一致的快照
+        self._checkpoints_submitted += 1
+        weights = self.model.get_weights()
+        if self._checkpoints_submitted % self.full_checkpoint_every == 0:
+            variables = self.model.optimizer.variables
+            if callable(variables): # 舊版 Keras 的 variables 是方法
+                variables = variables()
+            self.checkpoint_writer.submit(self.train_counter, self.exploration_rate, weights,
+                                          self.target_model.get_weights(), [v.numpy() for v in variables])
+        else:
+            self.checkpoint_writer.submit(self.train_counter, self.exploration_rate, weights)
+
+    def restore_latest_checkpoint(self, newer_than=None):
+        """
+        從 checkpoints/<id>/ 中最新的檢查點還原權重與訓練進度 (完整檢查點另外還原
+        目標網路與優化器)。newer_than 為時間戳記，檢查點不比它新時不還原。
+        """
+        path = latest_checkpoint(self.instance_id)
+        if path is None or (newer_than is not None and os.path.getmtime(path) <= newer_than):
+            return False
+        with np.load(path) as data:
+            count = sum(1 for name in data.files if name.startswith("arr_"))
+            expected = [w.shape for w in self.model.get_weights()]
+            shapes = [data[f"arr_{i}"].shape for i in range(count)]
+            if "target_0" in data.files:
+                shapes_match = shapes == expected and [data[f"target_{i}"].shape for i in range(count)] == expected
+            else:
+                shapes_match = shapes == expected
+            if not shapes_match:
+                # 例如以不同的 --tls 選擇 (狀態維度不同) 訓練出的檢查點
+                print(f"⚠️ 檢查點 {path} 的網路結構與目前模型不同，略過還原。")
+                return False
+            with self._train_lock:
+                self.model.set_weights([data[f"arr_{i}"] for i in range(count)])
+                if "target_0" in data.files:
+                    self.target_model.set_weights([data[f"target_{i}"] for i in range(count)])
+                    variables = self.model.optimizer.variables
+                    if callable(variables):
+                        variables = variables()
+                    opt_count = sum(1 for name in data.files if name.startswith("opt_"))
+                    if opt_count == len(variables):
+                        for i, v in enumerate(variables):
+                            v.assign(data[f"opt_{i}"])
+                else:
+                    self.update_target_model()
+                self.train_counter = int(data["train_counter"])
+                self.exploration_rate = float(data["exploration_rate"])
+                self._weights_version += 1
+        print(f"✅ 已從檢查點還原: {path} (訓練次數 {self.train_counter}, Epsilon {self.exploration_rate:.3f})")
+        return True
+
     # --- 【修正點 2：新增儲存模型的方法】---
     def save_model(self, filename="model_weights.h5"):
         """將主網路和目標網路模型儲存到帶有唯一 ID 的檔案"""
         try:
-            self.model.save(self.model_filename)
-            self.target_model.save(self.target_model_filename)
+            with self._train_lock: # 不在背景學習更新到一半時存檔
+                self.model.save(self.model_filename)
+                self.target_model.save(self.target_model_filename)
+                with self._memory_cond:
+                    self.memory.flush()
+                self._save_training_state()
+                self.export_policy()
             print(f"\n✅ RL 模型已儲存: {self.model_filename}")
         except Exception as e:
             print(f"\n❌ 模型儲存失敗: {e}")
 
+    def _save_training_state(self):
+        state = {"train_counter": self.train_counter, "exploration_rate": self.exploration_rate}
+        with atomic_write(self.state_filename) as f:
+            json.dump(state, f)
+
+    def _load_training_state(self):
+        if not os.path.exists(self.state_filename):
+            return False
+        with open(self.state_filename, encoding="utf-8") as f:
+            state = json.load(f)
+        self.train_counter = state["train_counter"]
+        self.exploration_rate = state["exploration_rate"]
+        return True
+
+    def export_policy(self):
+        """把主網路權重匯出成 policy_<id>.npz (原子替換)，給不需要 TensorFlow 的測試模式使用"""
+        with atomic_write(self.policy_filename, "wb") as f:
+            np.savez(f, *self.model.get_weights())
+
     # --- 【修正點 3：新增載入模型的方法】---
-    def load_model(self):
-        """從帶有唯一 ID 的檔案載入模型"""
+    def load_model(self, resume=False):
+        """
+        從帶有唯一 ID 的檔案載入模型。
+        resume=True (接續訓練) 時一併還原 train_counter 與 epsilon；
+        否則 epsilon 降到最低 (測試用)。
+        """
         # 確保 model 檔案存在
         if not os.path.exists(self.model_filename):
             print(f"警告：找不到模型檔案 '{self.model_filename}'，將從頭開始訓練。")
@@ -214,7 +586,13 @@ class DQNAgent:
                 compile=True # 確保模型載入後是可用的
                 )
             self.update_target_model() # 載入後同步權重
+            self._train_step = self._make_train_step() # 模型物件已更換，重新建立訓練函式
+            self._weights_version += 1
             
+            if resume and self._load_training_state():
+                print(f"✅ RL 模型已載入: {self.model_filename}. 接續訓練 (訓練次數 {self.train_counter}, "
+                      f"Epsilon {self.exploration_rate:.3f})")
+                return True
             # 載入模型後，將探索率降到最低
             self.exploration_rate = self.min_exploration
             print(f"✅ RL 模型已載入: {self.model_filename}. Epsilon 重設為 {self.min_exploration}")
@@ -224,4 +602,25 @@ class DQNAgent:
             print(f"❌ 無法載入模型 '{self.model_filename}' (錯誤: {e})，將從頭開始訓練。")
             return False
 
-    
\ No newline at end of file
+
+def benchmark_replay(state_size=6, updates=200, batch_size=64, prioritized=False):
+    """量測 replay() 每秒可完成的學習更新次數 (使用隨機資料，不需要 SUMO)"""
+    agent = DQNAgent(state_size=state_size, action_space=[0, 1], instance_id="benchmark",
+                     prioritized=prioritized)
+    agent.build_models()
+    for _ in range(1000):
+        state = tuple(np.random.randint(0, 20, size=state_size))
+        next_state = tuple(np.random.randint(0, 20, size=state_size))
+        agent.remember(state, random.randint(0, 1), random.uniform(-50, 0), next_state, False)
+    agent.replay(batch_size) # 第一次呼叫包含 tf.function 追蹤 (tracing) 時間，不列入計時
+    start = time.perf_counter()
+    for _ in range(updates):
+        agent.replay(batch_size)
+    elapsed = time.perf_counter() - start
+    return updates / elapsed
+
+
+if __name__ == "__main__":
+    mode = "eager (DQN_EAGER_DEBUG=1)" if DEBUG_EAGER else "graph (tf.function)"
+    print(f"replay() 學習更新速度 [{mode}]: {benchmark_replay():.1f} 次/秒")
+    print(f"replay() 學習更新速度 [{mode}, 優先回放]: {benchmark_replay(prioritized=True):.1f} 次/秒")
@@ -1,5 +1,3 @@
-import traci
-from traci._trafficlight import Logic, Phase
 from plyer import notification 
 import xml.etree.ElementTree as ET
 import concurrent.futures # 【新增】用於多核心並行處理
@@ -9,6 +7,12 @@ from deap import base, creator, tools
 import random
 import csv
 import datetime
+from tls_topology import load_topology_for_sumocfg, green_phase_indices
+from sumo_backend import SumoBackend
+from sumo_snapshot import ensure_snapshot, SIM_OPTIONS
+from sim_fitness import statistic_output_options, total_time_loss, trip_time_loss_so_far, spearman
+from tls_program_eval import run_fixed_time
+from fitness_cache import FitnessCache, evaluation_context, evaluate_with_cache, format_cache_stats
 
 # --- 基礎設定與 SUMO 啟動 ---
 def get_sumo_home():
@@ -26,116 +30,256 @@ if len(sys.argv) > 1:
     GA_INSTANCE_ID = sys.argv[1]
 print(f"{os.getpid}: 啟動 GA 實例 ID: {GA_INSTANCE_ID}",flush=True)
 
-now = datetime.datetime.now()
-timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
-filename = rf"./GA_{GA_INSTANCE_ID}__{timestamp}.csv"
-
-csv_file = open(file=filename, mode="w", newline="", encoding="utf-8")
-csv_writer = csv.writer(csv_file)
-csv_writer.writerow(["generation", "phase1", "phase2", "delay"])
-
-TRIPINFO_OUTPUT_PATH = f"tripinfo_{GA_INSTANCE_ID}.xml"
 sumo_binary = "sumo"
 SUMO_CONFIG_FILE="osm.sumocfg"
 sim_seed  = 42
-sumoCmd = [
+
+# 【號誌拓撲索引】從快取的路網索引取得兩個主綠燈相位及其後的黃燈相位的號誌字串，
+# 取代寫死的 'G' * 8 + 'r' * 8 (原本會讓互相衝突的兩個方向同時綠燈)
+TLS_INFO = load_topology_for_sumocfg(SUMO_CONFIG_FILE)[TRAFFIC_LIGHT_ID]
+_green = green_phase_indices(TLS_INFO)
+_phases = TLS_INFO["phases"]
+GREEN1_STATE = _phases[_green[0]]["state"]
+YELLOW1_STATE = _phases[_green[0] + 1]["state"]
+GREEN2_STATE = _phases[_green[1]]["state"]
+YELLOW2_STATE = _phases[(_green[1] + 1) % len(_phases)]["state"]
+
+# 【後端切換】GA 不需要 GUI，預設使用行程內的 libsumo (每個 worker 行程各自一個模擬)；
+# 找不到 libsumo 時回退到 traci。可用環境變數 SUMO_BACKEND=traci 強制使用 socket。
+SUMO = SumoBackend(sumo_binary)
+print(f"{os.getpid()}: SUMO 後端: {SUMO.name}", flush=True)
+
+# 【暖機快照】GA_WARM_START=1 時每個個體都從穩定負載的快照開始評估，跳過空路網的暖機
+GA_WARM_START = os.environ.get("GA_WARM_START", "0") == "1"
+WARM_START_STATE = ensure_snapshot(SUMO_CONFIG_FILE, sim_seed, SIM_OPTIONS) if GA_WARM_START else None
+
+# 確保模擬運行足夠長的時間
+MAX_SIM_STEPS = 100000
+
+# 【評估方式】常駐 SUMO (GA_PERSISTENT_SUMO，預設) / 每個個體重新啟動 / 子行程 (GA_SUBPROCESS_EVAL)，
+# 詳見下方的 evaluate_persistent 與 evaluate_subprocess
+GA_PERSISTENT_SUMO = os.environ.get("GA_PERSISTENT_SUMO", "1") == "1"
+GA_SUBPROCESS_EVAL = os.environ.get("GA_SUBPROCESS_EVAL", "0") == "1"
+if GA_SUBPROCESS_EVAL and WARM_START_STATE:
+    # 載入狀態檔會把號誌切回快照中的程式，附加檔的 ga_prog 不會生效
+    print("警告：GA_SUBPROCESS_EVAL 不支援暖機快照，改用 TraCI 評估。", flush=True)
+    GA_SUBPROCESS_EVAL = False
+# 不同方式算出的延遲可能略有差異 (見 bench_ga_eval.py)，快取情境依方式分開
+EVAL_MODE = "subprocess" if GA_SUBPROCESS_EVAL else ("persistent" if GA_PERSISTENT_SUMO else "traci")
+
+# 【適應度快取】基因空間只有 96 x 96 種組合，評估過的 (phase1, phase2, seed) 存在 SQLite，
+# 所有 worker 行程與之後的執行共用；情境雜湊涵蓋 sumocfg/路網/路線/附加檔、模擬參數、
+# 號誌相位字串、暖機快照、模擬長度與評估方式，任一項改變都不會讀到舊結果
+FITNESS_CACHE = FitnessCache(evaluation_context(
+    SUMO_CONFIG_FILE, SIM_OPTIONS,
+    extra=f"GA.py|{TRAFFIC_LIGHT_ID}|{GREEN1_STATE}|{YELLOW1_STATE}|{GREEN2_STATE}|{YELLOW2_STATE}"
+          f"|warm={GA_WARM_START}|steps={MAX_SIM_STEPS}|fitness=statistic-output|mode={EVAL_MODE}"))
+
+# 【多精度評估】GA_MULTI_FIDELITY=1 時子代先以較短的模擬 (GA_PROXY_STEPS 秒) 粗篩，
+# 只有代理分數最好的 GA_PROXY_TOP 比例才跑完整模擬；代理分數另存一個快取情境
+GA_MULTI_FIDELITY = os.environ.get("GA_MULTI_FIDELITY", "0") == "1"
+PROXY_STEPS = int(os.environ.get("GA_PROXY_STEPS", "1800"))
+PROXY_TOP_FRACTION = float(os.environ.get("GA_PROXY_TOP", "0.3"))
+PROXY_CACHE = FitnessCache(evaluation_context(
+    SUMO_CONFIG_FILE, SIM_OPTIONS,
+    extra=f"GA.py|{TRAFFIC_LIGHT_ID}|{GREEN1_STATE}|{YELLOW1_STATE}|{GREEN2_STATE}|{YELLOW2_STATE}"
+          f"|warm={GA_WARM_START}|steps={PROXY_STEPS}|fitness=statistic-output|mode={EVAL_MODE}"))
+
+def fidelity(proxy):
+    """(快取, 最多模擬秒數)：proxy=True 為短時間的代理評估"""
+    return (PROXY_CACHE, PROXY_STEPS) if proxy else (FITNESS_CACHE, MAX_SIM_STEPS)
+
+# 【串流適應度】不再寫出整份 tripinfo 再以 DOM 讀回：SUMO 在記憶體中累計每趟旅程，
+# 結束時只寫一個幾百位元組的 statistic-output (車輛數 x 平均 timeLoss = 總延遲)
+def get_total_delay(filename):
+    try:
+        return total_time_loss(filename)
+    except (FileNotFoundError, ET.ParseError, ValueError, KeyError) as e:
+        print(f"{os.getpid}: 警告：無法解析或讀取 '{filename}' (錯誤: {e}). 返回極大延遲作為懲罰。", file=sys.stderr)
+        return -1
+
+def sim_command(stats_path):
+    """評估用的 SUMO 指令 (種子、模擬參數、只寫統計檔的輸出設定、暖機快照)"""
+    cmd = [
         sumo_binary,
         "-c", SUMO_CONFIG_FILE,
-        "--time-to-teleport", "300",
         "--seed", str(sim_seed), # 【新增】加入隨機種子碼
-        
-        # 【新增：啟用子車道模型】
-        "--lateral-resolution", "0.05", # 設置橫向解析度 (例如：每 0.2m 一個子車道)
+        ] + SIM_OPTIONS + statistic_output_options(stats_path)
+    if WARM_START_STATE:
+        cmd += ["--load-state", WARM_START_STATE]
+    return cmd
+
+def candidate_phases(individual):
+    """個體對應的固定時制相位 [(秒數, 號誌字串), ...]"""
+    return [
+        # Phase 0: 第一個主幹道方向綠燈
+        (individual[0], GREEN1_STATE),
+        # Phase 1: 黃燈
+        (1, YELLOW1_STATE),
+        # Phase 2: 第二個方向綠燈
+        (individual[1], GREEN2_STATE),
+        # Phase 3: 黃燈
+        (3, YELLOW2_STATE),
+    ]
+
+# 【提前終止】每隔幾秒檢查一次已完成旅程的延遲
+BOUND_CHECK_INTERVAL = 60
+
+def run_candidate(individual, bound=None, baseline=0.0, max_steps=MAX_SIM_STEPS):
+    """
+    在已啟動的模擬上套用個體的固定時制並跑到結束。
+    bound 不為 None 時每 BOUND_CHECK_INTERVAL 步檢查已完成旅程的延遲 (扣掉 baseline)：
+    timeLoss 只增不減，超過 bound 時最終延遲必定更大，直接停止並回傳這個部分延遲；
+    迴圈結束後再檢查一次 (最後一次檢查之後才超過的也算)。沒有超過時回傳 None。
+    """
+    # --- 建立時相邏輯 (固定時制，type=0) ---
+    SUMO.set_program(TRAFFIC_LIGHT_ID, "ga_prog", candidate_phases(individual))
     
-    "--tripinfo-output", TRIPINFO_OUTPUT_PATH
-]
+    step = 0
+    while step < max_steps and SUMO.simulation.getMinExpectedNumber() > 0:
+        SUMO.simulationStep()
+        step += 1
+        if bound is not None and step % BOUND_CHECK_INTERVAL == 0:
+            partial = trip_time_loss_so_far(SUMO) - baseline
+            if partial > bound:
+                return partial
+    if bound is not None:
+        partial = trip_time_loss_so_far(SUMO) - baseline
+        if partial > bound:
+            return partial
+    return None
 
-def get_total_delay(filename):
+# 【常駐 SUMO】GA_PERSISTENT_SUMO=1 (預設) 時每個 worker 行程只啟動一次 SUMO，
+# 之後每個個體以 simulation.load 在同一個行程內重新載入模擬 (不必重啟行程與 libsumo/TraCI 連線)。
+# 不用 saveState/loadState 回到 t=0：實測 SUMO 1.28 載入狀態後路線檔的車輛不會重新載入，
+# 每次重設後的車輛數越來越少，評估結果會依評估順序而變
+GA_WORK_DIR = os.path.join(".cache", "ga_work") # 子行程評估的暫存檔
+_worker_started = False
+_worker_fresh = False # 剛啟動或剛重新載入、還沒跑過任何個體
+
+def init_worker():
+    """ProcessPoolExecutor 的 initializer：啟動這個 worker 的 SUMO"""
+    global _worker_started, _worker_fresh
+    pid = os.getpid()
     try:
-        tree = ET.parse(filename)
-        root = tree.getroot()
-    except (FileNotFoundError, ET.ParseError) as e:
-        print(f"{os.getpid}: 警告：無法解析或讀取 '{filename}' (錯誤: {e}). 返回極大延遲作為懲罰。", file=sys.stderr)
-        return -1
-        
-    total_waiting_time = 0.0
-    for trip in root.findall("tripinfo"):
-        if "timeLoss" in trip.attrib:
-            timeLoss = float(trip.attrib["timeLoss"])
-            total_waiting_time += timeLoss
-    return total_waiting_time
+        # 模擬不關閉，statistic-output 不會寫出；延遲改由 TraCI 的旅程統計累計值相減
+        SUMO.start(sim_command(os.devnull), label=f"GA_TL_{pid}")
+        _worker_started = _worker_fresh = True
+        print(f"{pid}: 常駐 SUMO 已啟動 ({SUMO.name})", flush=True)
+    except Exception as e:
+        # initializer 拋出例外會讓整個 ProcessPoolExecutor 失效，這裡只記錄，評估時再重試
+        print(f"{pid}: 常駐 SUMO 啟動失敗: {e}", flush=True)
+        close_worker()
+
+def close_worker():
+    global _worker_started, _worker_fresh
+    _worker_started = _worker_fresh = False
+    try:
+        SUMO.close()
+    except Exception:
+        pass
+
+def evaluate_persistent(individual, bound=None, proxy=False):
+    """在常駐的模擬上評估：重新載入 → 套用時制 → 跑完，延遲為旅程統計的增量"""
+    global _worker_fresh
+    if not _worker_started:
+        init_worker() # 上一次評估出錯時重新啟動
+        if not _worker_started:
+            return -1, False
+    try:
+        if not _worker_fresh:
+            SUMO.load(sim_command(os.devnull)[1:])
+        _worker_fresh = False
+        before = trip_time_loss_so_far(SUMO)
+        cache, max_steps = fidelity(proxy)
+        partial = run_candidate(individual, bound, before, max_steps)
+        if partial is not None:
+            return partial, True
+        delay = trip_time_loss_so_far(SUMO) - before
+        cache.put(individual, delay, sim_seed)
+        return delay, False
+    except SUMO.TraCIException as e:
+        print(f"TraCIException ({SUMO.name}): {e}", flush=True)
+    except Exception as e_general:
+        print(f"Exception error: {e_general}", flush=True)
+    # 模擬狀態不確定，關掉讓下一個個體重新啟動
+    close_worker()
+    return -1, False
+
+# 【子行程評估】GA_SUBPROCESS_EVAL=1 時不使用 TraCI：個體的號誌程式寫成 tlLogic 附加檔，
+# 直接執行 sumo 跑完整場模擬 (沒有逐步的 socket 往返)，再讀 statistic-output
+def evaluate_subprocess(individual, proxy=False):
+    cache, max_steps = fidelity(proxy)
+    work_prefix = os.path.join(GA_WORK_DIR, f"eval_{GA_INSTANCE_ID}_PID{os.getpid()}")
+    try:
+        os.makedirs(GA_WORK_DIR, exist_ok=True)
+        delay = run_fixed_time(SUMO_CONFIG_FILE, TRAFFIC_LIGHT_ID, candidate_phases(individual), work_prefix,
+                               seed=sim_seed, sim_options=SIM_OPTIONS,
+                               max_steps=max_steps, sumo_binary=sumo_binary)
+    except Exception as e:
+        print(f"子行程評估失敗: {e}", flush=True)
+        return (-1,)
+    cache.put(individual, delay, sim_seed)
+    return delay,
 
 # 【修正：將 evaluate 函數的 tripinfo 檔案名改為動態，以支援並行】
 def evaluate(individual):
-    # 【關鍵修正 3】：使用 Process ID 來創建獨立的 tripinfo 檔案和 TraCI label
+    return evaluate_bounded(individual)[0],
+
+def evaluate_bounded(individual, bound=None, proxy=False):
+    """
+    回傳 (延遲, 是否提前停止)。bound 為 GA 主程式給的界限 (本代最差的適應度)；
+    提前停止時延遲是已完成旅程的部分延遲 (真實值的下界)，不寫入快取。
+    子行程評估沒有逐步迴圈，不會提前停止。proxy=True 時只模擬 PROXY_STEPS 秒。
+    """
+    # 【關鍵修正 3】：使用 Process ID 來創建獨立的統計檔案和 TraCI label
     pid = os.getpid()
-    
+
+    # 先查快取，評估過的組合不再跑模擬
+    cache, max_steps = fidelity(proxy)
+    cached = cache.get(individual, sim_seed)
+    if cached is not None:
+        return cached, False
+
+    if GA_SUBPROCESS_EVAL:
+        return evaluate_subprocess(individual, proxy)[0], False
+    if GA_PERSISTENT_SUMO:
+        return evaluate_persistent(individual, bound, proxy)
+
     # 確保每個進程的輸出檔案和 TraCI 連線名稱都是唯一的
-    unique_tripinfo = f"tripinfo_{GA_INSTANCE_ID}_PID{pid}.xml"
-    unique_sumo_cmd = [
-        sumo_binary,
-        "-c", SUMO_CONFIG_FILE,
-        "--time-to-teleport", "300",
-        "--seed", str(sim_seed), # 【新增】加入隨機種子碼
-        
-        # 【新增：啟用子車道模型】
-        "--lateral-resolution", "0.05", # 設置橫向解析度 (例如：每 0.2m 一個子車道)
-    
-        "--tripinfo-output", unique_tripinfo
-        ]
+    unique_stats = f"stats_{GA_INSTANCE_ID}_PID{pid}.xml"
 
     try:
-        # 使用唯一的 label 啟動 TraCI
-        traci.start(unique_sumo_cmd, label=f"GA_TL_{pid}") 
-
-        # --- 建立時相邏輯 ---
-        # --- 修正後的時相邏輯 ---
-        logic = Logic(
-            programID="ga_prog",
-            phases=[            
-                # Phase 0: 讓信號組 0-7 綠燈 (包含 tl-index 4)
-                Phase(individual[0], 'G' * 8 + 'r' * 8),
-                # Phase 1: 黃燈
-                Phase(1, 'y' * 8 + 'r' * 8),
-                # Phase 2: 讓信號組 8-15 綠燈
-                Phase(individual[1], 'r' * 8 + 'G' * 8), 
-                # Phase 3: 黃燈
-                Phase(3, 'r' * 8 + 'y' * 8) 
-            ],
-            type=0,
-            currentPhaseIndex=0
-        )
-        traci.trafficlight.setProgramLogic(TRAFFIC_LIGHT_ID, logic)
-        traci.trafficlight.setProgram(TRAFFIC_LIGHT_ID, logic.programID)
-        traci.trafficlight.setPhase(TRAFFIC_LIGHT_ID, 0)
-        
-        # 確保模擬運行足夠長的時間
-        MAX_SIM_STEPS = 100000
-        step = 0
-        while step < MAX_SIM_STEPS and traci.simulation.getMinExpectedNumber() > 0:
-            traci.simulationStep()
-            step += 1
-        
+        # 使用唯一的 label 啟動 (traci 時才需要 label)
+        SUMO.start(sim_command(unique_stats), label=f"GA_TL_{pid}")
+        partial = run_candidate(individual, bound, max_steps=max_steps)
+        if partial is not None:
+            return partial, True
+
+        # statistic-output 在模擬關閉時才寫出
+        SUMO.close()
+
         # 獲取總延遲
         try:
-            delay = get_total_delay(unique_tripinfo) 
-            return delay,
+            delay = get_total_delay(unique_stats) 
+            cache.put(individual, delay, sim_seed) # 失敗 (-1) 不會寫入
+            return delay, False
         except Exception as xml_e:
             print(f"xlm_e error: {xml_e}", flush=True)
-            return (-1,) 
+            return -1, False
             
-    except traci.TraCIException as e:
-        print(f"traci.TraCIException : {e}", flush=True)
-        return (-1,) 
+    except SUMO.TraCIException as e:
+        print(f"TraCIException ({SUMO.name}): {e}", flush=True)
+        return -1, False
     except Exception as e_general:
         print(f"Exception error: {e_general}", flush=True)
-        return (-1,) 
+        return -1, False
     finally:
         try:
-             traci.close()
-             # 模擬結束後刪除臨時 tripinfo 檔案
-             if os.path.exists(unique_tripinfo):
-                 os.remove(unique_tripinfo)
+             SUMO.close()
+             # 模擬結束後刪除臨時統計檔案
+             if os.path.exists(unique_stats):
+                 os.remove(unique_stats)
         except Exception:
              pass
 
@@ -160,116 +304,248 @@ toolbox.register("mutate", tools.mutUniformInt, low=TIME_MIN, up=TIME_MAX, indpb
 toolbox.register("select", tools.selTournament, tournsize=3)
 
 
-# --- 執行 GA 訓練 (使用 ProcessPoolExecutor) ---
-pop = toolbox.population(n=POP_SIZE)
-first_values = 0
+# 【提前終止】GA_PRUNE=1 (預設) 時，子代的部分延遲一超過本代族群中最差的適應度就停止模擬
+GA_PRUNE = os.environ.get("GA_PRUNE", "1") == "1"
 
-print(f"{os.getpid}: \n🔁 開始進行 GA 訓練...\n",flush=True)
+# 評估失敗的個體 (評估函式回傳 -1)：FitnessMin 之下 -1 會變成最好的分數，改給一個一定最差的值
+FAILED_FITNESS = float("inf")
 
-# 【關鍵修正 1】：將 ProcessPoolExecutor 放在最外層
-with concurrent.futures.ProcessPoolExecutor() as executor:
-    
-    # 【關鍵修正 2】：使用 executor.map 評估初始族群，並統一賦值
-    print(f"\n🔁 開始評估初始群體 (Generation 0)，共 {POP_SIZE} 個體 (多核心加速中...)\n" ,flush=True)
-    
-    # 這裡的 map 是並行的，但結果是按順序返回的
-    fitnesses = list(executor.map(toolbox.evaluate, pop))
-    
-    # 將適應度賦值給個體
-    for ind, fit in zip(pop, fitnesses):
-        ind.fitness.values = fit
-        
-    print(f"✅ Gen 0 初始群體評估完成！\n", flush=True)
-
-    # --- 主世代迴圈 ---
-    for gen in range(GEN_NUM):
-        offspring = toolbox.select(pop, len(pop))
-        offspring = list(map(toolbox.clone, offspring))
-
-        # 交配、突變 (保持不變)
-        for child1, child2 in zip(offspring[::2], offspring[1::2]):
-            if random.random() < 0.8:   
-                toolbox.mate(child1, child2)
-                del child1.fitness.values
-                del child2.fitness.values
-        for mutant in offspring:
-            if random.random() < 0.9:
-                toolbox.mutate(mutant)
-                del mutant.fitness.values
-
-        # 計算新的適應度 (使用多核心)
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        print(f"🔄 第 {gen+1} 代：開始評估 {len(invalid_ind)} 個新個體 (多核心加速中...)", flush=True)
-        
-        # 【關鍵修正 2 續】：使用 executor.map 進行多核心評估
-        new_fitnesses = list(executor.map(toolbox.evaluate, invalid_ind))
-        
-        for ind, fit in zip(invalid_ind, new_fitnesses):
+# 提前停止的個體：部分延遲只是真實值的下界，可能比快取中其他世代的完整延遲還小；
+# 適應度改為 PRUNED_FITNESS_BASE + 部分延遲，排在所有完整評估之後 (彼此仍依部分延遲排序)，但在失敗之前
+PRUNED_FITNESS_BASE = 1e15
+
+# 多精度評估中沒有晉級的個體：只有短時間的代理延遲，與完整延遲不同尺度，不能直接比較；
+# 適應度改為 UNPROMOTED_FITNESS_BASE + 代理延遲，排在所有完整評估與提前停止的個體之後 (彼此依代理延遲排序)
+UNPROMOTED_FITNESS_BASE = 2e15
+
+def pruned_fitness(partial):
+    return PRUNED_FITNESS_BASE + partial
+
+def bounded_fitness(delay, pruned):
+    """evaluate_bounded 的 (延遲, 是否提前停止) 對應到適應度：失敗 → FAILED_FITNESS，提前停止 → pruned_fitness"""
+    if delay < 0:
+        return FAILED_FITNESS
+    return pruned_fitness(delay) if pruned else delay
+
+def unpromoted_fitness(proxy_delay):
+    return UNPROMOTED_FITNESS_BASE + proxy_delay
+
+def is_full_fitness(value):
+    """完整評估的有效延遲 (不是失敗也不是提前停止)"""
+    return 0 <= value < PRUNED_FITNESS_BASE
+
+def generation_bound(population):
+    """本代的剪枝界限：目前族群中最差 (最大) 的完整適應度；失敗與提前停止的個體不算，沒有有效值時不剪枝"""
+    values = [ind.fitness.values[0] for ind in population
+              if ind.fitness.valid and is_full_fitness(ind.fitness.values[0])]
+    return max(values) if values else None
+
+def map_with_bound(executor, todo, bound, prune_stats):
+    """
+    以 evaluate_bounded 平行評估，把提前停止的數量記在 prune_stats，回傳 [(適應度,), ...]；
+    提前停止與失敗的個體依 bounded_fitness 排在所有完整評估之後
+    """
+    results = list(executor.map(evaluate_bounded, todo, [bound] * len(todo)))
+    prune_stats["bound"] = bound
+    prune_stats["evaluated"] = len(results)
+    prune_stats["flags"] = [pruned for _, pruned in results]
+    prune_stats["pruned"] = sum(prune_stats["flags"])
+    return [(bounded_fitness(delay, pruned),) for delay, pruned in results]
+
+def format_prune_stats(prune_stats):
+    if prune_stats.get("bound") is None:
+        return "提前終止：本代沒有界限"
+    return (f"提前終止：{prune_stats['pruned']}/{prune_stats['evaluated']} 個個體的部分延遲超過 "
+            f"{prune_stats['bound']:.2f} 秒")
+
+def map_multi_fidelity(executor, todo, bound, prune_stats, fidelity_stats):
+    """
+    兩階段評估：全部先跑代理評估，代理分數最好的 PROXY_TOP_FRACTION 再跑完整模擬
+    (可被 bound 提前終止)。適應度分成幾個不重疊的區段，區段之間一定依下列順序排列，區段內才比較延遲：
+    完整延遲 < pruned_fitness(部分延遲) < unpromoted_fitness(代理延遲) < FAILED_FITNESS。
+    沒有晉級的個體因此排在所有完整評估之後 (包含快取中其他世代的結果)，且不寫入完整評估的快取。
+    """
+    proxy_scores = [delay for delay, _ in executor.map(evaluate_bounded, todo, [None] * len(todo),
+                                                       [True] * len(todo))]
+    # 失敗的代理評估 (-1) 排在最後
+    ranked = sorted(range(len(todo)), key=lambda i: (proxy_scores[i] < 0, proxy_scores[i]))
+    top = ranked[:max(1, int(round(len(todo) * PROXY_TOP_FRACTION)))] if todo else []
+    full_fits = map_with_bound(executor, [todo[i] for i in top], bound, prune_stats)
+    full = {i: fit[0] for i, fit in zip(top, full_fits)}
+
+    results = []
+    for i in range(len(todo)):
+        if i in full:
+            results.append((full[i],))
+        elif proxy_scores[i] < 0:
+            results.append((FAILED_FITNESS,))
+        else:
+            results.append((unpromoted_fitness(proxy_scores[i]),))
+
+    # 代理分數與完整分數的等級相關：只有晉級者有完整分數，因此只用兩者都成功、且沒有提前終止的晉級者；
+    # 晉級者是代理分數最好的一段，相關係數衡量的是這一段內的排名一致性
+    pairs = [(proxy_scores[i], full[i]) for i in top
+             if proxy_scores[i] >= 0 and is_full_fitness(full[i])]
+    fidelity_stats["proxy"] = len(todo)
+    fidelity_stats["full"] = len(top)
+    fidelity_stats["pairs"] = len(pairs)
+    fidelity_stats["spearman"] = spearman([p for p, _ in pairs], [f for _, f in pairs])
+    return results
+
+def format_fidelity_stats(fidelity_stats):
+    rho = fidelity_stats.get("spearman")
+    rho_text = "無法計算" if rho is None else f"{rho:.3f}"
+    return (f"多精度評估：{fidelity_stats.get('proxy', 0)} 個代理評估 ({PROXY_STEPS} 秒)，"
+            f"{fidelity_stats.get('full', 0)} 個完整模擬，晉級者的等級相關 (Spearman, {fidelity_stats.get('pairs', 0)} 組) = {rho_text}")
+
+def evaluate_offspring(executor, todo, bound, prune_stats, fidelity_stats):
+    if GA_MULTI_FIDELITY:
+        return map_multi_fidelity(executor, todo, bound, prune_stats, fidelity_stats)
+    return map_with_bound(executor, todo, bound, prune_stats)
+
+# --- 主程式 ---
+# ProcessPoolExecutor 的 worker 會 import 這個模組 (spawn 時重新執行模組層級的程式)，
+# 上面只放設定與評估函式；開檔、GA 迴圈與通知都在 main() 裡，只在直接執行時跑一次
+def main():
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
+    filename = rf"./GA_{GA_INSTANCE_ID}__{timestamp}.csv"
+
+    csv_file = open(file=filename, mode="w", newline="", encoding="utf-8")
+    csv_writer = csv.writer(csv_file)
+    csv_writer.writerow(["generation", "phase1", "phase2", "delay"])
+
+    # --- 執行 GA 訓練 (使用 ProcessPoolExecutor) ---
+    pop = toolbox.population(n=POP_SIZE)
+    first_values = 0
+
+    print(f"{os.getpid}: \n🔁 開始進行 GA 訓練...\n",flush=True)
+
+    # 【關鍵修正 1】：將 ProcessPoolExecutor 放在最外層
+    # 常駐模式下每個 worker 啟動時先開好自己的 SUMO
+    with concurrent.futures.ProcessPoolExecutor(initializer=init_worker if GA_PERSISTENT_SUMO and not GA_SUBPROCESS_EVAL else None) as executor:
+
+        # 【關鍵修正 2】：使用 executor.map 評估初始族群，並統一賦值
+        print(f"\n🔁 開始評估初始群體 (Generation 0)，共 {POP_SIZE} 個體 (多核心加速中...)\n" ,flush=True)
+
+        # 這裡的 map 是並行的，但結果是按順序返回的
+        # 先查快取並合併重複基因，只有沒評估過的組合才交給 worker
+        prune_stats, fidelity_stats = {}, {}
+        fitnesses, cache_stats = evaluate_with_cache(
+            pop, lambda todo: evaluate_offspring(executor, todo, None, prune_stats, fidelity_stats), FITNESS_CACHE, sim_seed)
+
+        # 將適應度賦值給個體
+        for ind, fit in zip(pop, fitnesses):
             ind.fitness.values = fit
 
-        pop[:] = offspring
+        print(f"✅ Gen 0 初始群體評估完成！{format_cache_stats(cache_stats)}", flush=True)
+        if GA_MULTI_FIDELITY:
+            print(f"   {format_fidelity_stats(fidelity_stats)}", flush=True)
+        print(flush=True)
 
-        best = tools.selBest(pop, 1)[0]
+        # --- 主世代迴圈 ---
+        for gen in range(GEN_NUM):
+            offspring = toolbox.select(pop, len(pop))
+            offspring = list(map(toolbox.clone, offspring))
 
-        if gen == 0:
-            first_values = best.fitness.values[0]
+            # 交配、突變 (保持不變)
+            for child1, child2 in zip(offspring[::2], offspring[1::2]):
+                if random.random() < 0.8:   
+                    toolbox.mate(child1, child2)
+                    del child1.fitness.values
+                    del child2.fitness.values
+            for mutant in offspring:
+                if random.random() < 0.9:
+                    toolbox.mutate(mutant)
+                    del mutant.fitness.values
 
-        print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒",flush=True)
+            # 計算新的適應度 (使用多核心)
+            invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
+            print(f"🔄 第 {gen+1} 代：開始評估 {len(invalid_ind)} 個新個體 (多核心加速中...)", flush=True)
 
-        # 1. 寫入【完整日誌檔】
-        csv_writer.writerow([gen + 1, best[0], best[1], f"{best.fitness.values[0]:.2f}"])
-        csv_file.flush()
+            # 【關鍵修正 2 續】：使用 executor.map 進行多核心評估
+            # 提前停止的個體適應度為 pruned_fitness(部分延遲)，排在所有完整評估之後，且不寫入快取
+            bound = generation_bound(pop) if GA_PRUNE else None
+            prune_stats, fidelity_stats = {}, {}
+            new_fitnesses, cache_stats = evaluate_with_cache(
+                invalid_ind, lambda todo: evaluate_offspring(executor, todo, bound, prune_stats, fidelity_stats),
+                FITNESS_CACHE, sim_seed)
+            print(f"   {format_cache_stats(cache_stats)}", flush=True)
+            if GA_PRUNE:
+                print(f"   {format_prune_stats(prune_stats)}", flush=True)
+            if GA_MULTI_FIDELITY:
+                print(f"   {format_fidelity_stats(fidelity_stats)}", flush=True)
 
-        # 2. 【即時更新】固定名稱結果檔 (確保中斷也能拿到最好結果)
-        FINAL_RESULT_FILENAME = "./GA_best_result.csv" 
-        try:
-            with open(FINAL_RESULT_FILENAME, mode="w", newline="", encoding="utf-8") as final_f:
-                final_writer = csv.writer(final_f)
-                final_writer.writerow(["generation", "phase1", "phase2", "delay"])
-                final_writer.writerow([
-                    gen + 1, 
-                    best[0], 
-                    best[1], 
-                    f"{best.fitness.values[0]:.2f}"
-                ])
-        except Exception as e:
-            print(f"警告：無法寫入最終 GA 結果檔案: {e}")
-
-# --- 輸出最終最佳解 ---
-final_best = tools.selBest(pop, 1)[0]
-print("\n✅ 訓練完成！")
-# ... (後續的輸出和通知邏輯保持不變) ...
-# --- 輸出最終最佳解 ---
-final_best = tools.selBest(pop, 1)[0]
-print("\n✅ 訓練完成！")
-print(f"最佳紅綠燈時間組合為：{final_best}")
-print(f"總等待時間：{final_best.fitness.values[0]:.2f} 秒")
-print(f"第一代等待時間：{first_values:.2f} 秒")
-# 【新增：將最終最佳解寫入固定名稱檔案】
-FINAL_RESULT_FILENAME = "./GA_best_result.csv" 
-
-try:
-    with open(FINAL_RESULT_FILENAME, mode="w", newline="", encoding="utf-8") as final_f:
-        final_writer = csv.writer(final_f)
-        # 僅寫入標頭和最佳結果
-        final_writer.writerow(["generation", "phase1", "phase2", "delay"])
-        final_writer.writerow([
-            GEN_NUM, 
-            final_best[0], 
-            final_best[1], 
-            f"{final_best.fitness.values[0]:.2f}"
-        ])
-    print(f"📄 已將最終最佳解寫入固定檔案 {FINAL_RESULT_FILENAME}")
-except Exception as e:
-    print(f"警告：無法寫入最終 GA 結果檔案: {e}")
-
-    notification.notify(
-    title = "Python GA Trainning Finish",
-    message = f"RUN PID: {os.getpid()} , MODEL ID= GA {timestamp}" ,
-        
-    # displaying time
-    timeout=10 # seconds
-)
-# 關閉 csv 檔
-csv_file.close()
-print(f"\n📄 已將所有結果寫入 {filename}")
\ No newline at end of file
+            for ind, fit in zip(invalid_ind, new_fitnesses):
+                ind.fitness.values = fit
+
+            pop[:] = offspring
+
+            best = tools.selBest(pop, 1)[0]
+
+            if gen == 0:
+                first_values = best.fitness.values[0]
+
+            print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒",flush=True)
+
+            # 1. 寫入【完整日誌檔】
+            csv_writer.writerow([gen + 1, best[0], best[1], f"{best.fitness.values[0]:.2f}"])
+            csv_file.flush()
+
+            # 2. 【即時更新】固定名稱結果檔 (確保中斷也能拿到最好結果)
+            FINAL_RESULT_FILENAME = "./GA_best_result.csv" 
+            try:
+                with open(FINAL_RESULT_FILENAME, mode="w", newline="", encoding="utf-8") as final_f:
+                    final_writer = csv.writer(final_f)
+                    final_writer.writerow(["generation", "phase1", "phase2", "delay"])
+                    final_writer.writerow([
+                        gen + 1, 
+                        best[0], 
+                        best[1], 
+                        f"{best.fitness.values[0]:.2f}"
+                    ])
+            except Exception as e:
+                print(f"警告：無法寫入最終 GA 結果檔案: {e}")
+
+    # --- 輸出最終最佳解 ---
+    final_best = tools.selBest(pop, 1)[0]
+    print("\n✅ 訓練完成！")
+    # ... (後續的輸出和通知邏輯保持不變) ...
+    # --- 輸出最終最佳解 ---
+    final_best = tools.selBest(pop, 1)[0]
+    print("\n✅ 訓練完成！")
+    print(f"最佳紅綠燈時間組合為：{final_best}")
+    print(f"總等待時間：{final_best.fitness.values[0]:.2f} 秒")
+    print(f"第一代等待時間：{first_values:.2f} 秒")
+    # 【新增：將最終最佳解寫入固定名稱檔案】
+    FINAL_RESULT_FILENAME = "./GA_best_result.csv" 
+
+    try:
+        with open(FINAL_RESULT_FILENAME, mode="w", newline="", encoding="utf-8") as final_f:
+            final_writer = csv.writer(final_f)
+            # 僅寫入標頭和最佳結果
+            final_writer.writerow(["generation", "phase1", "phase2", "delay"])
+            final_writer.writerow([
+                GEN_NUM, 
+                final_best[0], 
+                final_best[1], 
+                f"{final_best.fitness.values[0]:.2f}"
+            ])
+        print(f"📄 已將最終最佳解寫入固定檔案 {FINAL_RESULT_FILENAME}")
+    except Exception as e:
+        print(f"警告：無法寫入最終 GA 結果檔案: {e}")
+
+        notification.notify(
+        title = "Python GA Trainning Finish",
+        message = f"RUN PID: {os.getpid()} , MODEL ID= GA {timestamp}" ,
+
+        # displaying time
+        timeout=10 # seconds
+    )
+    # 關閉 csv 檔
+    csv_file.close()
+    print(f"\n📄 已將所有結果寫入 {filename}")
+
+
+if __name__ == "__main__":
+    main()
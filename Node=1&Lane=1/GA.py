@@ -1,9 +1,8 @@
 import traci
 from traci._trafficlight import Logic, Phase
 
-import xml.etree.ElementTree as ET
-
 import os
+import sys
 
 from deap import base, creator, tools
 import random
@@ -11,6 +10,11 @@ import random
 import csv
 import datetime
 
+# 共用上層目錄的適應度快取模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fitness_cache import FitnessCache, evaluation_context, evaluate_with_cache, format_cache_stats
+from sim_fitness import total_time_loss_from_tripinfo
+
 # 存入當下的時間
 now = datetime.datetime.now()
 timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
@@ -24,19 +28,37 @@ csv_writer.writerow(["generation", "phase1", "phase2", "delay"])
 # 啟動 SUMO 模擬（用 sumo-gui 可視化，或 sumo 為命令列）
 sumoCmd = ["sumo", "-c", "test.sumocfg"]
 
+# 確保模擬運行足夠長的時間來評估這個固定時相
+SIM_TIME = 3600 # 運行 1 小時，或隊友設定的時長
+
+# 個體 [phase1, phase2] 對應的時相 [(秒數, 號誌字串), ...]
+def program_phases(green1, green2):
+    return [
+        (3, 'G' * 4 + 'y' * 4),    # 黃燈 3s
+        (green1, 'G' * 4 + 'g' * 4), # Phase 0 (主幹道綠燈)
+        (3, 'y' * 4 + 'G' * 4),    # 黃燈 3s
+        (green2, 'g' * 4 + 'G' * 4), # Phase 2 (次幹道綠燈)
+    ]
+
+# 【適應度快取】評估過的 (phase1, phase2) 存在 SQLite，之後的世代與執行直接讀取；
+# 沒有指定 --seed (SUMO 預設種子)，seed 欄位存 -1。情境鍵由實際使用的時相與模擬長度產生
+FITNESS_CACHE = FitnessCache(evaluation_context(
+    "test.sumocfg", sumoCmd[3:],
+    extra=f"GA.py|SIM_TIME={SIM_TIME}|" + "|".join(f"{d}:{s}" for d, s in program_phases("phase1", "phase2"))))
+
 # 取得總等待時間
 def get_total_delay(filename="tripinfo.xml"):
-    tree = ET.parse(filename)                       # 載入整個 XML 樹狀結構
-    root = tree.getroot()                           # 取得 XML 的根元素（整個 <tripinfos> 標籤）
-    total_waiting_time = 0.0
-    for trip in root.findall("tripinfo"):           # 對每一個 <tripinfo> 標籤（代表一輛車）進行迴圈
-        timeLoss = float(trip.attrib["timeLoss"])   # 從 <tripinfo> 的 timeLoss 屬性抓出來（是字串），轉成 float。
-        total_waiting_time += timeLoss
-    return total_waiting_time
+    # 以 iterparse 逐筆讀取 <tripinfo> 並加總 timeLoss，讀完就清掉，不在記憶體中建整棵樹
+    return total_time_loss_from_tripinfo(filename)
 
 # context: GA.py 檔案中
 
 def evaluate(individual):
+    # 先查快取，評估過的組合不再跑模擬
+    cached = FITNESS_CACHE.get(individual)
+    if cached is not None:
+        return cached,
+
     # 載入當前 SUMO 環境
     # 這裡的 os.environ 設置應放在 GA.py 的開頭，確保 traci 正常工作
     # (如果 traci 已經能用，這行就不是必要的)
@@ -48,12 +70,7 @@ def evaluate(individual):
     # 建立新的時相邏輯
     logic = Logic(
         programID="ga_prog",
-        phases=[
-            Phase(3, 'G' * 4 + 'y' * 4),    # 黃燈 3s
-            Phase(individual[0], 'G' * 4 + 'g' * 4), # Phase 0 (主幹道綠燈)
-            Phase(3, 'y' * 4 + 'G' * 4),    # 黃燈 3s
-            Phase(individual[1], 'g' * 4 + 'G' * 4), # Phase 2 (次幹道綠燈)
-        ],
+        phases=[Phase(duration, state) for duration, state in program_phases(individual[0], individual[1])],
         type="static",
         currentPhaseIndex=0
     )
@@ -63,8 +80,6 @@ def evaluate(individual):
     traci.trafficlight.setProgram(TRAFFIC_LIGHT_ID, logic.programID) 
     traci.trafficlight.setPhase(TRAFFIC_LIGHT_ID, 0)
     
-    # 確保模擬運行足夠長的時間來評估這個固定時相
-    SIM_TIME = 3600 # 運行 1 小時，或隊友設定的時長
     for step in range(SIM_TIME):
         traci.simulationStep()
 
@@ -72,6 +87,7 @@ def evaluate(individual):
     delay = get_total_delay("tripinfo.xml")
 
     traci.close()
+    FITNESS_CACHE.put(individual, delay)
     return delay, # 必須回傳一個 tuple
 
 
@@ -96,7 +112,8 @@ toolbox.register("select", tools.selTournament, tournsize=3)
 
 # --- 執行 GA 訓練 ---
 pop = toolbox.population(n=POP_SIZE)
-fitnesses = list(map(toolbox.evaluate, pop))
+fitnesses, cache_stats = evaluate_with_cache(pop, lambda todo: map(toolbox.evaluate, todo), FITNESS_CACHE)
+print(f"初始群體 {format_cache_stats(cache_stats)}")
 for ind, fit in zip(pop, fitnesses):
     ind.fitness.values = fit
 first_values = 0
@@ -121,7 +138,7 @@ for gen in range(GEN_NUM):
 
     # 計算新的適應度
     invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-    fitnesses = list(map(toolbox.evaluate, invalid_ind))
+    fitnesses, cache_stats = evaluate_with_cache(invalid_ind, lambda todo: map(toolbox.evaluate, todo), FITNESS_CACHE)
     for ind, fit in zip(invalid_ind, fitnesses):
         ind.fitness.values = fit
 
@@ -132,7 +149,7 @@ for gen in range(GEN_NUM):
     if gen == 0:
         first_values = best.fitness.values[0]
 
-    print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒")
+    print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒 | {format_cache_stats(cache_stats)}")
 
     # 將 ["generation", "phase1", "phase2", "delay"] 存入csv
     csv_writer.writerow([gen + 1, best[0], best[1], f"{best.fitness.values[0]:.2f}"])
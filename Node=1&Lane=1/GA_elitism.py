@@ -1,9 +1,8 @@
 import traci
 from traci._trafficlight import Logic, Phase
 
-import xml.etree.ElementTree as ET
-
 import os
+import sys
 
 from deap import base, creator, tools
 import random
@@ -11,6 +10,11 @@ import random
 import csv
 import datetime
 
+# 共用上層目錄的適應度快取模組
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fitness_cache import FitnessCache, evaluation_context, evaluate_with_cache, format_cache_stats
+from sim_fitness import total_time_loss_from_tripinfo
+
 # 存入當下的時間
 now = datetime.datetime.now()
 timestamp = now.strftime("%Y-%m-%d_%H-%M-%S")
@@ -24,21 +28,39 @@ csv_writer.writerow(["generation", "phase1", "phase2", "delay"])
 # 啟動 SUMO 模擬（用 sumo-gui 可視化，或 sumo 為命令列）
 sumoCmd = ["sumo", "-c", "test.sumocfg"]
 
+# 每個個體模擬的步數
+SIM_STEPS = 500
+
+# 個體 [phase1, phase2] 對應的時相 [(秒數, 號誌字串), ...]
+def program_phases(phase1, phase2):
+    return [
+        (phase1, "GGgrrrGGgrrr"),
+        (5, "yyyrrryyyrrr"),
+        (phase2, "rrrGGgrrrGGg"),
+        (5, "rrryyyrrryyy"),
+    ]
+
+# 【適應度快取】評估過的 (phase1, phase2) 存在 SQLite，之後的世代與執行直接讀取；
+# 沒有指定 --seed (SUMO 預設種子)，seed 欄位存 -1。情境鍵由實際使用的時相與模擬長度產生
+FITNESS_CACHE = FitnessCache(evaluation_context(
+    "test.sumocfg", sumoCmd[3:],
+    extra=f"GA_elitism.py|steps={SIM_STEPS}|" + "|".join(f"{d}:{s}" for d, s in program_phases("phase1", "phase2"))))
+
 # 取得總等待時間
 def get_total_delay(filename="tripinfo.xml"):
-    tree = ET.parse(filename)                       # 載入整個 XML 樹狀結構
-    root = tree.getroot()                           # 取得 XML 的根元素（整個 <tripinfos> 標籤）
-    total_waiting_time = 0.0
-    for trip in root.findall("tripinfo"):           # 對每一個 <tripinfo> 標籤（代表一輛車）進行迴圈
-        timeLoss = float(trip.attrib["timeLoss"])   # 從 <tripinfo> 的 timeLoss 屬性抓出來（是字串），轉成 float。
-        total_waiting_time += timeLoss
-    return total_waiting_time
+    # 以 iterparse 逐筆讀取 <tripinfo> 並加總 timeLoss，讀完就清掉，不在記憶體中建整棵樹
+    return total_time_loss_from_tripinfo(filename)
 
 # GA 評估函數
 def evaluate(ind):
     # 東西向綠燈時間, 南北向綠燈時間 = 個體[phase1, phase2]
     phase1, phase2 = ind
 
+    # 先查快取，評估過的組合不再跑模擬
+    cached = FITNESS_CACHE.get(ind)
+    if cached is not None:
+        return cached,
+
     # 如果有上一次的紀錄, 就刪除舊的紀錄
     if os.path.exists("tripinfo.xml"):
         os.remove("tripinfo.xml")
@@ -54,17 +76,13 @@ def evaluate(ind):
         programID="ga-program",                     # 紅綠燈邏輯的名稱
         type=0,                                     # 類型（0 = 固定邏輯）
         currentPhaseIndex=0,                        # 初始相位 index（從哪一個 phase 開始）
-        phases=[                                    # 相位列表
-            Phase(phase1, "GGgrrrGGgrrr", 0, 0),
-            Phase(5, "yyyrrryyyrrr", 0, 0),
-            Phase(phase2, "rrrGGgrrrGGg", 0, 0),
-            Phase(5, "rrryyyrrryyy", 0, 0)
-        ]
+        phases=[Phase(duration, state, 0, 0)        # 相位列表
+                for duration, state in program_phases(phase1, phase2)]
     )
     traci.trafficlight.setProgramLogic(tl_id, logic)
 
     # 跑 500 ms
-    for step in range(500):
+    for step in range(SIM_STEPS):
         traci.simulationStep()
 
     # 結束模擬
@@ -72,6 +90,7 @@ def evaluate(ind):
 
     # 呼叫自定義函數取得總等待時間
     delay = get_total_delay("tripinfo.xml")
+    FITNESS_CACHE.put(ind, delay)
     return (delay,) # tuple
 
 # --- GA 參數設定 ---
@@ -95,7 +114,8 @@ toolbox.register("select", tools.selTournament, tournsize=3)
 
 # --- 執行 GA 訓練 ---
 pop = toolbox.population(n=POP_SIZE)
-fitnesses = list(map(toolbox.evaluate, pop))
+fitnesses, cache_stats = evaluate_with_cache(pop, lambda todo: map(toolbox.evaluate, todo), FITNESS_CACHE)
+print(f"初始群體 {format_cache_stats(cache_stats)}")
 for ind, fit in zip(pop, fitnesses):
     ind.fitness.values = fit
 first_values = 0
@@ -120,7 +140,7 @@ for gen in range(GEN_NUM):
 
     # 計算新的適應度
     invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-    fitnesses = list(map(toolbox.evaluate, invalid_ind))
+    fitnesses, cache_stats = evaluate_with_cache(invalid_ind, lambda todo: map(toolbox.evaluate, todo), FITNESS_CACHE)
     for ind, fit in zip(invalid_ind, fitnesses):
         ind.fitness.values = fit
 
@@ -137,7 +157,7 @@ for gen in range(GEN_NUM):
     if gen == 0:
         first_values = best.fitness.values[0]
 
-    print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒")
+    print(f"第 {gen+1} 代最佳紅綠燈組合：{best}, 等待時間：{best.fitness.values[0]:.2f} 秒 | {format_cache_stats(cache_stats)}")
 
     # 將 ["generation", "phase1", "phase2", "delay"] 存入csv
     csv_writer.writerow([gen + 1, best[0], best[1], f"{best.fitness.values[0]:.2f}"])
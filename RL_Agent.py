@@ -1,7 +1,60 @@
+import os
 import random # <--- 新增這個 import
+import numpy as np # pyright: ignore[reportMissingImports]
+
+from atomic_file import atomic_write
+
+
+class StateEncoder:
+    """
+    把狀態 (tuple) 離散化成整數索引。
+
+    每個特徵以 bin_width 分箱 (可為單一數值或每個特徵各自的寬度)，
+    max_bin 以上的箱號合併成同一箱；分箱後的 tuple 以 dict (雜湊) 對應到
+    連續的整數索引，第一次看到的狀態依序配發新索引。
+    bin_width=1 時整數狀態各自一格，與原本 str(state) 當 key 的行為相同。
+    """
+
+    def __init__(self, bin_width=1, max_bin=None):
+        self.bin_width = bin_width
+        self.max_bin = max_bin
+        self.index_of = {}
+
+    def __len__(self):
+        return len(self.index_of)
+
+    def bins(self, states):
+        """states: (n, 特徵數) → 分箱後的整數陣列"""
+        binned = np.floor_divide(np.asarray(states, dtype=np.float64), self.bin_width).astype(np.int64)
+        if self.max_bin is not None:
+            np.minimum(binned, self.max_bin, out=binned)
+        return binned
+
+    def encode(self, states, add=True):
+        """回傳每個狀態的索引；add=False 時未見過的狀態為 -1"""
+        index_of = self.index_of
+        indices = np.empty(len(states), dtype=np.int64)
+        for i, key in enumerate(map(tuple, self.bins(states).tolist())):
+            index = index_of.get(key)
+            if index is None:
+                if add:
+                    index = index_of[key] = len(index_of)
+                else:
+                    index = -1
+            indices[i] = index
+        return indices
+
+    def keys(self):
+        """依索引順序排列的分箱 tuple (存檔用)"""
+        keys = [None] * len(self.index_of)
+        for key, index in self.index_of.items():
+            keys[index] = key
+        return keys
+
+
 #  Q table
 class RLAgent:
-    def __init__(self, action_space):
+    def __init__(self, action_space, bin_width=1, max_bin=None, initial_capacity=1024, instance_id="default_tabular"):
         # 初始化智能體
         self.action_space = action_space # 讓智能體知道有哪些動作可以選, e.g., [0, 1]
         self.learning_rate = 0.1         # 學習率 (alpha): 每次學習的幅度有多大
@@ -12,43 +65,113 @@ class RLAgent:
         # 提高最小探索率
 
         # Q-table: 智能體的「大腦」或「記憶筆記本」
-        # 我們用一個字典來儲存，格式是: { 狀態: [動作0的分數, 動作1的分數, ...] }
-        self.q_table = {}
+        # 狀態先由 encoder 轉成整數索引，分數存在預先配置的 NumPy 表格 [狀態索引, 動作]，
+        # 新狀態超過容量時表格加倍 (沒見過的狀態所有動作分數都是 0)
+        self.encoder = StateEncoder(bin_width, max_bin)
+        self.q_table = np.zeros((initial_capacity, len(action_space)), dtype=np.float64)
+        self.instance_id = instance_id
+        self.table_filename = f"q_table_{self.instance_id}.npz"
+
+    def __len__(self):
+        return len(self.encoder)
+
+    def _indices(self, states, add=True):
+        indices = self.encoder.encode(states, add=add)
+        needed = len(self.encoder)
+        if needed > len(self.q_table):
+            capacity = len(self.q_table)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.zeros((capacity, self.q_table.shape[1]), dtype=self.q_table.dtype)
+            grown[:len(self.q_table)] = self.q_table
+            self.q_table = grown
+        return indices
+
+    def q_values(self, state):
+        """單一狀態的分數 (沒見過的狀態全為 0，不會配發新索引)"""
+        index = self.encoder.encode([state], add=False)[0]
+        if index < 0:
+            return np.zeros(len(self.action_space))
+        return self.q_table[index]
 
     def choose_action(self, state):
-        state = str(state) # 將 state (tuple) 轉為字串，使其可以作為字典的 key
         # 根據當前狀態，決定下一步要做什麼動作 (探索 vs. 利用)
         if random.uniform(0, 1) < self.exploration_rate:
             # 隨機探索：隨便選一個動作
             return random.choice(self.action_space)
-        else:
-            # 利用經驗：選擇當前已知分數最高的動作
-            # .get(state, [0] * len(self.action_space)) 的意思是:
-            # "如果這個狀態從沒見過，就預設所有動作分數都是0"
-            q_values = self.q_table.get(state, [0] * len(self.action_space))
-            return q_values.index(max(q_values))
+        # 利用經驗：選擇當前已知分數最高的動作 (同分時取第一個，與原本 list.index(max) 相同)
+        return self.action_space[int(np.argmax(self.q_values(state)))]
 
     def learn(self, state, action, reward, next_state):
         # 智能體學習的核心 (更新 Q-table)
-        state = str(state)
-        next_state = str(next_state)
-        # 獲取舊的分數
-        old_q_values = self.q_table.get(state, [0] * len(self.action_space))
-        old_value = old_q_values[action]
+        self.learn_batch([state], [action], [reward], [next_state])
+
+    def learn_batch(self, states, actions, rewards, next_states):
+        """
+        一次更新多筆經驗 (向量化)。
+        新分數 = (1 - 學習率) * 舊分數 + 學習率 * (獎勵 + 折扣因子 * 未來的最好分數)
+        同一批中重複的 (狀態, 動作) 以同一個舊分數計算，各自的更新量直接相加。
+        """
+        indices = self._indices(states)
+        next_indices = self._indices(next_states)
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=np.float64)
 
         # 計算下一個狀態能得到的最好分數是多少
-        next_max = max(self.q_table.get(next_state, [0.0] * len(self.action_space)))
-        
-        # 這是 Q-Learning 的核心公式
-        # 新分數 = (1 - 學習率) * 舊分數 + 學習率 * (獎勵 + 折扣因子 * 未來的最好分數)
-        new_value = (1 - self.learning_rate) * old_value + \
-                    self.learning_rate * (reward + self.discount_factor * next_max)
-
-        # 更新 Q-table 裡的筆記
-        updated_q_values = old_q_values[:]
-        updated_q_values[action] = new_value
-        self.q_table[state] = updated_q_values
-        
-        # 學習完後，稍微降低下次亂試的機率
+        next_max = self.q_table[next_indices].max(axis=1)
+        targets = rewards + self.discount_factor * next_max
+        deltas = self.learning_rate * (targets - self.q_table[indices, actions])
+        np.add.at(self.q_table, (indices, actions), deltas)
+
+        # 學習完後，稍微降低下次亂試的機率 (每筆經驗衰減一次)
         if self.exploration_rate > self.min_exploration:
-            self.exploration_rate *= self.exploration_decay
\ No newline at end of file
+            self.exploration_rate *= self.exploration_decay ** len(indices)
+
+    def save(self, path=None):
+        """把 Q-table、狀態索引與超參數存成 .npz (原子替換)"""
+        path = path or self.table_filename
+        keys = self.encoder.keys()
+        with atomic_write(path, "wb") as f:
+            np.savez(
+                f,
+                q_table=self.q_table[:len(keys)],
+                keys=np.asarray(keys, dtype=np.int64) if keys else np.zeros((0, 0), dtype=np.int64),
+                bin_width=np.asarray(self.encoder.bin_width, dtype=np.float64),
+                max_bin=np.asarray(-1 if self.encoder.max_bin is None else self.encoder.max_bin),
+                exploration_rate=np.float64(self.exploration_rate),
+            )
+        print(f"✅ Q-table 已儲存: {path} ({len(keys)} 個狀態)")
+
+    def load(self, path=None):
+        """讀回 save() 的內容；檔案不存在時回傳 False"""
+        path = path or self.table_filename
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            keys = [tuple(row) for row in data["keys"].tolist()]
+            bin_width = data["bin_width"]
+            max_bin = int(data["max_bin"])
+            self.encoder = StateEncoder(float(bin_width) if bin_width.ndim == 0 else bin_width,
+                                        None if max_bin < 0 else max_bin)
+            self.encoder.index_of = {key: i for i, key in enumerate(keys)}
+            self.q_table = np.zeros((max(len(keys), 1024), len(self.action_space)), dtype=np.float64)
+            self.q_table[:len(keys)] = data["q_table"]
+            self.exploration_rate = float(data["exploration_rate"])
+        print(f"✅ Q-table 已載入: {path} ({len(keys)} 個狀態)")
+        return True
+
+
+if __name__ == "__main__":
+    # 以隨機狀態量測批次學習速度與表格大小 (不需要 SUMO)
+    import time
+    agent = RLAgent([0, 1])
+    states = np.random.randint(0, 20, size=(100000, 6))
+    next_states = np.random.randint(0, 20, size=(100000, 6))
+    actions = np.random.randint(0, 2, size=100000)
+    rewards = np.random.uniform(-50, 0, size=100000)
+    start = time.perf_counter()
+    for i in range(0, len(states), 1000):
+        agent.learn_batch(states[i:i + 1000], actions[i:i + 1000], rewards[i:i + 1000], next_states[i:i + 1000])
+    elapsed = time.perf_counter() - start
+    print(f"learn_batch: {len(states) / elapsed:.0f} 筆/秒 | 狀態數 {len(agent)} | "
+          f"Q-table {agent.q_table.nbytes / 1e6:.1f} MB")
@@ -1,16 +1,25 @@
+import time
+_LAUNCH_TIME = time.perf_counter() # 程式啟動時間 (量測啟動到第一個 simulationStep 的耗時)
 import traci
 import sys
 import os
-from DQN_RL_Agent import DQNAgent # 直接 import class
 import csv # <--- 新增
-from plyer import notification # <--- 新增
+import argparse
+# 【延遲載入】TensorFlow (DQN_RL_Agent) 與 plyer 在真正需要時才 import，
+# 測試模式使用匯出的 NumPy 權重時完全不需要 TensorFlow
+from tls_observation import TLSObserver
+from tls_topology import load_topology_for_sumocfg, lanes_by_tls, green_phases_by_tls
+from sumo_backend import SumoBackend
+from sumo_snapshot import ensure_snapshot, SIM_OPTIONS
 
 GA_RESULT_PATH = "./GA_best_result.csv"
-last_total_waiting_time = 0.0
-# --- 新增全域變數 ---
-# context: 在 RL_controller.py 檔案的頂部新增/修改此行
-last_total_queue_length = 0.0
-last_total_cumulative_waiting_time = 0.0
+DEFAULT_TRAFFIC_LIGHT_ID = "1253678773"
+# 【多路口】每個號誌各自的上一次累積等待時間 {tls_id: float}，取代原本的單一全域變數
+last_total_waiting_time = {}
+# 【訂閱式觀測層】由 main()/run_experiment() 在 traci.start 之後建立
+OBSERVER = None
+# 【多路口】狀態中的車道欄位數；控制多個號誌時補零到最大車道數，讓所有路口共用同一個網路
+STATE_LANE_COUNT = None
 def read_ga_optimal_phases(csv_filepath):
     """從 GA 輸出的 CSV 檔案中讀取最後一行的 phase1 和 phase2 數值"""
     
@@ -61,19 +70,21 @@ def get_sumo_home():
     else:
         sys.exit("請確認 SUMO_HOME 環境變數已設定！")
 
-def get_state(tls_id):
+def get_state(tls_id, observer=None):
     """
     【修復】: 獲取指定交通號誌的狀態，納入時相和 GA 最佳解。
+    observer 預設為全域 OBSERVER；向量化環境會傳入各自 SUMO 實例的觀測層。
     """
+    if observer is None:
+        observer = OBSERVER
     
-    lanes = traci.trafficlight.getControlledLanes(tls_id)
-    unique_lanes = list(set(lanes))
-    
-    # 1. 獲取排隊長度 (Queue Lengths)
-    queue_lengths = [traci.lane.getLastStepHaltingNumber(lane) for lane in unique_lanes]
+    # 1. 獲取排隊長度 (Queue Lengths) - 直接讀取訂閱快取，不產生 TraCI 往返
+    queue_lengths = observer.queue_lengths(tls_id)
+    if STATE_LANE_COUNT is not None and len(queue_lengths) < STATE_LANE_COUNT:
+        queue_lengths = queue_lengths + [0] * (STATE_LANE_COUNT - len(queue_lengths))
     
     # 2. 獲取當前時相 (Current Phase) 
-    current_phase = traci.trafficlight.getPhase(tls_id)
+    current_phase = observer.phase(tls_id)
     
     # 3. 異構集成 (RL+GA) - 現在使用動態讀取的數值
     GA_min_time_suggestion = 0.0
@@ -90,45 +101,31 @@ def get_state(tls_id):
     return tuple(state_list)
 # -----------------------------
     
-# context: 在程式的全局區域
 # --- 修正後的 calculate_reward 函數 ---
-# context: 在 RL_controller.py 檔案的頂部新增/修改此行
-last_total_waiting_time = 0.0 # 重新啟用這個變數，並用來追蹤累積等待時間
-
-def calculate_reward(tls_id):
+def calculate_reward(tls_id, observer=None, last_waiting=None):
     """
     計算即時獎勵：總累積等待時間的變化量 (Delta Delay)。
-    使用 traci.vehicle.getWaitingTime 來實現截圖中的目標。
+    車輛等待時間來自受控車道的 context 訂閱 (VAR_WAITING_TIME)，不再逐車查詢。
+    observer / last_waiting 預設為全域的 OBSERVER 與 last_total_waiting_time。
     """
+    if observer is None:
+        observer = OBSERVER
+    if last_waiting is None:
+        last_waiting = last_total_waiting_time
     try:
-        lanes = traci.trafficlight.getControlledLanes(tls_id)
-        unique_lanes = list(set(lanes))
-        
-        current_total_waiting_time = 0.0
-        
-        # 1. 遍歷所有受控車道
-        for lane in unique_lanes:
-            # 獲取該車道上所有車輛 ID
-            vehicle_ids = traci.lane.getLastStepVehicleIDs(lane)
-            
-            # 2. 遍歷車道上的所有車輛
-            for veh_id in vehicle_ids:
-                # 【關鍵嘗試】：使用 traci.vehicle 級別的 API 來獲取單車等待時間
-                # 這個 API 應該是相當穩定的
-                current_total_waiting_time += traci.vehicle.getWaitingTime(veh_id)
-        
-        # 3. 計算 Delta Reward
-        global last_total_waiting_time
+        # 1. 受控車道上所有車輛的等待時間總和 (訂閱快取)
+        current_total_waiting_time = observer.total_waiting_time(tls_id)
         
+        # 3. 計算 Delta Reward (每個號誌各自追蹤，避免多路口互相覆蓋)
         # Delta = (舊的累積等待時間 - 新的累積等待時間)
         # 如果 Delta > 0，表示等待時間減少，獎勵為正。
-        delta_delay = last_total_waiting_time - current_total_waiting_time
+        delta_delay = last_waiting.get(tls_id, 0.0) - current_total_waiting_time
         delta_delay *= -1
         # 🌟 【關鍵修正】：引入二次方排隊懲罰
     # 1. 獲取當前的總排隊車輛數 (Halting Number)
-        current_total_queue_length  = get_total_queue_length(tls_id)
-        # 4. 更新全域變數
-        last_total_waiting_time = current_total_waiting_time
+        current_total_queue_length  = get_total_queue_length(tls_id, observer)
+        # 4. 更新該號誌的紀錄
+        last_waiting[tls_id] = current_total_waiting_time
         # 2. 懲罰係數 (可調整 0.1 ~ 0.3)
         beta = 0.2 
         
@@ -146,29 +143,19 @@ def calculate_reward(tls_id):
         # 捕獲 'LaneDomain' 或 'VehicleDomain' 相關的 AttributeError
         print(f"計算獎勵時發生致命 AttributeError: {e}. 請檢查 traci.vehicle.getWaitingTime 是否存在。", file=sys.stderr)
         # 如果這個方法失敗，就回到我們之前最魯棒的「排隊長度變化量」邏輯
-        return calculate_reward_queue_fallback(tls_id)
+        return calculate_reward_queue_fallback(tls_id, observer, last_waiting)
     except Exception as e_general:
         # 捕獲其他錯誤
         return 0.0, 0.0
-def get_total_queue_length(tls_id):
+def get_total_queue_length(tls_id, observer=None):
     """
     計算給定交通號誌所控制的所有車道上的總排隊車輛數 (Halting Number)。
     """
+    if observer is None:
+        observer = OBSERVER
     try:
-        # 獲取交通號誌控制的所有車道
-        lanes = traci.trafficlight.getControlledLanes(tls_id)
-        # 使用 set 去除重複的車道 ID (因為一個信號燈可能控制同一車道的不同部分)
-        unique_lanes = list(set(lanes))
-        
-        total_queue_length = 0
-        
-        # 遍歷所有受控車道
-        for lane in unique_lanes:
-            # 獲取當前步驟靜止或排隊的車輛數 (速度小於 0.1 m/s)
-            # traci.lane.getLastStepHaltingNumber(lane) 是計算排隊長度的標準 API
-            total_queue_length += traci.lane.getLastStepHaltingNumber(lane)
-            
-        return total_queue_length
+        # 受控車道的 LAST_STEP_VEHICLE_HALTING_NUMBER 已由訂閱取得 (車道已去重)
+        return observer.total_queue_length(tls_id)
             
     except traci.TraCIException:
         # SUMO 連線中斷或其他 traci 錯誤
@@ -180,25 +167,23 @@ def get_total_queue_length(tls_id):
 # (注意：這個函式需要在您的程式碼中定義一次)
 # --- 備用函數：如果 vehicle.getWaitingTime 失敗，則回退到排隊長度 ---
 # 這是確保程式不會因為 API 不相容而崩潰的保護層
-def calculate_reward_queue_fallback(tls_id):
+def calculate_reward_queue_fallback(tls_id, observer=None, last_waiting=None):
     """
     備用函數：如果基於車輛等待時間的計算失敗，則回退到排隊長度變化量。
     （使用你上次修正後的 Delta Queue 邏輯）
     """
     print("使用calculate_reward_queue_fallback",flush=True)
+    if observer is None:
+        observer = OBSERVER
+    if last_waiting is None:
+        last_waiting = last_total_waiting_time
     try:
-        lanes = traci.trafficlight.getControlledLanes(tls_id)
-        unique_lanes = list(set(lanes))
-        
-        current_total_queue_length = 0.0
-        for lane in unique_lanes:
-            current_total_queue_length += traci.lane.getLastStepHaltingNumber(lane)
+        current_total_queue_length = float(observer.total_queue_length(tls_id))
         
         # 注意：為了避免依賴另一個全域變數，這裡暫時使用 last_total_waiting_time 作為排隊長度的追蹤器。
         # ⚠️ 這裡是犧牲了變數名稱的語義，換取程式的魯棒性。
-        global last_total_waiting_time
-        delta_queue = last_total_waiting_time - current_total_queue_length
-        last_total_waiting_time = current_total_queue_length
+        delta_queue = last_waiting.get(tls_id, 0.0) - current_total_queue_length
+        last_waiting[tls_id] = current_total_queue_length
         
         # 使用 Delta Queue 作為獎勵
         reward = delta_queue * 1.0 
@@ -228,12 +213,16 @@ def run_experiment():
     try:
         traci.start(SUMO_CMD)
         
-        logics = traci.trafficlight.getAllProgramLogics(TRAFFIC_LIGHT_ID)
-        num_phases = len(logics[0].phases) if logics else 4
+        # 【號誌拓撲索引】相位結構與受控車道順序來自快取的路網索引
+        topology = load_topology_for_sumocfg(SUMOCFG_PATH)
+        num_phases = len(topology[TRAFFIC_LIGHT_ID]["phases"])
         print(f"成功獲取交通號誌 '{TRAFFIC_LIGHT_ID}' 的相位總數: {num_phases}")
 
-        lanes = traci.trafficlight.getControlledLanes(TRAFFIC_LIGHT_ID)
-        state_size = len(list(set(lanes))) + 2
+        # 【訂閱式觀測層】只在啟動時設定一次訂閱
+        global OBSERVER
+        OBSERVER = TLSObserver(TRAFFIC_LIGHT_ID, lanes_by_tls=lanes_by_tls(topology, [TRAFFIC_LIGHT_ID]))
+        OBSERVER.subscribe()
+        state_size = len(OBSERVER.lanes[TRAFFIC_LIGHT_ID]) + 2
         print(f"狀態維度 (State Size): {state_size}")
         
     except traci.TraCIException as e:
@@ -249,6 +238,7 @@ def run_experiment():
         # 使用 sys.argv[1] 作為最常見的單參數傳遞方式
         RL_INSTANCE_ID = sys.argv[1] 
     print(f"使用的 RL 實例 ID (instance_id): {RL_INSTANCE_ID}")
+    from DQN_RL_Agent import DQNAgent
     agent = DQNAgent(state_size=state_size, action_space=ACTION_SPACE, instance_id=RL_INSTANCE_ID)
     # 嘗試載入模型，如果存在的話
     agent.load_model() # <--- 新增：嘗試載入模型
@@ -261,19 +251,19 @@ def run_experiment():
 
     while step < 5000:
         try:
-            if traci.simulation.getMinExpectedNumber() <= 0:
+            if OBSERVER.min_expected_number() <= 0:
                 print("所有車輛已離開模擬，提前結束。")
                 break
 
             current_state = get_state(TRAFFIC_LIGHT_ID)
-            current_phase = traci.trafficlight.getPhase(TRAFFIC_LIGHT_ID)
+            current_phase = OBSERVER.phase(TRAFFIC_LIGHT_ID)
             # 獲取當前相位的總時間長度（綠燈時間 + 黃燈時間，通常是 3s）
-            phase_duration = traci.trafficlight.getPhaseDuration(TRAFFIC_LIGHT_ID)
+            phase_duration = OBSERVER.phase_duration(TRAFFIC_LIGHT_ID)
            # 獲取距離下次變換剩餘的時間 (Time to Next Switch)
             # 這樣比嘗試計算 elapsed time 更準確且常見
-            time_remaining = traci.trafficlight.getNextSwitch(TRAFFIC_LIGHT_ID) - traci.simulation.getTime()
+            time_remaining = OBSERVER.next_switch(TRAFFIC_LIGHT_ID) - OBSERVER.time()
             # 獲取當前相位模式（例如：rryyGGggrr...）
-            phase_state = traci.trafficlight.getRedYellowGreenState(TRAFFIC_LIGHT_ID)
+            phase_state = OBSERVER.red_yellow_green_state(TRAFFIC_LIGHT_ID)
             
             action = 0
             # 只有在綠燈相位 (偶數相位) 且超過最短綠燈時間後才允許 RL 決策
@@ -282,20 +272,20 @@ def run_experiment():
 
             if action == 1 and current_phase % 2 == 0:
                 next_phase = (current_phase + 1) % num_phases
-                traci.trafficlight.setPhase(TRAFFIC_LIGHT_ID, next_phase)
+                OBSERVER.set_phase(TRAFFIC_LIGHT_ID, next_phase)
                 
                 # 等待黃燈時間
                 for _ in range(3):
-                    traci.simulationStep()
+                    OBSERVER.step()
                     
                     step += 1
             else:
                 # (修正点): 如果决定维持，就让模拟继续跑 DECISION_INTERVAL 步
                 for _ in range(DECISION_INTERVAL):
                 # 在进入下一步之前，先检查模拟是否已经没有车辆
-                    if traci.simulation.getMinExpectedNumber() <= 0:
+                    if OBSERVER.min_expected_number() <= 0:
                         break # 如果没有车了，就跳出这个小循环
-                    traci.simulationStep()
+                    OBSERVER.step()
                     step += 1
                 
             # --- 學習步驟 ---
@@ -321,21 +311,48 @@ def run_experiment():
 
 # --- 1. 新增命令列/互動式參數解析函數 ---
 def parse_arguments():
-    """解析命令行參數，允許使用者選擇模式和模型名稱。"""
-    
-    # 檢查是否有足夠的命令行參數 (例如: python RL_controller.py test my_model)
-    if len(sys.argv) > 1:
-        mode = sys.argv[1].lower()
-        if mode not in ['train', 'test']:
-            print("❌ 錯誤: 第一個參數必須是 'train' 或 'test'。")
-            sys.exit(1)
-        instance_id = sys.argv[2]
-    elif len(sys.argv) == 2: # 處理只給了模式或ID的情況
-        # 為了簡化，我們假設如果只有一個參數，它就是模型ID，並使用默認的訓練模式
-        print(f"警告：只提供一個參數 '{sys.argv[1]}'，將其作為模型ID並進入默認的訓練模式。")
-        instance_id = sys.argv[1]
-        
-    return mode, instance_id
+    """解析命令行參數，允許使用者選擇模式、模型名稱與要控制的號誌。"""
+    parser = argparse.ArgumentParser(description="DQN 交通號誌控制器")
+    parser.add_argument("mode", type=str.lower, choices=["train", "test"], help="train: 訓練 / test: 測試")
+    parser.add_argument("instance_id", help="模型 ID (決定 model_<id>.h5 檔名)")
+    parser.add_argument("--tls", default=DEFAULT_TRAFFIC_LIGHT_ID,
+                        help="要控制的號誌 ID，多個以逗號分隔；'all' 表示路網中所有號誌")
+    parser.add_argument("--backend", choices=["auto", "libsumo", "traci"], default=None,
+                        help="SUMO 後端：libsumo (行程內，較快) / traci (socket，sumo-gui 必須使用)")
+    parser.add_argument("--no-gui", action="store_true", help="測試模式不開啟 sumo-gui (改用 sumo，可搭配 libsumo)")
+    parser.add_argument("--episodes", type=int, default=1,
+                        help="訓練模式下連續執行的 episode 數 (同一個行程內以 traci.load 重置，每個 episode 換種子)")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="從穩定負載的模擬快照開始 (快照依 sumocfg/路線檔/種子快取，不存在時自動建立)")
+    parser.add_argument("--prioritized", action="store_true",
+                        help="使用優先經驗回放 (sum-tree，依 TD 誤差取樣) 取代均勻取樣")
+    parser.add_argument("--async-learner", action="store_true",
+                        help="訓練在背景執行緒進行，控制迴圈只存經驗與讀取權重副本")
+    parser.add_argument("--replay-ratio", type=float, default=1.0,
+                        help="非同步學習時，每個決策步對應的學習更新次數 (與 --tls 控制的號誌數量無關；0 表示不限制，持續訓練)")
+    parser.add_argument("--q-cache-size", type=int, default=4096,
+                        help="以狀態 tuple 為鍵的 LRU Q 值快取容量 (0 表示停用)")
+    parser.add_argument("--policy-sync-interval", type=int, default=1,
+                        help="訓練時決策用的權重每幾次更新同步一次 (同步時清空 Q 值快取)")
+    parser.add_argument("--distilled", action="store_true",
+                        help="測試模式使用 policy_distill.py 產生的 distilled_<id>.json (查表 + 決策樹)")
+    parser.add_argument("--use-tf", action="store_true",
+                        help="測試模式一律以 TensorFlow 載入 .h5 (預設有 policy_<id>.npz 時使用 NumPy 推論)")
+    parser.add_argument("--checkpoint-every", type=int, default=500,
+                        help="每幾次訓練更新在背景寫一次檢查點到 checkpoints/<id>/ (0 表示停用)")
+    return parser.parse_args()
+
+
+def resolve_tls_ids(tls_arg, topology):
+    """將 --tls 參數轉成號誌 ID 列表"""
+    if tls_arg == "all":
+        return list(topology)
+    tls_ids = [t.strip() for t in tls_arg.split(",") if t.strip()]
+    unknown = [t for t in tls_ids if t not in topology]
+    if unknown:
+        print(f"❌ 錯誤: 路網中找不到號誌 {unknown}")
+        sys.exit(1)
+    return tls_ids
 
 
 # def main():
@@ -505,34 +522,185 @@ def parse_arguments():
 #         # displaying time
 #         timeout=100 # seconds
 #     )   
+def build_sumo_args(sumo_config_file, seed, warm_start=False):
+    """
+    SUMO 啟動參數 (不含執行檔名稱)；traci.load 重新載入時也使用同一組參數。
+    warm_start=True 時從 (sumocfg, 路線檔, 種子) 對應的穩定負載快照開始，跳過空路網的暖機。
+    """
+    args = [
+        "-c", sumo_config_file,
+        "--tripinfo-output", "tripinfo_RL_{}.xml" ,
+        "--seed", str(seed), # 【新增】加入隨機種子碼
+    ] + SIM_OPTIONS # 含子車道模型 (--lateral-resolution)，與暖機快照相同
+    if warm_start:
+        args += ["--load-state", ensure_snapshot(sumo_config_file, seed, SIM_OPTIONS)]
+    return args
+
+
+_STARTUP_REPORTED = False
+
+
+def run_episode(agent, sumo, tls_ids, num_phases, green_phases, is_train_mode,
+                MAX_SIMULATION_STEPS, DECISION_INTERVAL, MIN_GREEN_TIME):
+    """
+    執行一個 episode 的控制迴圈 (green_phases 為 green_phases_by_tls 的結果)。
+    回傳 (模擬步數, 累積獎勵, 是否正常結束)；SUMO 連線中斷時第三個值為 False。
+    """
+    global _STARTUP_REPORTED
+    step = 0
+    cumulative_reward = 0.0
+    # 【關鍵修正 1】：新增時間追蹤變數 (每個號誌各自計時)
+    time_since_last_change = {tls_id: 0 for tls_id in tls_ids}
+
+    # --- 4. 主模擬與訓練/測試迴圈 (最終穩定結構) ---
+    while step < MAX_SIMULATION_STEPS:
+        try:
+            # 1. 檢查退出條件
+            if OBSERVER.min_expected_number() <= 0:
+                print("所有車輛已離開模擬，提前結束。")
+                break
+                
+            # 1. 推進單步模擬與時間計數 (每一步都執行)
+            OBSERVER.step()
+            step += 1
+            if not _STARTUP_REPORTED:
+                _STARTUP_REPORTED = True
+                print(f"🚀 啟動到第一個 simulationStep: {time.perf_counter() - _LAUNCH_TIME:.2f} 秒", flush=True)
+            for tls_id in tls_ids:
+                time_since_last_change[tls_id] += 1
+
+            # 2. 決策與學習邏輯：只在固定的 DECISION_INTERVAL 發生
+            if step % DECISION_INTERVAL == 0:
+                
+                # 2.1 獲取所有號誌的狀態 (在決策點獲取)
+                current_states = {tls_id: get_state(tls_id) for tls_id in tls_ids}
+                current_phases = {tls_id: OBSERVER.phase(tls_id) for tls_id in tls_ids}
+                actions = {tls_id: 0 for tls_id in tls_ids} # 預設：維持
+                
+                # 2.2 判斷哪些號誌允許 RL 決策 (必須是綠燈，且超過最小綠燈時間)
+                deciding = [tls_id for tls_id in tls_ids
+                            if current_phases[tls_id] in green_phases[tls_id]
+                            and time_since_last_change[tls_id] >= MIN_GREEN_TIME]
+                if deciding:
+                    # 【批次推論】所有需要決策的號誌只做一次前向傳播
+                    chosen = agent.choose_actions([current_states[tls_id] for tls_id in deciding])
+                    for tls_id, action in zip(deciding, chosen):
+                        actions[tls_id] = action
+                    
+                # 2.3 執行切換動作
+                for tls_id in deciding:
+                    if actions[tls_id] == 1:
+                        # 切換到下一個相位 (黃燈)
+                        next_phase = (current_phases[tls_id] + 1) % num_phases[tls_id]
+                        OBSERVER.set_phase(tls_id, next_phase)
+                        time_since_last_change[tls_id] = 0 # 重置計時器
+                
+                # 2.4 學習與紀錄 (發生在每個決策點)
+                transitions = []
+                step_reward = 0.0
+                step_queue_length = 0.0
+                for tls_id in tls_ids:
+                    next_state = get_state(tls_id)
+                    reward, current_total_queue_length = calculate_reward(tls_id)
+                    transitions.append((current_states[tls_id], actions[tls_id], reward, next_state))
+                    step_reward += reward
+                    step_queue_length += current_total_queue_length
+                
+                if is_train_mode:
+                    # 所有號誌的經驗一起放入記憶庫，每個決策點只訓練一次
+                    agent.learn_batch(transitions)
+                
+                cumulative_reward += step_reward
+                
+                # 2.5 輸出紀錄 (只在決策點輸出)
+                if len(tls_ids) == 1:
+                    tls_id = tls_ids[0]
+                    action = actions[tls_id]
+                    time_info = f" | Phase Time: {time_since_last_change[tls_id]:.1f}s"
+                    phase_state = OBSERVER.red_yellow_green_state(tls_id)
+            
+                    if is_train_mode:
+                        status_line = f"時間: {step}s{time_info} | 獎勵: {step_reward:.2f} | States: {phase_state} | Action: {action} | Epsilon: {agent.exploration_rate:.3f}"
+                    else:
+                        status_line = f"時間: {step}s{time_info} | 瞬間獎勵: {step_reward:.2f}  | States: {phase_state} | 排隊總數: {step_queue_length:.2f}"
+                else:
+                    switched = sum(1 for tls_id in tls_ids if actions[tls_id] == 1)
+                    if is_train_mode:
+                        status_line = f"時間: {step}s | 號誌數: {len(tls_ids)} | 切換: {switched} | 獎勵: {step_reward:.2f} | Epsilon: {agent.exploration_rate:.3f}"
+                    else:
+                        status_line = f"時間: {step}s | 號誌數: {len(tls_ids)} | 切換: {switched} | 瞬間獎勵: {step_reward:.2f} | 排隊總數: {step_queue_length:.2f}"
+                
+                print(status_line, flush=True)
+
+            # 3. 處理非 RL 控制的相位跳轉 (黃燈 -> 紅燈/綠燈)
+            #    (此處不需要任何額外的程式碼，由 SUMO 內部處理)
+
+        except sumo.TraCIException:
+            print("SUMO 連線中斷，提前結束迴圈。")
+            return step, cumulative_reward, False
+            
+    return step, cumulative_reward, True
+
+
 def main():
-    mode, instance_id = parse_arguments()
+    args = parse_arguments()
+    mode, instance_id = args.mode, args.instance_id
     is_train_mode = (mode == 'train')
 
     # 參數設定
-    TRAFFIC_LIGHT_ID = "1253678773"
     SUMO_CONFIG_FILE = "osm.sumocfg"
     MAX_SIMULATION_STEPS = 25000 # 模擬總步數
     DECISION_INTERVAL = 5 # 每隔 5 步進行一次決策
     MIN_GREEN_TIME = 10 # 最小綠燈時間
     ACTION_SPACE = [0, 1]  # 0: Maintain, 1: Change Phase
+
+    # 【號誌拓撲索引】相位結構與受控車道 (固定順序) 來自快取的路網索引，不必再查詢 TraCI
+    topology = load_topology_for_sumocfg(SUMO_CONFIG_FILE)
+    # 【多路口】要控制的號誌列表 (預設只有 1253678773)
+    tls_ids = resolve_tls_ids(args.tls, topology)
     
     # --- 2. 初始化 DQN 代理，使用解析出的 instance_id ---
     print(f"使用的 RL 實例 ID (instance_id): {instance_id}")
-    agent = DQNAgent(state_size=6, action_space=ACTION_SPACE, instance_id=instance_id) # state_size 暫時為 0
+    policy_filename = f"policy_{instance_id}.npz"
 
 
     if is_train_mode:
+        from DQN_RL_Agent import DQNAgent
+        agent = DQNAgent(state_size=6, action_space=ACTION_SPACE, instance_id=instance_id, # state_size 暫時為 0
+                         prioritized=args.prioritized, q_cache_size=args.q_cache_size,
+                         policy_sync_interval=args.policy_sync_interval)
         print("💡 模式：DQN 訓練模式 (Train Mode)。")
         # 載入 GA 基線數據 (訓練用)
         read_ga_optimal_phases(GA_RESULT_PATH)
-        # 訓練模式會繼續 Epsilon 衰減 (可以選擇載入上次進度)
-        if agent.load_model():
+        # 訓練模式會繼續 Epsilon 衰減 (載入上次的訓練次數與 Epsilon)
+        if agent.load_model(resume=True):
             print("✅ 找到上次訓練模型，將繼續訓練。")
         else:
             print("⚠️ 未找到模型檔案，將從頭開始訓練。")
             
+    elif args.distilled: # 測試模式 (蒸餾策略)
+        print("💡 模式：DQN 測試模式 (Test Mode)。")
+        # 【部署】查表 + 淺層決策樹，純 Python 決策 (由 policy_distill.py 產生)
+        from policy_distill import DistilledPolicyAgent
+        distilled_filename = f"distilled_{instance_id}.json"
+        if not os.path.exists(distilled_filename):
+            print(f"\n❌ 找不到 {distilled_filename}，請先執行 python policy_distill.py {instance_id}")
+            sys.exit(1)
+        agent = DistilledPolicyAgent.load(distilled_filename, ACTION_SPACE, instance_id)
+        print(f"✅ 已載入蒸餾策略 {distilled_filename} (與網路一致率 {agent.fidelity.get('table_agreement', 0) * 100:.2f}%)。")
+
+    elif os.path.exists(policy_filename) and not args.use_tf: # 測試模式 (NumPy 推論)
+        print("💡 模式：DQN 測試模式 (Test Mode)。")
+        # 【快速啟動】直接使用匯出的權重做 NumPy 前向傳播，不 import TensorFlow
+        from numpy_policy import NumpyPolicyAgent
+        agent = NumpyPolicyAgent.load(policy_filename, ACTION_SPACE, instance_id)
+        agent.q_cache.maxsize = args.q_cache_size
+        print(f"✅ 已載入匯出的權重 {policy_filename} (NumPy 推論，不使用 TensorFlow)。探索率 Epsilon 鎖定為 0。")
+
     else: # 測試模式
+        from DQN_RL_Agent import DQNAgent
+        agent = DQNAgent(state_size=6, action_space=ACTION_SPACE, instance_id=instance_id,
+                         q_cache_size=args.q_cache_size)
         print("💡 模式：DQN 測試模式 (Test Mode)。")
         # --- 測試模式核心邏輯 ---
         if not agent.load_model():
@@ -541,6 +709,9 @@ def main():
             
         agent.exploration_rate = 0.0 # 鎖定探索率為 0，只執行利用(Exploitation)
         print(f"✅ 模型載入成功。探索率 Epsilon 已鎖定為 {agent.exploration_rate}。")
+        if not os.path.exists(policy_filename):
+            agent.export_policy() # 下次測試可直接使用 NumPy 權重，不必載入 TensorFlow
+            print(f"💾 已匯出 {policy_filename}，之後的測試不需要 TensorFlow。")
         
         
     # ... [啟動 SUMO 和 TraCI 連線]
@@ -550,109 +721,95 @@ def main():
     # 訓練時使用固定種子 (例如 42)，測試時使用不同種子 (例如 100)
     sim_seed = 42 if is_train_mode else 100 # <--- 這裡可以動態修改
     # 【修正】: 根據模式自動選擇 sumo 或 sumo-gui
-    sumo_binary = "sumo" if is_train_mode else "sumo-gui"
-    sumoCmd = [
-        sumo_binary,
-        "-c", SUMO_CONFIG_FILE,
-        "--time-to-teleport", "300",
-        "--tripinfo-output", "tripinfo_RL_{}.xml" ,
-        "--seed", str(sim_seed), # 【新增】加入隨機種子碼
-        
-        # 【新增：啟用子車道模型】
-        "--lateral-resolution", "0.05" # 設置橫向解析度 (例如：每 0.2m 一個子車道)
-    ]
-    traci.start(sumoCmd)
+    sumo_binary = "sumo" if (is_train_mode or args.no_gui) else "sumo-gui"
+    sumoCmd = [sumo_binary] + build_sumo_args(SUMO_CONFIG_FILE, sim_seed, args.warm_start)
+    # 【後端切換】sumo 預設使用行程內的 libsumo，sumo-gui 回退到 traci
+    sumo = SumoBackend(sumo_binary, prefer=args.backend)
+    print(f"SUMO 後端: {sumo.name}")
+    sumo.start(sumoCmd)
     
     
-    # --- 3. 初始化並開始模擬 ---
-    step = 0
-    cumulative_reward = 0.0
-    logics = traci.trafficlight.getAllProgramLogics(TRAFFIC_LIGHT_ID)
-    num_phases = len(logics[0].phases) if logics else 4
-    # 【關鍵修正 1】：新增時間追蹤變數
-    time_since_last_change = 0
+    # --- 3. 初始化 ---
+    num_phases = {tls_id: len(topology[tls_id]["phases"]) for tls_id in tls_ids}
+    green_phases = green_phases_by_tls(topology, tls_ids)
+    # 【訂閱式觀測層】只在啟動時設定一次訂閱，之後每步只有 simulationStep 一次往返
+    global OBSERVER, STATE_LANE_COUNT
+    OBSERVER = TLSObserver(tls_ids, conn=sumo, lanes_by_tls=lanes_by_tls(topology, tls_ids))
+    OBSERVER.subscribe()
+    # 【多路口】所有號誌共用一個網路：狀態補零到最多的受控車道數
+    STATE_LANE_COUNT = max(len(OBSERVER.lanes[tls_id]) for tls_id in tls_ids)
     # 【修正】: 動態獲取 state_size 並建立模型
-    lanes = traci.trafficlight.getControlledLanes(TRAFFIC_LIGHT_ID)
-    real_state_size = len(list(set(lanes))) + 2
+    real_state_size = STATE_LANE_COUNT + 2
     agent.state_size = real_state_size
     agent.build_models() # 在獲取真實維度後，才建立模型
-
-    print(f"成功獲取交通號誌 '{TRAFFIC_LIGHT_ID}' 的相位總數: {num_phases}")
-    print(f"狀態維度 (State Size): {agent.state_size}")
-
-    # --- 4. 主模擬與訓練/測試迴圈 (最終穩定結構) ---
-    while step < MAX_SIMULATION_STEPS:
-        try:
-            # 1. 檢查退出條件
-            if traci.simulation.getMinExpectedNumber() <= 0:
-                print("所有車輛已離開模擬，提前結束。")
-                break
-                
-            # 1. 推進單步模擬與時間計數 (每一步都執行)
-            traci.simulationStep()
-            step += 1
-            time_since_last_change += 1 
-
-            # 2. 決策與學習邏輯：只在固定的 DECISION_INTERVAL 發生
-            if step % DECISION_INTERVAL == 0:
-                
-                # 2.1 獲取狀態 (在決策點獲取)
-                current_state = get_state(TRAFFIC_LIGHT_ID)
-                current_phase = traci.trafficlight.getPhase(TRAFFIC_LIGHT_ID)
-                
-                action = 0 # 預設：維持
-                
-                # 2.2 判斷是否允許 RL 決策 (必須是綠燈，且超過最小綠燈時間)
-                if current_phase % 2 == 0: # 確保在綠燈相位 (0, 2, ...)
-                    
-                    if time_since_last_change >= MIN_GREEN_TIME:
-                        action = agent.choose_action(current_state)
-                    
-                    # 2.3 執行切換動作
-                    if action == 1:
-                        # 切換到下一個相位 (黃燈)
-                        next_phase = (current_phase + 1) % num_phases
-                        traci.trafficlight.setPhase(TRAFFIC_LIGHT_ID, next_phase)
-                        time_since_last_change = 0 # 重置計時器
-                
-                # 2.4 學習與紀錄 (發生在每個決策點)
-                next_state = get_state(TRAFFIC_LIGHT_ID)
-                reward, current_total_queue_length = calculate_reward(TRAFFIC_LIGHT_ID)
-                
-                if is_train_mode:
-                    agent.learn(current_state, action, reward, next_state) 
-                
-                cumulative_reward += reward
-                
-                # 2.5 輸出紀錄 (只在決策點輸出)
-                time_info = f" | Phase Time: {time_since_last_change:.1f}s"
-                phase_state = traci.trafficlight.getRedYellowGreenState(TRAFFIC_LIGHT_ID)
-        
-                if is_train_mode:
-                    status_line = f"時間: {step}s{time_info} | 獎勵: {reward:.2f} | States: {phase_state} | Action: {action} | Epsilon: {agent.exploration_rate:.3f}"
-                else:
-                    status_line = f"時間: {step}s{time_info} | 瞬間獎勵: {reward:.2f}  | States: {phase_state} | 排隊總數: {current_total_queue_length:.2f}"
-                
-                print(status_line, flush=True)
-
-            # 3. 處理非 RL 控制的相位跳轉 (黃燈 -> 紅燈/綠燈)
-            #    (此處不需要任何額外的程式碼，由 SUMO 內部處理)
-
-        except traci.TraCIException:
-            print("SUMO 連線中斷，提前結束迴圈。")
+    if is_train_mode:
+        # 【持久化記憶庫】接續上次存檔時的經驗 (記憶體映射，不整個讀進 RAM)
+        agent.attach_persistent_memory()
+        # 【背景檢查點】上次執行在存檔前中斷時，從比模型檔更新的檢查點接續
+        model_mtime = os.path.getmtime(agent.model_filename) if os.path.exists(agent.model_filename) else None
+        agent.restore_latest_checkpoint(newer_than=model_mtime)
+        agent.enable_checkpoints(every=args.checkpoint_every)
+
+    for tls_id in tls_ids:
+        print(f"成功獲取交通號誌 '{tls_id}' 的相位總數: {num_phases[tls_id]}")
+    print(f"控制號誌數: {len(tls_ids)} | 狀態維度 (State Size): {agent.state_size}")
+    if is_train_mode and args.async_learner:
+        agent.start_async_learner(replay_ratio=args.replay_ratio or None)
+        print(f"🧵 非同步學習已啟動 (replay ratio: {args.replay_ratio or '不限制'})")
+
+    # --- 4. 多個 episode 連續訓練 (同一個行程，agent / optimizer / 記憶庫保持不變) ---
+    num_episodes = args.episodes if is_train_mode else 1
+    total_steps = 0
+    step = 0
+    cumulative_reward = 0.0
+    for episode in range(1, num_episodes + 1):
+        if episode > 1:
+            # 以新的種子重新載入模擬，不必重啟 SUMO 與 TensorFlow
+            episode_seed = sim_seed + episode - 1
+            sumo.load(build_sumo_args(SUMO_CONFIG_FILE, episode_seed, args.warm_start))
+            OBSERVER.subscribe() # 重新載入後重新建立訂閱
+            print(f"\n🔁 Episode {episode}/{num_episodes} 開始 (seed={episode_seed})", flush=True)
+        last_total_waiting_time.clear()
+
+        episode_start = time.perf_counter()
+        step, cumulative_reward, completed = run_episode(
+            agent, sumo, tls_ids, num_phases, green_phases, is_train_mode,
+            MAX_SIMULATION_STEPS, DECISION_INTERVAL, MIN_GREEN_TIME)
+        total_steps += step
+        steps_per_second = step / max(time.perf_counter() - episode_start, 1e-9)
+        print(f"⏱️ 模擬速度: {steps_per_second:.1f} 步/秒", flush=True)
+
+        if is_train_mode and num_episodes > 1:
+            print(f"📦 Episode {episode}/{num_episodes} 完成 | 步數: {step} | 累積獎勵: {cumulative_reward:.2f} | Epsilon: {agent.exploration_rate:.3f}", flush=True)
+            print(agent.cache_report(), flush=True)
+            # 每個 episode 之間存一次檢查點 (最後一個 episode 在停止背景學習後才存)
+            if completed and episode < num_episodes:
+                agent.save_model()
+        if not completed:
             break
             
     # --- 5. 結束模擬 ---
     print("正在關閉模擬...")
-    traci.close()
+    sumo.close()
+    if is_train_mode and args.async_learner:
+        agent.stop_async_learner() # 存檔前停止背景訓練
+        print(f"🧵 背景學習更新次數: {agent.learner_updates}")
+    if is_train_mode:
+        agent.close_checkpoints()
     
     if is_train_mode:
-        agent.save_model() # 訓練結束時儲存模型
+        # 訓練結束時儲存模型 (背景學習已停止，最後的更新都會寫入)
+        agent.save_model()
+        if num_episodes > 1:
+            print(f"\n✅ 訓練完成！共 {num_episodes} 個 episode，總模擬步數: {total_steps}")
     else:
         # 測試模式下的最終結果輸出
         print(f"\n✅ 測試完成！使用的模型 ID: {instance_id}")
         print(f"模擬總步數: {step}")
         print(f"最終累積獎勵: {cumulative_reward:.2f}")
+        print(agent.latency_report())
+        print(agent.cache_report())
+    from plyer import notification
     notification.notify(
         title = "Python RL Trainning Finish",
         message = f"RUN PID: {os.getpid()}, MODEL ID= {instance_id}" ,
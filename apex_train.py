@@ -0,0 +1,174 @@
+"""
+Ape-X 式分散訓練：多個 actor 行程 + 一個 learner，訓練同一個模型。
+
++ 每個 actor 行程各自啟動一個 SUMO (自己的 label、種子與固定的 epsilon)，
+  以 NumPy 前向傳播做決策，把經驗直接寫進共享記憶體中的 SharedReplayBuffer
++ learner (主行程) 擁有 DQNAgent 的網路，從共享記憶庫取樣訓練，
+  每 PUBLISH_INTERVAL 次更新把主網路權重發布到 SharedWeights
++ 結束時只產生一組 model_<id>.h5 / target_model_<id>.h5
+
+用法: python apex_train.py my_model --actors 4 --updates 20000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np # pyright: ignore[reportMissingImports]
+
+SUMO_CONFIG_FILE = "osm.sumocfg"
+ACTION_SPACE = [0, 1]  # 0: Maintain, 1: Change Phase
+PUBLISH_INTERVAL = 50 # learner 每幾次更新發布一次權重
+REPORT_INTERVAL = 500 # learner 每幾次更新輸出一次進度
+BASE_EPSILON = 0.4 # Ape-X 的 epsilon 配置：eps_i = BASE_EPSILON ** (1 + i / (N - 1) * EPSILON_ALPHA)
+EPSILON_ALPHA = 7.0
+
+
+def actor_epsilon(actor_id, num_actors):
+    """每個 actor 固定的探索率：從 0.4 (大量探索) 到 0.4^8 (幾乎貪婪)"""
+    if num_actors == 1:
+        return BASE_EPSILON
+    return BASE_EPSILON ** (1 + actor_id / (num_actors - 1) * EPSILON_ALPHA)
+
+
+def actor_main(actor_id, seed, epsilon, tls_ids, buffer_spec, weights_spec, buffer_lock, weights_lock,
+               stop_event, env_steps, warm_start, seed_stride):
+    """actor 行程：跑 SUMO、以最新發布的權重做 epsilon-greedy 決策、把經驗寫入共享記憶庫"""
+    import RL_controller
+    from numpy_policy import NumpyPolicy, SharedWeights
+    from replay_buffer import SharedReplayBuffer
+    from sumo_vec_env import SumoTLSEnv
+    from tls_topology import load_topology_for_sumocfg
+
+    topology = load_topology_for_sumocfg(SUMO_CONFIG_FILE)
+    # 與 learner 相同的狀態維度 (spawn 的子行程不會繼承模組全域變數)
+    RL_controller.STATE_LANE_COUNT = max(len(topology[t]["controlled_lanes"]) for t in tls_ids)
+
+    memory = SharedReplayBuffer.attach(buffer_spec, buffer_lock)
+    shared_weights = SharedWeights.attach(weights_spec, weights_lock)
+    policy = NumpyPolicy()
+    version = -1
+    rng = np.random.default_rng(seed)
+    # reset 時種子以 actor 數為間隔遞增，各 actor 不會跑到相同的種子
+    env = SumoTLSEnv(f"apex_actor_{actor_id}", seed, tls_ids, topology, seed_stride=seed_stride,
+                     warm_start=warm_start)
+    try:
+        states = env.reset()
+        while not stop_event.is_set():
+            version, weights = shared_weights.read_if_newer(version)
+            if weights is not None:
+                policy.set_weights(weights)
+
+            batch = np.asarray(states, dtype=np.float32)
+            actions = np.argmax(policy.q_values_batch(batch), axis=1)
+            explore = rng.random(len(actions)) < epsilon
+            actions[explore] = rng.integers(len(ACTION_SPACE), size=int(explore.sum()))
+
+            before = env.step_count
+            applied, next_states, rewards, done = env.step([int(a) for a in actions])
+            for state, action, reward, next_state in zip(states, applied, rewards, next_states):
+                memory.add(state, action, reward, next_state, done)
+            with env_steps.get_lock():
+                env_steps.value += env.step_count - before
+            states = env.reset() if done else next_states
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        memory.close()
+        shared_weights.close()
+
+
+def train_apex(instance_id, num_actors, total_updates, tls_ids=None, base_seed=42, warm_start=False,
+               batch_size=64):
+    import RL_controller
+    from DQN_RL_Agent import DQNAgent
+    from numpy_policy import SharedWeights
+    from replay_buffer import SharedReplayBuffer
+    from tls_topology import load_topology_for_sumocfg
+
+    topology = load_topology_for_sumocfg(SUMO_CONFIG_FILE)
+    if tls_ids is None:
+        tls_ids = [RL_controller.DEFAULT_TRAFFIC_LIGHT_ID]
+    RL_controller.STATE_LANE_COUNT = max(len(topology[t]["controlled_lanes"]) for t in tls_ids)
+
+    agent = DQNAgent(state_size=RL_controller.STATE_LANE_COUNT + 2, action_space=ACTION_SPACE, instance_id=instance_id)
+    if agent.load_model(resume=True):
+        print("✅ 找到上次訓練模型，將繼續訓練。")
+    else:
+        agent.build_models()
+
+    # TensorFlow 不保證 fork 安全，子行程一律以 spawn 啟動
+    ctx = multiprocessing.get_context("spawn")
+    buffer_lock = ctx.Lock()
+    weights_lock = ctx.Lock()
+    stop_event = ctx.Event()
+    env_steps = ctx.Value("q", 0)
+
+    memory = SharedReplayBuffer(agent.memory_capacity, agent.state_size, buffer_lock)
+    agent.memory = memory # learner 直接從共享記憶庫取樣
+    weights = agent.model.get_weights()
+    shared_weights = SharedWeights([w.shape for w in weights], weights_lock)
+    shared_weights.publish(weights)
+
+    actors = []
+    for i in range(num_actors):
+        epsilon = actor_epsilon(i, num_actors)
+        proc = ctx.Process(
+            target=actor_main, name=f"apex-actor-{i}",
+            args=(i, base_seed + i, epsilon, tls_ids, memory.spec, shared_weights.spec, buffer_lock, weights_lock,
+                  stop_event, env_steps, warm_start, num_actors))
+        proc.start()
+        actors.append(proc)
+        print(f"🎬 actor {i}: seed={base_seed + i} epsilon={epsilon:.4f}", flush=True)
+
+    start = time.perf_counter()
+    updates = 0
+    try:
+        while updates < total_updates:
+            if len(memory) <= batch_size:
+                if not any(proc.is_alive() for proc in actors):
+                    print("❌ 所有 actor 都已結束，停止訓練。")
+                    break
+                time.sleep(0.5)
+                continue
+            agent.replay(batch_size)
+            updates += 1
+            if updates % PUBLISH_INTERVAL == 0:
+                shared_weights.publish(agent.model.get_weights())
+            if updates % REPORT_INTERVAL == 0:
+                elapsed = time.perf_counter() - start
+                print(f"更新: {updates}/{total_updates} | 記憶庫: {len(memory)} | 模擬步數合計: {env_steps.value} "
+                      f"| {updates / elapsed:.1f} 更新/秒 | {env_steps.value / elapsed:.1f} 模擬步/秒", flush=True)
+    except KeyboardInterrupt:
+        print("中斷訓練，正在儲存模型...")
+    finally:
+        stop_event.set()
+        for proc in actors:
+            proc.join(timeout=30)
+            if proc.is_alive():
+                proc.terminate()
+        agent.save_model()
+        agent.memory = None
+        memory.close()
+        shared_weights.close()
+
+
+if __name__ == "__main__":
+    if 'SUMO_HOME' not in os.environ:
+        sys.exit("請確認 SUMO_HOME 環境變數已設定！")
+    from RL_controller import resolve_tls_ids, DEFAULT_TRAFFIC_LIGHT_ID
+    from tls_topology import load_topology_for_sumocfg
+
+    parser = argparse.ArgumentParser(description="Ape-X 式分散訓練：多個 actor 行程 + 一個 learner")
+    parser.add_argument("instance_id", help="模型 ID (決定 model_<id>.h5 檔名)")
+    parser.add_argument("--actors", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="actor 行程數 (預設為 CPU 核心數 - 1，留一個給 learner)")
+    parser.add_argument("--updates", type=int, default=20000, help="learner 的學習更新次數")
+    parser.add_argument("--tls", default=DEFAULT_TRAFFIC_LIGHT_ID, help="要控制的號誌 ID，逗號分隔或 'all'")
+    parser.add_argument("--seed", type=int, default=42, help="第一個 actor 的種子，其餘依序遞增")
+    parser.add_argument("--warm-start", action="store_true", help="每個 episode 從穩定負載的快照開始")
+    args = parser.parse_args()
+    tls_ids = resolve_tls_ids(args.tls, load_topology_for_sumocfg(SUMO_CONFIG_FILE))
+    train_apex(args.instance_id, args.actors, args.updates, tls_ids, args.seed, args.warm_start)
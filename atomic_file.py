@@ -0,0 +1,31 @@
+"""
+原子寫檔：先寫到同目錄的暫存檔 (<path>.<pid>.tmp) 再以 os.replace 取代目標檔。
+
+中斷或其他行程同時讀取時只會看到舊檔或完整的新檔，不會讀到寫到一半的內容；
+寫入失敗時刪除暫存檔，目標檔保持不變。
+"""
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_path(path, suffix=""):
+    """
+    產生暫存檔路徑，區塊正常結束後原子替換成 path；適合由外部程式 (例如 SUMO 的
+    saveState) 寫檔的情況。suffix 附加在暫存檔名後 (SUMO 依副檔名決定狀態檔格式)。
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp{suffix}"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", encoding="utf-8"):
+    """以 open(暫存檔, mode) 寫入，關檔後原子替換成 path；二進位模式 ("wb") 不使用 encoding"""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
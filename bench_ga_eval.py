@@ -0,0 +1,96 @@
+"""
+比較 GA 固定時制評估的兩種方式 (每個候選解的耗時與適應度是否一致)：
+
++ traci     : 與 GA.py 相同，啟動 SUMO、setProgramLogic 後以 simulationStep 逐步跑完
++ subprocess: 號誌程式寫成 tlLogic 附加檔，直接以子行程執行 sumo，不經過 TraCI
+
+用法: python bench_ga_eval.py [--candidates 5] [--seed 42] [--max-steps 100000]
+"""
+import argparse
+import os
+import random
+import time
+
+from sim_fitness import statistic_output_options, total_time_loss
+from sumo_backend import SumoBackend
+from sumo_snapshot import SIM_OPTIONS
+from tls_program_eval import run_fixed_time
+from tls_topology import load_topology_for_sumocfg, green_phase_indices
+
+SUMO_CONFIG_FILE = "osm.sumocfg"
+TRAFFIC_LIGHT_ID = "1253678773"
+TIME_MIN = 5
+TIME_MAX = 100
+WORK_DIR = os.path.join(".cache", "bench_ga_eval")
+
+
+def candidate_phases(tls_info, genome):
+    """與 GA.py 相同的四相位固定時制"""
+    green = green_phase_indices(tls_info)
+    phases = tls_info["phases"]
+    return [
+        (genome[0], phases[green[0]]["state"]),
+        (1, phases[green[0] + 1]["state"]),
+        (genome[1], phases[green[1]]["state"]),
+        (3, phases[(green[1] + 1) % len(phases)]["state"]),
+    ]
+
+
+def run_traci(sumo, phases, seed, max_steps):
+    stats_path = os.path.join(WORK_DIR, f"traci_{os.getpid()}.stats.xml")
+    cmd = ["sumo", "-c", SUMO_CONFIG_FILE, "--seed", str(seed)] + SIM_OPTIONS + statistic_output_options(stats_path)
+    sumo.start(cmd, label=f"bench_ga_{os.getpid()}")
+    try:
+        sumo.set_program(TRAFFIC_LIGHT_ID, "ga_prog", phases)
+        step = 0
+        while step < max_steps and sumo.simulation.getMinExpectedNumber() > 0:
+            sumo.simulationStep()
+            step += 1
+    finally:
+        sumo.close()
+    try:
+        return total_time_loss(stats_path)
+    finally:
+        os.remove(stats_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 TraCI 逐步評估與子行程評估的耗時")
+    parser.add_argument("--candidates", type=int, default=5, help="隨機候選解的數量")
+    parser.add_argument("--seed", type=int, default=42, help="SUMO 種子 (候選解也以此種子產生)")
+    parser.add_argument("--max-steps", type=int, default=100000, help="每次評估最多模擬的秒數")
+    args = parser.parse_args()
+
+    os.makedirs(WORK_DIR, exist_ok=True)
+    tls_info = load_topology_for_sumocfg(SUMO_CONFIG_FILE)[TRAFFIC_LIGHT_ID]
+    rng = random.Random(args.seed)
+    genomes = [(rng.randint(TIME_MIN, TIME_MAX), rng.randint(TIME_MIN, TIME_MAX)) for _ in range(args.candidates)]
+    sumo = SumoBackend("sumo")
+
+    totals = {"traci": 0.0, "subprocess": 0.0}
+    for genome in genomes:
+        phases = candidate_phases(tls_info, genome)
+
+        start = time.perf_counter()
+        traci_delay = run_traci(sumo, phases, args.seed, args.max_steps)
+        traci_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sub_delay = run_fixed_time(SUMO_CONFIG_FILE, TRAFFIC_LIGHT_ID, phases,
+                                   os.path.join(WORK_DIR, f"sub_{os.getpid()}"), seed=args.seed,
+                                   sim_options=SIM_OPTIONS, max_steps=args.max_steps)
+        sub_seconds = time.perf_counter() - start
+
+        totals["traci"] += traci_seconds
+        totals["subprocess"] += sub_seconds
+        print(f"{genome}: {sumo.name} {traci_seconds:.2f}s (延遲 {traci_delay:.2f}) | "
+              f"subprocess {sub_seconds:.2f}s (延遲 {sub_delay:.2f}) | 差異 {sub_delay - traci_delay:+.2f}",
+              flush=True)
+
+    n = len(genomes)
+    print(f"\n平均每個候選解：{sumo.name} {totals['traci'] / n:.2f}s | subprocess {totals['subprocess'] / n:.2f}s "
+          f"| 加速 {totals['traci'] / max(totals['subprocess'], 1e-9):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
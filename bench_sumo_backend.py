@@ -0,0 +1,76 @@
+"""
+比較 libsumo (行程內) 與 traci (TCP socket) 在 osm.sumocfg 上的每步耗時。
+
+每一步都執行與 RL_controller 相同的觀測更新 (TLSObserver.step)，並在每個決策點
+讀取號誌資訊，模擬控制迴圈真實的呼叫模式。
+
+用法: python bench_sumo_backend.py [步數]
+"""
+import os
+import subprocess
+import sys
+import time
+
+from tls_topology import load_topology_for_sumocfg, lanes_by_tls
+
+SUMO_CONFIG_FILE = "osm.sumocfg"
+TRAFFIC_LIGHT_ID = "1253678773"
+DECISION_INTERVAL = 5
+
+
+def run_backend(name, steps):
+    """在目前行程中以指定後端跑 steps 步，回傳每步平均毫秒數"""
+    from sumo_backend import SumoBackend
+    from tls_observation import TLSObserver
+
+    sumo = SumoBackend("sumo", prefer=name)
+    if sumo.name != name:
+        return None
+    topology = load_topology_for_sumocfg(SUMO_CONFIG_FILE)
+    sumo.start(["sumo", "-c", SUMO_CONFIG_FILE, "--seed", "42", "--time-to-teleport", "300",
+                "--tripinfo-output", os.devnull, "--stop-output", os.devnull, "--statistic-output", os.devnull,
+                "--no-step-log", "true", "--verbose", "false"], label=f"bench_{name}")
+    observer = TLSObserver(TRAFFIC_LIGHT_ID, conn=sumo, lanes_by_tls=lanes_by_tls(topology, [TRAFFIC_LIGHT_ID]))
+    observer.subscribe()
+
+    start = time.perf_counter()
+    done = 0
+    for step in range(1, steps + 1):
+        if observer.min_expected_number() <= 0:
+            break
+        observer.step()
+        if step % DECISION_INTERVAL == 0:
+            observer.queue_lengths(TRAFFIC_LIGHT_ID)
+            observer.total_waiting_time(TRAFFIC_LIGHT_ID)
+            sumo.trafficlight.getNextSwitch(TRAFFIC_LIGHT_ID)
+            sumo.trafficlight.getPhase(TRAFFIC_LIGHT_ID)
+        done = step
+    elapsed = time.perf_counter() - start
+    sumo.close()
+    return elapsed / max(done, 1) * 1000.0
+
+
+def main():
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 3600
+    if len(sys.argv) > 1 and sys.argv[1] in ("libsumo", "traci"):
+        # 子行程模式：只跑一個後端並輸出結果 (libsumo 每個行程只能有一個模擬)
+        ms = run_backend(sys.argv[1], steps)
+        print("unavailable" if ms is None else f"{ms:.6f}")
+        return
+
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 3600
+    results = {}
+    for name in ("traci", "libsumo"):
+        out = subprocess.run([sys.executable, __file__, name, str(steps)],
+                             capture_output=True, text=True).stdout.strip().splitlines()
+        value = out[-1] if out else "unavailable"
+        results[name] = None if value == "unavailable" else float(value)
+        shown = "無法使用" if results[name] is None else f"{results[name]:.3f} ms/步"
+        print(f"{name:8s}: {shown}", flush=True)
+
+    if results.get("traci") and results.get("libsumo"):
+        print(f"libsumo 加速倍數: {results['traci'] / results['libsumo']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
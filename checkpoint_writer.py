@@ -0,0 +1,115 @@
+import glob
+import os
+import queue
+import threading
+
+import numpy as np # pyright: ignore[reportMissingImports]
+
+from atomic_file import atomic_write
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+class CheckpointWriter:
+    """
+    在背景執行緒寫入 DQNAgent 的檢查點，控制迴圈只需交出權重快照 (NumPy 陣列)。
+
+    + 權重檢查點 ckpt_<id>_<訓練次數>.npz：主網路權重 (arr_0, arr_1, ...，可直接以
+      NumpyPolicy.load 載入) + train_counter / exploration_rate
+    + 完整檢查點 full_<id>_<訓練次數>.npz：再加上目標網路 (target_i) 與優化器狀態 (opt_i)
+    + 以 atomic_write 先寫暫存檔再替換，中斷時不會留下寫到一半的檢查點
+    + 各自只保留最新的 keep / keep_full 個檔案
+    寫入跟不上時只保留最新的快照，較舊的待寫快照直接丟棄 (dropped 計數)。
+    """
+
+    def __init__(self, instance_id, directory=None, keep=5, keep_full=2):
+        # list(kind)[:-0] 是空的切片，keep=0 會變成全部保留；至少要保留剛寫好的那一個
+        if keep < 1 or keep_full < 1:
+            raise ValueError(f"keep ({keep}) 與 keep_full ({keep_full}) 至少要是 1")
+        self.instance_id = instance_id
+        self.directory = directory or os.path.join(CHECKPOINT_DIR, instance_id)
+        self.keep = keep
+        self.keep_full = keep_full
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = queue.Queue(maxsize=1)
+        self._thread = threading.Thread(target=self._run, name=f"checkpoint-writer-{instance_id}", daemon=True)
+        self._thread.start()
+
+    def path(self, kind, train_counter):
+        return os.path.join(self.directory, f"{kind}_{self.instance_id}_{train_counter:09d}.npz")
+
+    def submit(self, train_counter, exploration_rate, weights, target_weights=None, optimizer_state=None):
+        """交出一份快照 (不阻塞)；有 target_weights 與 optimizer_state 時寫成完整檢查點"""
+        arrays = {f"arr_{i}": w for i, w in enumerate(weights)}
+        if target_weights is not None:
+            arrays.update({f"target_{i}": w for i, w in enumerate(target_weights)})
+            arrays.update({f"opt_{i}": v for i, v in enumerate(optimizer_state or [])})
+        arrays["train_counter"] = np.int64(train_counter)
+        arrays["exploration_rate"] = np.float64(exploration_rate)
+        kind = "full" if target_weights is not None else "ckpt"
+        item = (self.path(kind, train_counter), kind, arrays)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                path, kind, arrays = item
+                self._write(path, arrays)
+                self._prune(kind, self.keep_full if kind == "full" else self.keep)
+                self.written += 1
+            except Exception as e:
+                self.error = e
+                print(f"❌ 檢查點寫入失敗: {e}", flush=True)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, arrays):
+        with atomic_write(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    def _prune(self, kind, keep):
+        for old in self.list(kind)[:-keep]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def list(self, kind):
+        """依訓練次數由舊到新排列的檢查點路徑"""
+        return sorted(glob.glob(os.path.join(self.directory, f"{kind}_{self.instance_id}_*.npz")))
+
+    def flush(self):
+        """等待所有已交出的快照寫完"""
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+
+def latest_checkpoint(instance_id, directory=None):
+    """回傳訓練次數最大的檢查點路徑 (權重或完整)，沒有時回傳 None"""
+    directory = directory or os.path.join(CHECKPOINT_DIR, instance_id)
+    paths = glob.glob(os.path.join(directory, f"ckpt_{instance_id}_*.npz"))
+    paths += glob.glob(os.path.join(directory, f"full_{instance_id}_*.npz"))
+    if not paths:
+        return None
+    # 同一訓練次數同時有兩種檔案時優先使用完整檢查點
+    return max(paths, key=lambda p: (os.path.basename(p).rsplit("_", 1)[1], os.path.basename(p).startswith("full")))
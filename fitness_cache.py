@@ -0,0 +1,126 @@
+import hashlib
+import os
+import sqlite3
+import xml.etree.ElementTree as ET
+
+from tls_topology import file_sha1
+
+CACHE_PATH = os.path.join(".cache", "ga_fitness.sqlite")
+# 快取格式版本：修改評估方式 (例如適應度的計算) 時遞增，舊結果自動失效
+CACHE_FORMAT_VERSION = 1
+DEFAULT_SEED = -1 # 沒有指定 --seed 時 (使用 SUMO 預設種子) 存成 -1
+
+
+def sumocfg_input_files(sumocfg_path):
+    """sumocfg 本身 + net-file、route-files、additional-files (相對於 sumocfg 所在目錄)"""
+    root = ET.parse(sumocfg_path).getroot()
+    base = os.path.dirname(os.path.abspath(sumocfg_path))
+    files = [sumocfg_path]
+    for tag in ("net-file", "route-files", "additional-files"):
+        for elem in root.iter(tag):
+            value = elem.attrib.get("value", "")
+            files.extend(os.path.join(base, f.strip()) for f in value.split(",") if f.strip())
+    return files
+
+
+def evaluation_context(sumocfg_path, sim_options=(), extra=""):
+    """
+    評估情境的雜湊：sumocfg/路網/路線/附加檔的內容 + 模擬參數 + extra
+    (號誌程式的格式、模擬長度等評估函式本身的設定)。任一項改變就是新的情境。
+    """
+    h = hashlib.sha1()
+    h.update(f"v{CACHE_FORMAT_VERSION}|{extra}|".encode())
+    h.update(" ".join(map(str, sim_options)).encode())
+    for path in sumocfg_input_files(sumocfg_path):
+        h.update(os.path.basename(path).encode())
+        if os.path.exists(path):
+            h.update(file_sha1(path).encode())
+    return h.hexdigest()[:16]
+
+
+class FitnessCache:
+    """
+    以 SQLite 儲存的 GA 適應度快取，鍵為 (情境雜湊, phase1, phase2, seed)。
+
+    同一個資料庫檔案由所有 worker 行程與之後的執行共用 (WAL 模式，可同時讀寫)；
+    連線在每個行程第一次使用時才建立，fork 出來的 worker 不會沿用父行程的連線。
+    只快取成功的評估 (適應度 >= 0)。
+    """
+
+    def __init__(self, context, path=CACHE_PATH):
+        self.context = context
+        self.path = path
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fitness ("
+                " context TEXT NOT NULL, phase1 INTEGER NOT NULL, phase2 INTEGER NOT NULL,"
+                " seed INTEGER NOT NULL, fitness REAL NOT NULL,"
+                " PRIMARY KEY (context, phase1, phase2, seed))")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, genome, seed=DEFAULT_SEED):
+        row = self._connection().execute(
+            "SELECT fitness FROM fitness WHERE context=? AND phase1=? AND phase2=? AND seed=?",
+            (self.context, int(genome[0]), int(genome[1]), seed)).fetchone()
+        return None if row is None else row[0]
+
+    def get_many(self, genomes, seed=DEFAULT_SEED):
+        """回傳 {(phase1, phase2): 適應度}，只包含已快取的基因"""
+        found = {}
+        conn = self._connection()
+        for genome in genomes:
+            key = (int(genome[0]), int(genome[1]))
+            row = conn.execute(
+                "SELECT fitness FROM fitness WHERE context=? AND phase1=? AND phase2=? AND seed=?",
+                (self.context, key[0], key[1], seed)).fetchone()
+            if row is not None:
+                found[key] = row[0]
+        return found
+
+    def put(self, genome, fitness, seed=DEFAULT_SEED):
+        if fitness is None or fitness < 0: # 評估失敗不快取
+            return
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO fitness VALUES (?, ?, ?, ?, ?)",
+                     (self.context, int(genome[0]), int(genome[1]), seed, float(fitness)))
+        conn.commit()
+
+
+def evaluate_with_cache(individuals, evaluate_many, cache, seed=DEFAULT_SEED):
+    """
+    先查快取、同一代重複的基因只評估一次，其餘交給 evaluate_many (例如 executor.map)。
+    回傳 (適應度 tuple 列表, 統計 dict)；統計含 total / hits / duplicates / evaluated。
+    """
+    keys = [(int(ind[0]), int(ind[1])) for ind in individuals]
+    unique = list(dict.fromkeys(keys))
+    known = cache.get_many(unique, seed)
+    todo = [key for key in unique if key not in known]
+    for key, fit in zip(todo, evaluate_many(todo)):
+        known[key] = fit[0]
+    stats = {
+        "total": len(keys),
+        "hits": len(unique) - len(todo),
+        "duplicates": len(keys) - len(unique),
+        "evaluated": len(todo),
+    }
+    return [(known[key],) for key in keys], stats
+
+
+def format_cache_stats(stats):
+    total = stats["total"]
+    rate = (total - stats["evaluated"]) / total * 100 if total else 0.0
+    return (f"適應度快取：{stats['hits']} 個基因命中，{stats['duplicates']} 個同代重複，"
+            f"實際模擬 {stats['evaluated']}/{total} (省下 {rate:.1f}%)")
@@ -0,0 +1,238 @@
+import collections
+import time
+from multiprocessing import shared_memory
+
+import numpy as np # pyright: ignore[reportMissingImports]
+
+
+class NumpyPolicy:
+    """
+    DQN 主網路 (Dense-ReLU-Dense-ReLU-Dense-linear) 的純 NumPy 前向傳播。
+
+    權重格式與 Keras model.get_weights() 相同：[W1, b1, W2, b2, ..., Wn, bn]。
+    單一狀態的決策只是幾個小矩陣乘法，不經過 Keras 的 predict 資料管線，
+    也不需要 import TensorFlow。
+    """
+
+    def __init__(self, weights=None):
+        self.layers = []
+        if weights is not None:
+            self.set_weights(weights)
+
+    def set_weights(self, weights):
+        # 預先轉成 float32 的連續陣列，之後每次決策不再轉型
+        self.layers = [
+            (np.ascontiguousarray(weights[i], dtype=np.float32),
+             np.ascontiguousarray(weights[i + 1], dtype=np.float32))
+            for i in range(0, len(weights), 2)
+        ]
+
+    def get_weights(self):
+        weights = []
+        for kernel, bias in self.layers:
+            weights.extend([kernel, bias])
+        return weights
+
+    @property
+    def state_size(self):
+        return self.layers[0][0].shape[0]
+
+    def q_values_batch(self, states):
+        x = np.asarray(states, dtype=np.float32)
+        last = len(self.layers) - 1
+        for i, (kernel, bias) in enumerate(self.layers):
+            x = x @ kernel + bias
+            if i < last:
+                np.maximum(x, 0.0, out=x) # ReLU
+        return x
+
+    def q_values(self, state):
+        return self.q_values_batch(np.asarray(state, dtype=np.float32)[None, :])[0]
+
+    def act(self, state):
+        return int(np.argmax(self.q_values(state)))
+
+    def save(self, path):
+        """匯出成 .npz (給不需要 TensorFlow 的推論使用)"""
+        np.savez(path, *self.get_weights())
+
+    @classmethod
+    def load(cls, path):
+        # 只讀 arr_i (檢查點檔案中還有目標網路、優化器與訓練進度等其他欄位)
+        with np.load(path) as data:
+            count = sum(1 for name in data.files if name.startswith("arr_"))
+            return cls([data[f"arr_{i}"] for i in range(count)])
+
+
+class QValueCache:
+    """
+    以狀態 tuple 為鍵的 LRU Q 值快取。
+
+    get_state 產生的狀態是整數排隊數 + 相位 + 常數，交通量低時同樣的狀態反覆出現；
+    命中時完全不做前向傳播。網路權重改變時必須 clear()。maxsize=0 表示停用。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def q_values_batch(self, policy, states):
+        """回傳 states 每一列的 Q 值；只有快取未命中的狀態合併成一次前向傳播"""
+        if not self.maxsize:
+            return policy.q_values_batch(states)
+        entries = self._entries
+        keys = [state if isinstance(state, tuple) else tuple(state) for state in states]
+        rows = []
+        missing = []
+        for i, key in enumerate(keys):
+            row = entries.get(key)
+            if row is None:
+                missing.append(i)
+            else:
+                entries.move_to_end(key)
+            rows.append(row)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            computed = policy.q_values_batch([keys[i] for i in missing])
+            for row, i in zip(computed, missing):
+                rows[i] = row
+                entries[keys[i]] = row
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+        return np.stack(rows)
+
+    def report(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return "Q 值快取：尚無查詢"
+        return (f"Q 值快取：命中 {self.hits}/{total} ({self.hits / total * 100:.1f}%)，"
+                f"目前 {len(self._entries)} 筆 (上限 {self.maxsize})")
+
+
+class DecisionLatencyStats:
+    """決策延遲統計 (秒)；DQNAgent 與 NumpyPolicyAgent 共用"""
+
+    decision_count = 0
+    decision_time_total = 0.0
+    decision_time_max = 0.0
+
+    def _record_decision_latency(self, elapsed):
+        self.decision_count += 1
+        self.decision_time_total += elapsed
+        if elapsed > self.decision_time_max:
+            self.decision_time_max = elapsed
+
+    def latency_report(self):
+        """回傳決策延遲的摘要字串"""
+        if self.decision_count == 0:
+            return "決策延遲：尚無網路決策紀錄"
+        mean_ms = self.decision_time_total / self.decision_count * 1000.0
+        return (f"決策延遲：{self.decision_count} 次網路決策，平均 {mean_ms:.4f} ms，"
+                f"最大 {self.decision_time_max * 1000.0:.4f} ms")
+
+
+class NumpyPolicyAgent(DecisionLatencyStats):
+    """
+    只做推論的代理 (測試模式用)：從匯出的 policy_<id>.npz 載入權重，
+    提供 RL_controller 控制迴圈需要的 DQNAgent 介面，完全不 import TensorFlow。
+    """
+
+    def __init__(self, policy, action_space, instance_id="default_rl", q_cache_size=4096):
+        self.policy = policy
+        self.action_space = action_space
+        self.action_size = len(action_space)
+        self.instance_id = instance_id
+        self.state_size = policy.state_size
+        self.exploration_rate = 0.0
+        # 權重固定不變，快取不需要失效
+        self.q_cache = QValueCache(q_cache_size)
+
+    @classmethod
+    def load(cls, path, action_space, instance_id="default_rl"):
+        return cls(NumpyPolicy.load(path), action_space, instance_id)
+
+    def build_models(self):
+        """權重已固定；只檢查狀態維度與匯出的網路相符"""
+        if self.state_size != self.policy.state_size:
+            raise ValueError(f"狀態維度 {self.state_size} 與匯出的網路 ({self.policy.state_size}) 不符")
+
+    def choose_actions(self, states):
+        n = len(states)
+        actions = np.asarray(self.action_space)[np.random.randint(self.action_size, size=n)]
+        greedy = np.random.rand(n) > self.exploration_rate
+        if greedy.any():
+            start = time.perf_counter()
+            rows = [states[i] for i in np.flatnonzero(greedy)]
+            actions[greedy] = np.argmax(self.q_cache.q_values_batch(self.policy, rows), axis=1)
+            self._record_decision_latency(time.perf_counter() - start)
+        return [int(a) for a in actions]
+
+    def choose_action(self, state):
+        return self.choose_actions([state])[0]
+
+    def cache_report(self):
+        return self.q_cache.report()
+
+
+class SharedWeights:
+    """
+    learner 行程發布、actor 行程讀取的網路權重 (共享記憶體中的一個 float32 平坦陣列)。
+
+    publish() 在 lock 內寫入權重並把版本號 +1；actor 以 read_if_newer() 檢查版本，
+    只有權重更新過才複製一份並還原成 [W1, b1, ...] 的形狀。
+    """
+
+    def __init__(self, shapes, lock, name=None):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.lock = lock
+        self.owner = name is None
+        count = sum(self.sizes)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=8 + count * 4)
+        self.version = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.flat = np.ndarray((count,), dtype=np.float32, buffer=self.shm.buf, offset=8)
+        if self.owner:
+            self.version[0] = 0
+
+    @property
+    def spec(self):
+        return {"shapes": self.shapes, "name": self.shm.name}
+
+    @classmethod
+    def attach(cls, spec, lock):
+        return cls(spec["shapes"], lock, name=spec["name"])
+
+    def publish(self, weights):
+        with self.lock:
+            self.flat[:] = np.concatenate([np.ravel(w) for w in weights])
+            self.version[0] += 1
+
+    def read_if_newer(self, known_version):
+        """回傳 (版本, 權重列表)；版本沒變時權重為 None"""
+        if int(self.version[0]) == known_version:
+            return known_version, None
+        with self.lock:
+            version = int(self.version[0])
+            flat = self.flat.copy()
+        weights = []
+        offset = 0
+        for shape, size in zip(self.shapes, self.sizes):
+            weights.append(flat[offset:offset + size].reshape(shape))
+            offset += size
+        return version, weights
+
+    def close(self):
+        self.version = None
+        self.flat = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,299 @@
+"""
+把訓練好的 DQN 蒸餾成部署用的常數時間策略 (不需要任何 ML 執行環境)。
+
++ 量化查表：排隊數以 bin_width 分箱 (超過 max_bin 視為同一箱) + 相位 → 動作，
+  每一格取網路在該格紀錄狀態上的多數決
++ 淺層決策樹 (CART，Gini)：直接以 get_state 的特徵擬合網路的 argmax 動作，
+  負責查表沒有涵蓋的狀態
++ 擬合度報告：在紀錄的狀態 (replay_<id>/ 持久化記憶庫) 上與網路的一致率，
+  含保留集 (hold-out) 與各相位的一致率
+
+輸出 distilled_<id>.json；RL_controller 測試模式加 --distilled 即以純 Python 執行。
+
+用法: python policy_distill.py my_model [--max-depth 8] [--min-leaf 5] [--bin-width 2] [--max-bin 15]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np # pyright: ignore[reportMissingImports]
+
+from atomic_file import atomic_write
+from numpy_policy import NumpyPolicy, DecisionLatencyStats
+
+ARTIFACT_FORMAT_VERSION = 1
+MAX_THRESHOLDS = 64 # 每個特徵最多嘗試的切分點數 (取分位數)
+
+
+def quantise_key(state, bin_width, max_bin):
+    """查表用的鍵：排隊數分箱 + 相位 (最後一個特徵 GA 建議值由相位決定，不列入)"""
+    lanes = state[:-2]
+    return tuple(min(int(q) // bin_width, max_bin) for q in lanes) + (int(state[-2]),)
+
+
+def _gini_split(values, y, counts, n_actions, min_leaf):
+    """回傳 (加權 Gini, 切分點)；沒有合法切分時回傳 None"""
+    unique = np.unique(values)
+    if len(unique) < 2:
+        return None
+    thresholds = (unique[:-1] + unique[1:]) / 2.0
+    if len(thresholds) > MAX_THRESHOLDS:
+        thresholds = np.unique(np.quantile(thresholds, np.linspace(0, 1, MAX_THRESHOLDS)))
+    left_mask = values[None, :] <= thresholds[:, None]
+    left_counts = np.stack([(left_mask & (y == a)[None, :]).sum(axis=1) for a in range(n_actions)], axis=1)
+    right_counts = counts[None, :] - left_counts
+    n_left = left_counts.sum(axis=1).astype(np.float64)
+    n_right = right_counts.sum(axis=1).astype(np.float64)
+    valid = (n_left >= min_leaf) & (n_right >= min_leaf)
+    if not valid.any():
+        return None
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gini_left = n_left - (left_counts ** 2).sum(axis=1) / n_left
+        gini_right = n_right - (right_counts ** 2).sum(axis=1) / n_right
+    impurity = np.where(valid, gini_left + gini_right, np.inf)
+    best = int(np.argmin(impurity))
+    return float(impurity[best]), float(thresholds[best])
+
+
+def fit_tree(X, y, n_actions, max_depth=8, min_leaf=5):
+    """
+    以 Gini 擬合淺層分類樹。節點格式：[特徵, 切分點, 左子節點, 右子節點, 動作]，
+    葉節點的特徵為 -1。特徵值 <= 切分點走左邊。
+    """
+    nodes = []
+
+    def build(indices, depth):
+        node_id = len(nodes)
+        nodes.append(None)
+        labels = y[indices]
+        counts = np.bincount(labels, minlength=n_actions)
+        majority = int(np.argmax(counts))
+        n = len(indices)
+        parent_impurity = n - (counts ** 2).sum() / n
+        if depth >= max_depth or counts.max() == n or n < 2 * min_leaf:
+            nodes[node_id] = [-1, 0.0, -1, -1, majority]
+            return node_id
+
+        best = None
+        for feature in range(X.shape[1]):
+            split = _gini_split(X[indices, feature], labels, counts, n_actions, min_leaf)
+            if split is not None and (best is None or split[0] < best[0]):
+                best = (split[0], feature, split[1])
+        if best is None or best[0] >= parent_impurity - 1e-9:
+            nodes[node_id] = [-1, 0.0, -1, -1, majority]
+            return node_id
+
+        _, feature, threshold = best
+        goes_left = X[indices, feature] <= threshold
+        left = build(indices[goes_left], depth + 1)
+        right = build(indices[~goes_left], depth + 1)
+        nodes[node_id] = [feature, threshold, left, right, majority]
+        return node_id
+
+    build(np.arange(len(y)), 0)
+    return nodes
+
+
+def tree_action(nodes, state):
+    i = 0
+    while True:
+        feature, threshold, left, right, action = nodes[i]
+        if feature < 0:
+            return action
+        i = left if state[feature] <= threshold else right
+
+
+def tree_depth(nodes, i=0):
+    feature, _, left, right, _ = nodes[i]
+    if feature < 0:
+        return 0
+    return 1 + max(tree_depth(nodes, left), tree_depth(nodes, right))
+
+
+def build_table(states, labels, n_actions, bin_width, max_bin):
+    """每個量化格子取網路動作的多數決"""
+    votes = {}
+    for state, label in zip(states, labels):
+        key = quantise_key(state, bin_width, max_bin)
+        cell = votes.get(key)
+        if cell is None:
+            cell = votes[key] = [0] * n_actions
+        cell[label] += 1
+    return {key: max(range(n_actions), key=cell.__getitem__) for key, cell in votes.items()}
+
+
+def load_recorded_states(memory_dir):
+    """讀取持久化記憶庫中的 states / next_states (只取有效的筆數)"""
+    with open(os.path.join(memory_dir, "meta.json"), encoding="utf-8") as f:
+        size = json.load(f)["size"]
+    states = np.load(os.path.join(memory_dir, "states.npy"), mmap_mode="r")[:size]
+    next_states = np.load(os.path.join(memory_dir, "next_states.npy"), mmap_mode="r")[:size]
+    return np.concatenate([states, next_states]).astype(np.float32)
+
+
+def load_teacher(instance_id, state_size):
+    """
+    優先讀取匯出的 policy_<id>.npz；只有 .h5 時以 TensorFlow 載入後匯出。
+    state_size 取自紀錄的狀態 (多路口模型為 STATE_LANE_COUNT + 2，不是固定的 6)。
+    """
+    policy_filename = f"policy_{instance_id}.npz"
+    if not os.path.exists(policy_filename):
+        from DQN_RL_Agent import DQNAgent
+        agent = DQNAgent(state_size=state_size, action_space=[0, 1], instance_id=instance_id)
+        if not agent.load_model():
+            raise FileNotFoundError(f"找不到模型檔案 model_{instance_id}.h5")
+        agent.export_policy()
+    return NumpyPolicy.load(policy_filename)
+
+
+def distill(instance_id, states, max_depth=8, min_leaf=5, bin_width=2, max_bin=15, holdout=0.2, seed=0):
+    """回傳可寫成 JSON 的蒸餾策略 (含擬合度報告)"""
+    teacher = load_teacher(instance_id, states.shape[1])
+    if states.shape[1] != teacher.state_size:
+        raise ValueError(f"紀錄狀態的維度 {states.shape[1]} 與網路輸入 ({teacher.state_size}) 不符")
+    labels = np.argmax(teacher.q_values_batch(states), axis=1)
+    n_actions = teacher.layers[-1][1].shape[0]
+
+    order = np.random.default_rng(seed).permutation(len(states))
+    n_test = int(len(states) * holdout)
+    test_idx, train_idx = order[:n_test], order[n_test:]
+
+    nodes = fit_tree(states[train_idx], labels[train_idx], n_actions, max_depth, min_leaf)
+    table = build_table(states[train_idx], labels[train_idx], n_actions, bin_width, max_bin)
+
+    def agreement(indices, use_table):
+        if len(indices) == 0:
+            return None
+        hits = 0
+        for i in indices:
+            state = states[i]
+            action = table.get(quantise_key(state, bin_width, max_bin)) if use_table else None
+            if action is None:
+                action = tree_action(nodes, state)
+            hits += int(action == labels[i])
+        return hits / len(indices)
+
+    all_idx = np.arange(len(states))
+    phases = states[:, -2].astype(int)
+    fidelity = {
+        "states": int(len(states)),
+        "holdout_states": int(n_test),
+        "tree_agreement": agreement(all_idx, False),
+        "tree_agreement_holdout": agreement(test_idx, False),
+        "table_agreement": agreement(all_idx, True),
+        "table_agreement_holdout": agreement(test_idx, True),
+        "per_phase_agreement": {str(p): agreement(np.flatnonzero(phases == p), True) for p in np.unique(phases)},
+        "tree_nodes": len(nodes),
+        "tree_depth": tree_depth(nodes),
+        "table_cells": len(table),
+    }
+    return {
+        "format": ARTIFACT_FORMAT_VERSION,
+        "instance_id": instance_id,
+        "state_size": int(teacher.state_size),
+        "bin_width": bin_width,
+        "max_bin": max_bin,
+        "tree": nodes,
+        "table": [list(key) + [action] for key, action in table.items()],
+        "fidelity": fidelity,
+    }
+
+
+class DistilledPolicyAgent(DecisionLatencyStats):
+    """
+    以蒸餾出的查表 + 決策樹做決策的代理 (純 Python，不需要 NumPy 以外的套件)。
+    介面與 NumpyPolicyAgent 相同，RL_controller 測試模式可直接替換。
+    """
+
+    def __init__(self, artifact, action_space, instance_id="default_rl"):
+        self.action_space = action_space
+        self.instance_id = instance_id
+        self.state_size = artifact["state_size"]
+        self.artifact_state_size = artifact["state_size"]
+        self.exploration_rate = 0.0
+        self.bin_width = artifact["bin_width"]
+        self.max_bin = artifact["max_bin"]
+        self.nodes = [tuple(node) for node in artifact["tree"]]
+        self.table = {tuple(row[:-1]): row[-1] for row in artifact["table"]}
+        self.fidelity = artifact.get("fidelity", {})
+        self.table_hits = 0
+        self.tree_decisions = 0
+
+    @classmethod
+    def load(cls, path, action_space, instance_id="default_rl"):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), action_space, instance_id)
+
+    def build_models(self):
+        """策略已固定；只檢查狀態維度與蒸餾時相符"""
+        if self.state_size != self.artifact_state_size:
+            raise ValueError(f"狀態維度 {self.state_size} 與蒸餾策略 ({self.artifact_state_size}) 不符")
+
+    def act(self, state):
+        action = self.table.get(quantise_key(state, self.bin_width, self.max_bin))
+        if action is not None:
+            self.table_hits += 1
+            return action
+        self.tree_decisions += 1
+        return tree_action(self.nodes, state)
+
+    def choose_actions(self, states):
+        start = time.perf_counter()
+        actions = [self.action_space[self.act(state)] for state in states]
+        self._record_decision_latency(time.perf_counter() - start)
+        return actions
+
+    def choose_action(self, state):
+        return self.choose_actions([state])[0]
+
+    def cache_report(self):
+        total = self.table_hits + self.tree_decisions
+        if total == 0:
+            return "蒸餾策略：尚無決策"
+        return (f"蒸餾策略：查表 {self.table_hits}/{total} ({self.table_hits / total * 100:.1f}%)，"
+                f"其餘由決策樹 (深度 {tree_depth(self.nodes)}) 決定")
+
+
+def print_report(fidelity):
+    def pct(value):
+        return "n/a" if value is None else f"{value * 100:.2f}%"
+    print(f"紀錄狀態: {fidelity['states']} 筆 (保留集 {fidelity['holdout_states']} 筆)")
+    print(f"決策樹: {fidelity['tree_nodes']} 個節點，深度 {fidelity['tree_depth']} | "
+          f"一致率 {pct(fidelity['tree_agreement'])} (保留集 {pct(fidelity['tree_agreement_holdout'])})")
+    print(f"查表 + 決策樹: {fidelity['table_cells']} 格 | "
+          f"一致率 {pct(fidelity['table_agreement'])} (保留集 {pct(fidelity['table_agreement_holdout'])})")
+    for phase, value in fidelity["per_phase_agreement"].items():
+        print(f"  相位 {phase}: {pct(value)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把訓練好的 DQN 蒸餾成查表 / 決策樹策略")
+    parser.add_argument("instance_id", help="模型 ID (model_<id>.h5 / policy_<id>.npz)")
+    parser.add_argument("--states", default=None, help="紀錄狀態的記憶庫目錄 (預設 replay_<id>)")
+    parser.add_argument("--max-depth", type=int, default=8)
+    parser.add_argument("--min-leaf", type=int, default=5)
+    parser.add_argument("--bin-width", type=int, default=2, help="排隊數分箱寬度 (輛)")
+    parser.add_argument("--max-bin", type=int, default=15, help="超過這個箱號的排隊數視為同一箱")
+    args = parser.parse_args()
+
+    memory_dir = args.states or f"replay_{args.instance_id}"
+    states = load_recorded_states(memory_dir)
+    artifact = distill(args.instance_id, states, args.max_depth, args.min_leaf, args.bin_width, args.max_bin)
+    path = f"distilled_{args.instance_id}.json"
+    with atomic_write(path) as f:
+        json.dump(artifact, f)
+    print_report(artifact["fidelity"])
+
+    agent = DistilledPolicyAgent(artifact, [0, 1], args.instance_id)
+    sample = [tuple(float(v) for v in state) for state in states[:1000]]
+    start = time.perf_counter()
+    for state in sample:
+        agent.act(state)
+    elapsed = time.perf_counter() - start
+    print(f"單次決策平均 {elapsed / max(len(sample), 1) * 1e6:.2f} µs (純 Python)")
+    print(f"✅ 已輸出 {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import json
+import os
+from multiprocessing import shared_memory
+
+import numpy as np # pyright: ignore[reportMissingImports]
+
+from atomic_file import atomic_write
+
+
+class ReplayBuffer:
+    """
+    以預先配置的 NumPy 陣列實作的環狀經驗回放記憶庫。
+
+    每筆經驗存成固定欄位：states / next_states (float32)、actions (int8)、
+    rewards (float32)、dones (bool)。新增是覆寫 pos 位置 (環狀)，
+    取樣是一次向量化的索引 (fancy indexing)，不再建立任何 Python tuple。
+
+    記憶體用量 (每筆) = 2 * state_size * 4 + 1 + 4 + 1 bytes。
+    以 state_size=6、容量 20000 為例：54 bytes * 20000 ≈ 1.1 MB；
+    原本 deque 中的 tuple-of-tuples 每筆約 400 bytes 以上 (外層 tuple、兩個
+    狀態 tuple 與其中的 float 物件)，同容量約 8 MB。
+
+    指定 storage_dir 時每個欄位改為 storage_dir 下的 .npy 記憶體映射檔
+    (np.lib.format.open_memmap)，flush() 寫出 pos/size 後，下次以相同參數建立
+    就會接續使用原本的內容；載入時只建立映射，不會把整個記憶庫讀進 RAM。
+    """
+
+    META_FILENAME = "meta.json"
+
+    def __init__(self, capacity, state_size, seed=None, storage_dir=None):
+        self.capacity = int(capacity)
+        self.state_size = int(state_size)
+        self.storage_dir = storage_dir
+        self._created = set() # 這次新建 (內容全為 0) 的記憶體映射欄位
+        self.restored_meta = self._read_meta()
+        self.states = self._allocate("states", (self.capacity, self.state_size), np.float32)
+        self.next_states = self._allocate("next_states", (self.capacity, self.state_size), np.float32)
+        self.actions = self._allocate("actions", (self.capacity,), np.int8)
+        self.rewards = self._allocate("rewards", (self.capacity,), np.float32)
+        self.dones = self._allocate("dones", (self.capacity,), np.bool_)
+        meta = self.restored_meta or {}
+        self.pos = meta.get("pos", 0) # 下一筆要寫入的位置
+        self.size = meta.get("size", 0) # 目前有效的筆數
+        self.rng = np.random.default_rng(seed)
+
+    def _read_meta(self):
+        """讀取 storage_dir 中相同容量與維度的記憶庫描述；沒有或不相符時回傳 None"""
+        if self.storage_dir is None:
+            return None
+        path = os.path.join(self.storage_dir, self.META_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("capacity") != self.capacity or meta.get("state_size") != self.state_size:
+            print(f"⚠️ {self.storage_dir} 中的記憶庫容量或狀態維度不同，將重新建立。")
+            return None
+        return meta
+
+    def _allocate(self, name, shape, dtype):
+        if self.storage_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.storage_dir, exist_ok=True)
+        path = os.path.join(self.storage_dir, f"{name}.npy")
+        if self.restored_meta is not None and os.path.exists(path):
+            array = np.lib.format.open_memmap(path, mode="r+")
+            if array.shape == shape and array.dtype == np.dtype(dtype):
+                return array
+            del array
+            # 只有部分欄位不相符時整個記憶庫都不能信任
+            self.restored_meta = None
+        self._created.add(name)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    def _meta(self):
+        return {"capacity": self.capacity, "state_size": self.state_size, "pos": self.pos, "size": self.size}
+
+    def flush(self):
+        """把記憶體映射的內容與 pos/size 寫回磁碟 (只有 storage_dir 模式有作用)"""
+        if self.storage_dir is None:
+            return
+        for array in (self.states, self.next_states, self.actions, self.rewards, self.dones):
+            array.flush()
+        path = os.path.join(self.storage_dir, self.META_FILENAME)
+        with atomic_write(path) as f: # 原子替換，中斷時舊的描述仍然完整
+            json.dump(self._meta(), f)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        """所有陣列合計的位元組數"""
+        return (self.states.nbytes + self.next_states.nbytes + self.actions.nbytes
+                + self.rewards.nbytes + self.dones.nbytes)
+
+    def add(self, state, action, reward, next_state, done):
+        i = self.pos
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.pos = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        return i
+
+    def sample_indices(self, batch_size):
+        # 不重複抽樣 (與原本 random.sample 的行為相同)
+        return self.rng.choice(self.size, size=batch_size, replace=False)
+
+    def get(self, indices):
+        return (self.states[indices], self.actions[indices], self.rewards[indices],
+                self.next_states[indices], self.dones[indices])
+
+    def sample(self, batch_size):
+        """回傳 (states, actions, rewards, next_states, dones) 五個陣列"""
+        return self.get(self.sample_indices(batch_size))
+
+
+class SumTree:
+    """
+    以陣列表示的完全二元樹：葉節點存每筆經驗的優先度，內部節點存子樹總和。
+    根節點在索引 1，葉節點從 leaf_start 開始。更新與取樣都是 O(log n)，
+    並以 NumPy 對整個批次一次處理。
+    """
+
+    def __init__(self, capacity, tree=None):
+        self.capacity = capacity
+        self.leaf_start = self.leaf_count(capacity)
+        # tree 可以由呼叫端提供 (例如記憶體映射的陣列)，長度必須是 2 * leaf_start
+        self.tree = np.zeros(2 * self.leaf_start, dtype=np.float64) if tree is None else tree
+
+    @staticmethod
+    def leaf_count(capacity):
+        leaf_start = 1
+        while leaf_start < capacity:
+            leaf_start *= 2
+        return leaf_start
+
+    def total(self):
+        return self.tree[1]
+
+    def leaves(self, indices):
+        return self.tree[np.asarray(indices) + self.leaf_start]
+
+    def max_leaf(self, size):
+        if size == 0:
+            return 0.0
+        return float(self.tree[self.leaf_start:self.leaf_start + size].max())
+
+    def update(self, indices, priorities):
+        """設定多個葉節點的優先度，並逐層往上重算受影響的父節點"""
+        pos = np.asarray(indices, dtype=np.int64) + self.leaf_start
+        self.tree[pos] = priorities
+        pos = np.unique(pos // 2)
+        while pos[0] >= 1:
+            self.tree[pos] = self.tree[2 * pos] + self.tree[2 * pos + 1]
+            if pos[0] == 1:
+                break
+            pos = np.unique(pos // 2)
+
+    def find(self, values):
+        """對每個 value (0 <= value < total) 找出前綴和落在其中的葉節點索引"""
+        values = np.array(values, dtype=np.float64)
+        idx = np.ones(len(values), dtype=np.int64)
+        while idx[0] < self.leaf_start:
+            left = 2 * idx
+            left_sum = self.tree[left]
+            go_right = values >= left_sum
+            values = np.where(go_right, values - left_sum, values)
+            idx = np.where(go_right, left + 1, left)
+        return idx - self.leaf_start
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    優先經驗回放 (Prioritized Experience Replay)。
+
+    取樣機率 P(i) = p_i^alpha / sum_k p_k^alpha，p_i = |TD 誤差| + eps；
+    新經驗以目前為止最大的優先度 (max_priority，只增不減，不必掃描所有葉節點) 加入，確保至少被抽到一次。
+    sample() 額外回傳葉節點索引與重要性取樣權重 w_i = (N * P(i))^-beta / max w，
+    beta 隨取樣次數從 beta 線性增加到 1。
+    """
+
+    def __init__(self, capacity, state_size, alpha=0.6, beta=0.4, beta_steps=100000, eps=1e-6, seed=None,
+                 storage_dir=None):
+        super().__init__(capacity, state_size, seed=seed, storage_dir=storage_dir)
+        leaf_start = SumTree.leaf_count(self.capacity)
+        self.tree = SumTree(self.capacity, self._allocate("priorities", (2 * leaf_start,), np.float64))
+        self.alpha = alpha
+        self.beta_start = beta
+        self.beta_steps = beta_steps
+        self.eps = eps
+        self.sample_count = (self.restored_meta or {}).get("sample_count", 0)
+        if self.size > 0 and (self.restored_meta is None or "priorities" in self._created):
+            # 優先度檔案不存在 (例如從均勻回放的記憶庫接續) 或與其他欄位不相符：
+            # 已存的經驗一律以相同優先度重新開始，否則 total() 為 0，取樣權重會是 NaN
+            self.tree.update(np.arange(self.size), np.ones(self.size))
+        # 只在建立時掃描一次葉節點 (接續舊記憶庫時)，之後由 update_priorities 維護
+        self.max_priority = self.tree.max_leaf(self.size) or 1.0
+
+    def _meta(self):
+        meta = super()._meta()
+        meta["sample_count"] = self.sample_count
+        return meta
+
+    def flush(self):
+        if self.storage_dir is not None:
+            self.tree.tree.flush()
+        super().flush()
+
+    @property
+    def nbytes(self):
+        return super().nbytes + self.tree.tree.nbytes
+
+    @property
+    def beta(self):
+        fraction = min(1.0, self.sample_count / self.beta_steps)
+        return self.beta_start + fraction * (1.0 - self.beta_start)
+
+    def add(self, state, action, reward, next_state, done):
+        i = super().add(state, action, reward, next_state, done)
+        self.tree.update([i], [self.max_priority])
+        return i
+
+    def sample_indices(self, batch_size):
+        # 分層取樣：把 [0, total) 切成 batch_size 段，每段抽一個
+        total = self.tree.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = self.tree.find(values)
+        # 浮點誤差可能落到尚未使用的葉節點，夾回有效範圍
+        return np.minimum(indices, self.size - 1)
+
+    def sample(self, batch_size):
+        """回傳 (states, actions, rewards, next_states, dones, indices, weights)"""
+        indices = self.sample_indices(batch_size)
+        probs = self.tree.leaves(indices) / self.tree.total()
+        weights = (self.size * probs) ** (-self.beta)
+        weights /= weights.max()
+        self.sample_count += 1
+        return self.get(indices) + (indices, weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(np.max(priorities)))
+
+
+class SharedReplayBuffer(ReplayBuffer):
+    """
+    放在共享記憶體 (multiprocessing.shared_memory) 中的環狀經驗回放記憶庫。
+
+    所有欄位與 pos/size 計數器都在同一塊共享記憶體中，多個 actor 行程以
+    attach(spec, lock) 連上同一個緩衝區直接寫入，learner 行程直接取樣，
+    經驗不經過 pickle 或 Queue。新增與取樣以跨行程的 lock 保護。
+    """
+
+    def __init__(self, capacity, state_size, lock, name=None, seed=None):
+        self.capacity = int(capacity)
+        self.state_size = int(state_size)
+        self.lock = lock
+        self.storage_dir = None
+        self.rng = np.random.default_rng(seed)
+        fields = [
+            ("counters", np.int64, (2,)), # [pos, size]
+            ("states", np.float32, (self.capacity, self.state_size)),
+            ("next_states", np.float32, (self.capacity, self.state_size)),
+            ("rewards", np.float32, (self.capacity,)),
+            ("actions", np.int8, (self.capacity,)),
+            ("dones", np.bool_, (self.capacity,)),
+        ]
+        offsets = []
+        total = 0
+        for _, dtype, shape in fields:
+            total = (total + 7) // 8 * 8 # 每個欄位對齊 8 bytes
+            offsets.append(total)
+            total += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=total)
+        for (field, dtype, shape), offset in zip(fields, offsets):
+            setattr(self, field, np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+        if self.owner:
+            self.counters[:] = 0
+
+    @property
+    def spec(self):
+        """傳給其他行程的參數 (配合 attach 使用)"""
+        return {"capacity": self.capacity, "state_size": self.state_size, "name": self.shm.name}
+
+    @classmethod
+    def attach(cls, spec, lock, seed=None):
+        return cls(spec["capacity"], spec["state_size"], lock, name=spec["name"], seed=seed)
+
+    @property
+    def pos(self):
+        return int(self.counters[0])
+
+    @pos.setter
+    def pos(self, value):
+        self.counters[0] = value
+
+    @property
+    def size(self):
+        return int(self.counters[1])
+
+    @size.setter
+    def size(self, value):
+        self.counters[1] = value
+
+    def add(self, state, action, reward, next_state, done):
+        with self.lock:
+            return super().add(state, action, reward, next_state, done)
+
+    def sample(self, batch_size):
+        with self.lock:
+            return super().sample(batch_size)
+
+    def close(self):
+        """釋放這個行程的映射；建立者另外負責 unlink 共享記憶體"""
+        for field in ("counters", "states", "next_states", "rewards", "actions", "dones"):
+            setattr(self, field, None)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
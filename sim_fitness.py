@@ -0,0 +1,84 @@
+import os
+import xml.etree.ElementTree as ET
+
+# 統計檔中平均值的小數位數；總延遲 = 平均 timeLoss x 車輛數，精度不足會放大誤差
+STATISTIC_PRECISION = 6
+
+
+def statistic_output_options(statistic_path):
+    """
+    評估用的輸出參數：只寫一個很小的 statistic-output (整場模擬的彙總)，
+    tripinfo / stop 輸出丟到 os.devnull (tripinfo 裝置仍會在記憶體中累計，不寫檔)。
+    """
+    return [
+        "--tripinfo-output", os.devnull,
+        "--stop-output", os.devnull,
+        "--statistic-output", statistic_path,
+        "--duration-log.statistics", "true",
+        "--precision", str(STATISTIC_PRECISION),
+    ]
+
+
+def trip_statistics(statistic_path):
+    """讀取 statistic-output 的 <vehicleTripStatistics>，回傳 {屬性: float}"""
+    root = ET.parse(statistic_path).getroot()
+    elem = root.find("vehicleTripStatistics")
+    if elem is None:
+        raise ValueError(f"'{statistic_path}' 中沒有 vehicleTripStatistics")
+    return {key: float(value) for key, value in elem.attrib.items()}
+
+
+def total_time_loss(statistic_path):
+    """所有完成旅程的 timeLoss 總和 (與逐筆加總 tripinfo 的 timeLoss 相同)"""
+    stats = trip_statistics(statistic_path)
+    return stats["count"] * stats["timeLoss"]
+
+
+def trip_time_loss_so_far(conn):
+    """
+    模擬進行中到目前為止完成旅程的 timeLoss 總和 (TraCI 的旅程統計，需啟用 tripinfo 裝置，
+    例如加上 statistic_output_options)。評估時一律取前後差值。
+    """
+    count = float(conn.simulation.getParameter("", "device.tripinfo.vehicleTripStatistics.count"))
+    mean = float(conn.simulation.getParameter("", "device.tripinfo.vehicleTripStatistics.timeLoss"))
+    return count * mean
+
+
+def total_time_loss_from_tripinfo(tripinfo_path):
+    """以 iterparse 串流加總 tripinfo 的 timeLoss，讀完每筆就清掉，記憶體用量固定"""
+    total = 0.0
+    for _, elem in ET.iterparse(tripinfo_path, events=("end",)):
+        if elem.tag == "tripinfo":
+            total += float(elem.attrib.get("timeLoss", 0.0))
+            elem.clear()
+    return total
+
+
+# 多精度評估 (GA_MULTI_FIDELITY) 用來比較代理分數與完整分數的排名是否一致
+def average_ranks(values):
+    """由小到大的名次 (從 1 開始)，同分取平均名次"""
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+
+def spearman(xs, ys):
+    """Spearman 等級相關係數 (名次的 Pearson 相關)；少於 3 筆或名次沒有變化時回傳 None"""
+    if len(xs) < 3:
+        return None
+    rx, ry = average_ranks(xs), average_ranks(ys)
+    mean_x, mean_y = sum(rx) / len(rx), sum(ry) / len(ry)
+    cov = sum((a - mean_x) * (b - mean_y) for a, b in zip(rx, ry))
+    var_x = sum((a - mean_x) ** 2 for a in rx)
+    var_y = sum((b - mean_y) ** 2 for b in ry)
+    if var_x == 0 or var_y == 0:
+        return None
+    return cov / (var_x * var_y) ** 0.5
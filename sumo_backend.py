@@ -0,0 +1,88 @@
+import os
+
+# 後端選擇：auto (預設，有 libsumo 就用) / libsumo / traci；可用環境變數 SUMO_BACKEND 覆寫
+DEFAULT_BACKEND = os.environ.get("SUMO_BACKEND", "auto")
+
+
+def _is_gui(sumo_binary):
+    return "gui" in os.path.basename(sumo_binary)
+
+
+def load_backend_module(sumo_binary="sumo", prefer=None):
+    """
+    回傳 (模組, 名稱)。libsumo 在同一個行程內執行 SUMO，沒有 socket 往返；
+    sumo-gui 無法透過 libsumo 執行，因此一律回退到 traci。
+    """
+    choice = (prefer or DEFAULT_BACKEND).lower()
+    if choice in ("auto", "libsumo") and not _is_gui(sumo_binary):
+        try:
+            import libsumo # pyright: ignore[reportMissingImports]
+            return libsumo, "libsumo"
+        except ImportError:
+            if choice == "libsumo":
+                print("警告：找不到 libsumo，改用 traci (TCP socket)。")
+    elif choice == "libsumo":
+        print(f"警告：'{sumo_binary}' 需要 GUI，libsumo 不支援，改用 traci。")
+    import traci
+    return traci, "traci"
+
+
+class SumoBackend:
+    """
+    SUMO 連線的薄包裝層。
+
+    只處理兩個後端真正不同的部分：啟動/重新載入/關閉，以及建立號誌程式物件
+    (set_program)。其他屬性 (trafficlight、lane、simulation、simulationStep ...)
+    直接轉發給底層模組或 traci.Connection，RL (TLSObserver 的 conn) 與 GA 都以
+    相同的 TraCI 呼叫方式使用。
+    """
+
+    def __init__(self, sumo_binary="sumo", prefer=None):
+        self.module, self.name = load_backend_module(sumo_binary, prefer)
+        self.TraCIException = self.module.TraCIException
+        self.conn = None
+
+    # --- 生命週期 ---
+    def start(self, cmd, label=None):
+        if self.name == "libsumo":
+            # libsumo 每個行程只有一個模擬，不需要 label
+            self.module.start(cmd)
+            self.conn = self.module
+        elif label is None:
+            self.module.start(cmd)
+            self.conn = self.module
+        else:
+            self.module.start(cmd, label=label)
+            self.conn = self.module.getConnection(label)
+        return self
+
+    def load(self, args):
+        """以新的參數重新載入模擬 (args 不含執行檔名稱)"""
+        self.conn.load(args)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __getattr__(self, name):
+        # 只有在一般屬性找不到時才會呼叫：轉發給底層連線 (lane / simulation / vehicle ...)
+        conn = self.__dict__.get("conn")
+        if conn is None:
+            raise AttributeError(name)
+        return getattr(conn, name)
+
+    # --- 號誌程式 (libsumo 與 traci 的 Logic/Phase 類別名稱不同) ---
+    def make_logic(self, program_id, phases):
+        """phases: [(duration, state), ...]；依後端建立對應的 Logic 物件"""
+        tl = self.module.trafficlight
+        logic_cls = getattr(tl, "Logic", None) or getattr(self.module, "TraCILogic")
+        phase_cls = getattr(tl, "Phase", None) or getattr(self.module, "TraCIPhase")
+        return logic_cls(program_id, 0, 0, [phase_cls(duration, state) for duration, state in phases])
+
+    def set_program(self, tls_id, program_id, phases):
+        """套用固定時制程式 (type=0) 並從第 0 個相位開始"""
+        logic = self.make_logic(program_id, phases)
+        self.conn.trafficlight.setProgramLogic(tls_id, logic)
+        self.conn.trafficlight.setProgram(tls_id, program_id)
+        self.conn.trafficlight.setPhase(tls_id, 0)
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from atomic_file import atomic_path
+from tls_topology import file_sha1, net_file_from_sumocfg
+
+SNAPSHOT_DIR = os.path.join(".cache", "snapshots")
+# 影響模擬動態的參數：RL_controller、sumo_vec_env、GA.py 與 bench_ga_eval.py 共用同一份，
+# 暖機快照也必須以同一組參數建立
+SIM_OPTIONS = ["--time-to-teleport", "300", "--lateral-resolution", "0.05"]
+# 快照格式版本：修改暖機邏輯時遞增，舊快照會自動重建
+SNAPSHOT_FORMAT_VERSION = 1
+
+MIN_WARMUP_STEPS = 300 # 至少暖機的秒數
+MAX_WARMUP_STEPS = 1800 # 最多暖機的秒數 (路網一直沒穩定時的上限)
+STEADY_WINDOW = 60 # 每隔多少秒比較一次路網上的車輛數
+STEADY_TOLERANCE = 0.05 # 兩個視窗的車輛數變化小於 5% 視為穩定負載
+
+
+def route_files_from_sumocfg(sumocfg_path):
+    """從 .sumocfg 讀出 route-files (相對於 sumocfg 所在目錄)"""
+    root = ET.parse(sumocfg_path).getroot()
+    base = os.path.dirname(os.path.abspath(sumocfg_path))
+    files = []
+    for elem in root.iter("route-files"):
+        value = elem.attrib.get("value", "")
+        files.extend(os.path.join(base, f.strip()) for f in value.split(",") if f.strip())
+    return files
+
+
+def snapshot_key(sumocfg_path, seed, sim_options=(), route_files=None):
+    """
+    快照的快取鍵：sumocfg、路網、路線檔的內容 + 種子 + 影響模擬的參數。
+    任何一項改變都會得到新的鍵，舊快照自然不再被使用。
+    """
+    if route_files is None:
+        route_files = route_files_from_sumocfg(sumocfg_path)
+    h = hashlib.sha1()
+    h.update(f"v{SNAPSHOT_FORMAT_VERSION}|seed={seed}|".encode())
+    h.update(" ".join(map(str, sim_options)).encode())
+    for path in [sumocfg_path, net_file_from_sumocfg(sumocfg_path)] + list(route_files):
+        h.update(os.path.basename(path).encode())
+        h.update(file_sha1(path).encode())
+    return h.hexdigest()[:16]
+
+
+def _build_snapshot(sumocfg_path, seed, sim_options, route_files, state_path):
+    """以 traci (獨立 label) 暖機到穩定負載後存檔；回傳 (暖機秒數, 路網上的車輛數)"""
+    import traci
+
+    cmd = ["sumo", "-c", sumocfg_path, "--seed", str(seed)] + list(sim_options) + [
+        # 暖機期間不需要任何輸出檔
+        "--tripinfo-output", os.devnull,
+        "--stop-output", os.devnull,
+        "--statistic-output", os.devnull,
+        "--no-step-log", "true",
+        "--verbose", "false",
+    ]
+    if route_files is not None:
+        cmd += ["--route-files", ",".join(route_files)]
+    label = f"snapshot_{os.getpid()}_{seed}"
+    traci.start(cmd, label=label)
+    conn = traci.getConnection(label)
+    try:
+        step = 0
+        last_count = None
+        while step < MAX_WARMUP_STEPS and conn.simulation.getMinExpectedNumber() > 0:
+            conn.simulationStep()
+            step += 1
+            if step % STEADY_WINDOW == 0:
+                count = conn.vehicle.getIDCount()
+                if (step >= MIN_WARMUP_STEPS and last_count
+                        and abs(count - last_count) <= STEADY_TOLERANCE * last_count):
+                    break
+                last_count = count
+        vehicles = conn.vehicle.getIDCount()
+        conn.simulation.saveState(state_path)
+    finally:
+        conn.close()
+    return step, vehicles
+
+
+def ensure_snapshot(sumocfg_path="osm.sumocfg", seed=42, sim_options=(), route_files=None,
+                    snapshot_dir=SNAPSHOT_DIR):
+    """
+    回傳穩定負載時的模擬狀態檔路徑 (給 --load-state 使用)。
+
+    快照依 (sumocfg, 路線檔, 種子, 模擬參數) 快取；找不到就先暖機建立。
+    sim_options 必須和載入快照的模擬使用相同的參數 (例如 --lateral-resolution)。
+    """
+    key = snapshot_key(sumocfg_path, seed, sim_options, route_files)
+    state_path = os.path.join(snapshot_dir, f"state_{key}.xml")
+    if os.path.exists(state_path):
+        return state_path
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    print(f"⏳ 建立暖機快照 (seed={seed})：從空路網模擬到穩定負載...", flush=True)
+    # 先寫到暫存檔再原子替換，其他行程不會讀到寫到一半的快照 (.xml 讓 SUMO 寫成 XML 格式)
+    with atomic_path(state_path, suffix=".xml") as tmp_path:
+        warmup, vehicles = _build_snapshot(sumocfg_path, seed, sim_options, route_files, tmp_path)
+    with open(os.path.join(snapshot_dir, f"state_{key}.json"), "w", encoding="utf-8") as f:
+        json.dump({"sumocfg": sumocfg_path, "seed": seed, "sim_options": list(sim_options),
+                   "route_files": route_files, "warmup_steps": warmup, "vehicles": vehicles}, f, indent=2)
+    print(f"✅ 暖機快照已建立: {state_path} (暖機 {warmup}s，路網上 {vehicles} 輛車)", flush=True)
+    return state_path
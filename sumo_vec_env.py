@@ -0,0 +1,258 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import threading
+
+import numpy as np # pyright: ignore[reportMissingImports]
+import traci
+
+import RL_controller
+# DQNAgent (TensorFlow) 只在 train_vectorised 內 import：apex_train 的 actor 行程只用 SumoTLSEnv，不載入 TensorFlow
+from RL_controller import get_state, calculate_reward, resolve_tls_ids, DEFAULT_TRAFFIC_LIGHT_ID
+from sumo_snapshot import ensure_snapshot, SIM_OPTIONS
+from tls_observation import TLSObserver
+from tls_topology import load_topology_for_sumocfg, lanes_by_tls, green_phases_by_tls
+
+SUMO_CONFIG_FILE = "osm.sumocfg"
+DECISION_INTERVAL = 5 # 每隔 5 步進行一次決策 (與 RL_controller.main 相同)
+MIN_GREEN_TIME = 10 # 最小綠燈時間
+MAX_EPISODE_STEPS = 25000 # 每個 episode 的模擬步數上限
+ACTION_SPACE = [0, 1]  # 0: Maintain, 1: Change Phase
+
+# traci.start 會挑選空閒埠號再啟動 SUMO；多個執行緒同時啟動可能挑到同一個埠，因此串行化
+_START_LOCK = threading.Lock()
+
+
+class SumoTLSEnv:
+    """
+    單一 SUMO 行程的號誌控制環境。
+
+    每個環境以自己的 TraCI label 與種子啟動 SUMO，透過 traci.Connection 物件
+    操作 (不依賴 traci 的「目前連線」)，因此多個環境可以在不同執行緒中同時推進。
+    """
+
+    def __init__(self, label, seed, tls_ids, topology, sumocfg=SUMO_CONFIG_FILE,
+                 max_steps=MAX_EPISODE_STEPS, sumo_binary="sumo", seed_stride=1, warm_start=False):
+        self.label = label
+        self.seed = seed
+        self.seed_stride = seed_stride # reset 時種子遞增的間隔，避免和其他環境重複
+        self.tls_ids = list(tls_ids)
+        self.topology = topology
+        self.sumocfg = sumocfg
+        self.max_steps = max_steps
+        self.sumo_binary = sumo_binary
+        self.warm_start = warm_start # 從穩定負載快照開始每個 episode
+        self.num_phases = {tls_id: len(topology[tls_id]["phases"]) for tls_id in self.tls_ids}
+        self.green_phases = green_phases_by_tls(topology, self.tls_ids)
+
+        self.conn = None
+        self.observer = None
+        self.step_count = 0
+        self.episode = 0
+        self.time_since_last_change = {}
+        self.last_waiting = {}
+
+    def _command(self):
+        # 每個實例各自的輸出檔，避免多個 SUMO 同時寫同一個檔案
+        cmd = [
+            self.sumo_binary,
+            "-c", self.sumocfg,
+            "--seed", str(self.seed),
+        ] + SIM_OPTIONS + [
+            "--tripinfo-output", f"tripinfo_{self.label}.xml",
+            "--stop-output", f"stopinfos_{self.label}.xml",
+            "--statistic-output", f"stats_{self.label}.xml",
+            "--no-step-log", "true",
+            "--verbose", "false",
+        ]
+        if self.warm_start:
+            cmd += ["--load-state", ensure_snapshot(self.sumocfg, self.seed, SIM_OPTIONS)]
+        return cmd
+
+    def reset(self):
+        """(重新) 啟動 SUMO，回傳每個號誌的初始狀態"""
+        if self.conn is not None:
+            self.close()
+            self.seed += self.seed_stride
+        with _START_LOCK:
+            traci.start(self._command(), label=self.label)
+        self.conn = traci.getConnection(self.label)
+        self.observer = TLSObserver(self.tls_ids, conn=self.conn,
+                                    lanes_by_tls=lanes_by_tls(self.topology, self.tls_ids))
+        self.observer.subscribe()
+        self.step_count = 0
+        self.episode += 1
+        self.time_since_last_change = {tls_id: 0 for tls_id in self.tls_ids}
+        self.last_waiting = {}
+        for tls_id in self.tls_ids:
+            # 初始化獎勵基準，避免第一個獎勵被整個路網的等待時間放大
+            calculate_reward(tls_id, self.observer, self.last_waiting)
+        return self.states()
+
+    def states(self):
+        return [get_state(tls_id, self.observer) for tls_id in self.tls_ids]
+
+    def step(self, actions):
+        """
+        套用動作、推進 DECISION_INTERVAL 步，回傳
+        (實際採用的動作, 下一狀態, 獎勵, done)。不允許決策的號誌動作固定為 0。
+        """
+        observer = self.observer
+        applied = []
+        for tls_id, action in zip(self.tls_ids, actions):
+            phase = observer.phase(tls_id)
+            allowed = phase in self.green_phases[tls_id] and self.time_since_last_change[tls_id] >= MIN_GREEN_TIME
+            if allowed and action == 1:
+                observer.set_phase(tls_id, (phase + 1) % self.num_phases[tls_id])
+                self.time_since_last_change[tls_id] = 0
+                applied.append(1)
+            else:
+                applied.append(0)
+
+        done = False
+        for _ in range(DECISION_INTERVAL):
+            if observer.min_expected_number() <= 0 or self.step_count >= self.max_steps:
+                done = True
+                break
+            observer.step()
+            self.step_count += 1
+            for tls_id in self.tls_ids:
+                self.time_since_last_change[tls_id] += 1
+        if observer.min_expected_number() <= 0 or self.step_count >= self.max_steps:
+            done = True
+
+        next_states = self.states()
+        rewards = [calculate_reward(tls_id, observer, self.last_waiting)[0] for tls_id in self.tls_ids]
+        return applied, next_states, rewards, done
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except traci.TraCIException:
+                pass
+            self.conn = None
+
+
+class SumoVecEnv:
+    """
+    N 個 SumoTLSEnv 的向量化包裝。
+
+    SUMO 本身是獨立的行程；Python 端以執行緒同時送出各環境的 simulationStep
+    (socket 等待時會釋放 GIL)，所以 N 個模擬可以在 N 個核心上並行推進。
+    所有環境、所有號誌的狀態會攤平成一個陣列，交給 agent 一次批次推論。
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.envs))
+        self.current_states = []
+
+    def _map(self, fn, *iterables):
+        return list(self.executor.map(fn, *iterables))
+
+    def reset(self):
+        per_env = self._map(lambda env: env.reset(), self.envs)
+        self.current_states = [state for states in per_env for state in states]
+        return self.current_states
+
+    def step(self, actions):
+        """
+        actions 為攤平後的動作列表 (順序與 reset/step 回傳的狀態相同)。
+        回傳攤平後的 (applied, next_states, rewards, dones)；
+        episode 結束的環境會自動 reset，next_states 仍是結束時的狀態，
+        下一輪的起始狀態由 self.current_states 提供。
+        """
+        chunks = []
+        offset = 0
+        for env in self.envs:
+            n = len(env.tls_ids)
+            chunks.append(actions[offset:offset + n])
+            offset += n
+
+        results = self._map(lambda env, acts: env.step(acts), self.envs, chunks)
+
+        applied, next_states, rewards, dones, current = [], [], [], [], []
+        finished = []
+        for env, (env_applied, env_next, env_rewards, env_done) in zip(self.envs, results):
+            applied.extend(env_applied)
+            next_states.extend(env_next)
+            rewards.extend(env_rewards)
+            dones.extend([env_done] * len(env_next))
+            if env_done:
+                finished.append(env)
+        if finished:
+            self._map(lambda env: env.reset(), finished)
+        for env in self.envs:
+            current.extend(env.states())
+        self.current_states = current
+        return applied, next_states, rewards, dones
+
+    def close(self):
+        self._map(lambda env: env.close(), self.envs)
+        self.executor.shutdown()
+
+
+def train_vectorised(instance_id, num_envs, total_decisions, tls_ids=None, base_seed=42, warm_start=False,
+                     prioritized=False):
+    """以 num_envs 個 SUMO 行程收集經驗，全部放進同一個 DQNAgent 的記憶庫"""
+    from DQN_RL_Agent import DQNAgent
+    topology = load_topology_for_sumocfg(SUMO_CONFIG_FILE)
+    if tls_ids is None:
+        tls_ids = [DEFAULT_TRAFFIC_LIGHT_ID]
+    # 所有環境共用同一個網路：狀態補零到最多的受控車道數
+    RL_controller.STATE_LANE_COUNT = max(len(topology[t]["controlled_lanes"]) for t in tls_ids)
+
+    agent = DQNAgent(state_size=RL_controller.STATE_LANE_COUNT + 2, action_space=ACTION_SPACE, instance_id=instance_id,
+                     prioritized=prioritized)
+    if agent.load_model(resume=True):
+        print("✅ 找到上次訓練模型，將繼續訓練。")
+    else:
+        agent.build_models()
+    agent.attach_persistent_memory()
+
+    envs = [SumoTLSEnv(f"vec_{instance_id}_{i}", base_seed + i, tls_ids, topology, seed_stride=num_envs,
+                       warm_start=warm_start)
+            for i in range(num_envs)]
+    vec_env = SumoVecEnv(envs)
+    print(f"🔁 向量化訓練：{num_envs} 個 SUMO 實例 × {len(tls_ids)} 個號誌", flush=True)
+
+    try:
+        states = vec_env.reset()
+        for decision in range(1, total_decisions + 1):
+            # 所有環境、所有號誌的狀態一次批次推論
+            actions = agent.choose_actions(states)
+            applied, next_states, rewards, dones = vec_env.step(actions)
+            for transition in zip(states, applied, rewards, next_states, dones):
+                agent.remember(*transition)
+            # 每個向量步只訓練一次
+            if len(agent.memory) > 64:
+                agent.replay(batch_size=64)
+            states = vec_env.current_states
+
+            if decision % 100 == 0:
+                sim_steps = sum(env.step_count for env in envs)
+                print(f"決策: {decision} | 平均獎勵: {np.mean(rewards):.2f} | 模擬步數合計: {sim_steps} | Epsilon: {agent.exploration_rate:.3f}", flush=True)
+    except traci.TraCIException as e:
+        print(f"SUMO 連線中斷，提前結束訓練: {e}")
+    finally:
+        vec_env.close()
+        agent.save_model()
+
+
+if __name__ == "__main__":
+    if 'SUMO_HOME' not in os.environ:
+        sys.exit("請確認 SUMO_HOME 環境變數已設定！")
+    parser = argparse.ArgumentParser(description="多個 SUMO 實例並行收集經驗的 DQN 訓練")
+    parser.add_argument("instance_id", help="模型 ID (決定 model_<id>.h5 檔名)")
+    parser.add_argument("--envs", type=int, default=os.cpu_count() or 1, help="SUMO 實例數 (預設為 CPU 核心數)")
+    parser.add_argument("--decisions", type=int, default=5000, help="向量化決策步數")
+    parser.add_argument("--tls", default=DEFAULT_TRAFFIC_LIGHT_ID, help="要控制的號誌 ID，逗號分隔或 'all'")
+    parser.add_argument("--seed", type=int, default=42, help="第一個實例的種子，其餘依序遞增")
+    parser.add_argument("--warm-start", action="store_true", help="每個 episode 從穩定負載的快照開始")
+    parser.add_argument("--prioritized", action="store_true", help="使用優先經驗回放 (sum-tree)")
+    args = parser.parse_args()
+    tls_ids = resolve_tls_ids(args.tls, load_topology_for_sumocfg(SUMO_CONFIG_FILE))
+    train_vectorised(args.instance_id, args.envs, args.decisions, tls_ids, args.seed, args.warm_start,
+                     args.prioritized)
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from atomic_file import atomic_path, atomic_write
+
+
+def test_atomic_write_replaces_target(tmp_path):
+    path = tmp_path / "meta.json"
+    path.write_text("old", encoding="utf-8")
+    with atomic_write(str(path)) as f:
+        f.write("new")
+    assert path.read_text(encoding="utf-8") == "new"
+    assert os.listdir(tmp_path) == ["meta.json"]
+
+
+def test_atomic_write_failure_keeps_old_file(tmp_path):
+    path = tmp_path / "meta.json"
+    path.write_text("old", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write("half")
+            raise RuntimeError("中斷")
+    assert path.read_text(encoding="utf-8") == "old"
+    assert os.listdir(tmp_path) == ["meta.json"]
+
+
+def test_atomic_path_keeps_suffix(tmp_path):
+    path = tmp_path / "state.xml"
+    with atomic_path(str(path), suffix=".xml") as tmp:
+        assert tmp.endswith(".tmp.xml")
+        with open(tmp, "wb") as f:
+            f.write(b"<snapshot/>")
+    assert path.read_bytes() == b"<snapshot/>"
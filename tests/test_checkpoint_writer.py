@@ -0,0 +1,76 @@
+import os
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from checkpoint_writer import CheckpointWriter, latest_checkpoint
+
+
+def touch(directory, name):
+    path = os.path.join(directory, name)
+    with open(path, "wb"):
+        pass
+    return path
+
+
+def test_latest_checkpoint_orders_by_train_counter(tmp_path):
+    directory = str(tmp_path)
+    assert latest_checkpoint("run_a", directory) is None
+    touch(directory, "ckpt_run_a_000000900.npz")
+    newest = touch(directory, "ckpt_run_a_000001000.npz")
+    touch(directory, "full_run_a_000000950.npz")
+    touch(directory, "ckpt_run_b_000005000.npz") # 其他實例的檔案不算
+    assert latest_checkpoint("run_a", directory) == newest
+
+
+def test_latest_checkpoint_prefers_full_on_tie(tmp_path):
+    directory = str(tmp_path)
+    touch(directory, "ckpt_run_a_000001000.npz")
+    full = touch(directory, "full_run_a_000001000.npz")
+    assert latest_checkpoint("run_a", directory) == full
+
+
+def test_writer_keeps_newest_and_restores_arrays(tmp_path):
+    writer = CheckpointWriter("run_a", directory=str(tmp_path), keep=2)
+    weights = [np.ones((2, 3), dtype=np.float32), np.zeros(3, dtype=np.float32)]
+    for counter in (10, 20, 30):
+        writer.submit(counter, 0.5, weights)
+        writer.flush()
+    writer.close()
+    assert [os.path.basename(p) for p in writer.list("ckpt")] == ["ckpt_run_a_000000020.npz", "ckpt_run_a_000000030.npz"]
+    with np.load(latest_checkpoint("run_a", str(tmp_path))) as data:
+        assert int(data["train_counter"]) == 30
+        assert float(data["exploration_rate"]) == 0.5
+        assert np.array_equal(data["arr_0"], weights[0])
+
+
+def test_writer_drops_stale_snapshots_when_busy(tmp_path):
+    writer = CheckpointWriter("run_a", directory=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+    write = writer._write
+
+    def slow_write(path, arrays):
+        started.set()
+        release.wait(5)
+        write(path, arrays)
+
+    writer._write = slow_write
+    weights = [np.ones(2, dtype=np.float32)]
+    writer.submit(1, 1.0, weights)
+    assert started.wait(5) # 背景執行緒正在寫第 1 份
+    for counter in (2, 3, 4):
+        writer.submit(counter, 1.0, weights) # 佇列只放一份，2、3 被較新的取代
+    release.set()
+    writer.close()
+    assert writer.dropped == 2
+    assert writer.written == 2
+    assert writer.error is None
+    assert [os.path.basename(p) for p in writer.list("ckpt")] == ["ckpt_run_a_000000001.npz", "ckpt_run_a_000000004.npz"]
+
+
+@pytest.mark.parametrize("keep, keep_full", [(0, 2), (5, 0)])
+def test_writer_rejects_keeping_no_checkpoints(tmp_path, keep, keep_full):
+    with pytest.raises(ValueError):
+        CheckpointWriter("run_c", directory=str(tmp_path), keep=keep, keep_full=keep_full)
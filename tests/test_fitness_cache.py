@@ -0,0 +1,55 @@
+import os
+
+from fitness_cache import FitnessCache, evaluation_context, evaluate_with_cache, format_cache_stats
+
+
+def write_sumocfg(directory, route="routes.rou.xml"):
+    with open(os.path.join(directory, "net.net.xml"), "w", encoding="utf-8") as f:
+        f.write("<net/>")
+    with open(os.path.join(directory, route), "w", encoding="utf-8") as f:
+        f.write("<routes/>")
+    path = os.path.join(directory, "test.sumocfg")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'<configuration><input><net-file value="net.net.xml"/>'
+                f'<route-files value="{route}"/></input></configuration>')
+    return path
+
+
+def test_context_changes_with_inputs_and_options(tmp_path):
+    sumocfg = write_sumocfg(str(tmp_path))
+    base = evaluation_context(sumocfg, ["--seed", "1"], extra="mode=persistent")
+    assert base == evaluation_context(sumocfg, ["--seed", "1"], extra="mode=persistent")
+    assert base != evaluation_context(sumocfg, ["--seed", "2"], extra="mode=persistent")
+    assert base != evaluation_context(sumocfg, ["--seed", "1"], extra="mode=subprocess")
+    with open(os.path.join(str(tmp_path), "routes.rou.xml"), "w", encoding="utf-8") as f:
+        f.write("<routes><vehicle/></routes>")
+    assert base != evaluation_context(sumocfg, ["--seed", "1"], extra="mode=persistent")
+
+
+def test_cache_round_trip_and_failures_not_stored(tmp_path):
+    path = str(tmp_path / "fitness.sqlite")
+    cache = FitnessCache("ctx", path=path)
+    cache.put([10, 20], 123.5, seed=42)
+    cache.put([30, 40], -1, seed=42) # 評估失敗
+    assert cache.get([10, 20], seed=42) == 123.5
+    assert cache.get([10, 20], seed=7) is None
+    assert cache.get([30, 40], seed=42) is None
+    assert FitnessCache("other", path=path).get([10, 20], seed=42) is None
+    # 另一個連線 (例如下一次執行) 讀得到同一筆
+    assert FitnessCache("ctx", path=path).get_many([(10, 20), (1, 1)], seed=42) == {(10, 20): 123.5}
+
+
+def test_evaluate_with_cache_skips_hits_and_duplicates(tmp_path):
+    cache = FitnessCache("ctx", path=str(tmp_path / "fitness.sqlite"))
+    cache.put([1, 1], 5.0)
+    calls = []
+
+    def evaluate_many(todo):
+        calls.append(list(todo))
+        return [(float(a + b),) for a, b in todo]
+
+    fitnesses, stats = evaluate_with_cache([[1, 1], [2, 3], [2, 3], [4, 4]], evaluate_many, cache)
+    assert fitnesses == [(5.0,), (5.0,), (5.0,), (8.0,)]
+    assert calls == [[(2, 3), (4, 4)]]
+    assert stats == {"total": 4, "hits": 1, "duplicates": 1, "evaluated": 2}
+    assert "2/4" in format_cache_stats(stats)
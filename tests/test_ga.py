@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pytest.importorskip("deap")
+pytest.importorskip("plyer")
+if "SUMO_HOME" not in os.environ:
+    pytest.skip("GA.py 需要 SUMO_HOME", allow_module_level=True)
+
+os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # GA.py 以相對路徑讀 osm.sumocfg
+import GA # noqa: E402
+
+
+class FakeExecutor:
+    """依序回傳預先給定的 evaluate_bounded 結果"""
+
+    def __init__(self, results):
+        self.results = results
+
+    def map(self, fn, todo, *args):
+        return iter(self.results[:len(todo)])
+
+
+def test_map_with_bound_ranks_failed_after_pruned_after_full():
+    results = [(-1, False), (800.0, False), (50.0, True), (1200.0, False)]
+    prune_stats = {}
+    fits = GA.map_with_bound(FakeExecutor(results), [[30, 30]] * 4, 700.0, prune_stats)
+    values = [fit[0] for fit in fits]
+    # FitnessMin：由小到大排序，失敗 (-1) 必須在最後，提前停止的部分延遲排在所有完整延遲之後
+    assert sorted(range(4), key=lambda i: values[i]) == [1, 3, 2, 0]
+    assert values[0] == GA.FAILED_FITNESS
+    assert prune_stats["pruned"] == 1
+
+
+def test_failed_fitness_is_never_best():
+    ind_failed = GA.creator.Individual([5, 5])
+    ind_full = GA.creator.Individual([30, 30])
+    ind_failed.fitness.values = (GA.bounded_fitness(-1, False),)
+    ind_full.fitness.values = (GA.bounded_fitness(900.0, False),)
+    assert GA.tools.selBest([ind_failed, ind_full], 1)[0] is ind_full
+    assert GA.generation_bound([ind_failed, ind_full]) == 900.0
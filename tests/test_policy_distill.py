@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from numpy_policy import NumpyPolicy
+from policy_distill import (DistilledPolicyAgent, build_table, distill, fit_tree, quantise_key, tree_action,
+                            tree_depth)
+
+
+def test_fit_tree_learns_threshold():
+    X = np.array([[q, 0.0] for q in range(20)], dtype=np.float32)
+    y = (X[:, 0] > 9).astype(np.int64)
+    nodes = fit_tree(X, y, n_actions=2, max_depth=3, min_leaf=2)
+    assert tree_depth(nodes) == 1
+    feature, threshold, _, _, _ = nodes[0]
+    assert feature == 0 and 9 <= threshold <= 10
+    assert [tree_action(nodes, x) for x in X] == y.tolist()
+
+
+def test_fit_tree_pure_labels_is_single_leaf():
+    X = np.arange(12, dtype=np.float32).reshape(6, 2)
+    nodes = fit_tree(X, np.ones(6, dtype=np.int64), n_actions=2)
+    assert nodes == [[-1, 0.0, -1, -1, 1]]
+
+
+def test_build_table_majority_vote_per_cell():
+    # 狀態：[車道 1, 車道 2, 相位, GA 建議值]；bin_width=2 時 0 與 1 落在同一格
+    states = np.array([[0, 4, 0, 9], [1, 5, 0, 9], [1, 4, 0, 3], [0, 4, 2, 9], [40, 0, 0, 9]], dtype=np.float32)
+    labels = np.array([1, 1, 0, 0, 1])
+    table = build_table(states, labels, n_actions=2, bin_width=2, max_bin=3)
+    assert table == {(0, 2, 0): 1, (0, 2, 2): 0, (3, 0, 0): 1}
+    assert quantise_key(states[4], 2, 3) == (3, 0, 0) # 超過 max_bin 的排隊數視為同一箱
+
+
+def test_distill_matches_teacher(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    state_size = 5 # 3 條車道 + 相位 + GA 建議值 (多路口模型，不是固定的 6)
+    kernel = np.zeros((state_size, 2), dtype=np.float32)
+    kernel[0, 1] = 1.0
+    bias = np.array([0.0, -5.5], dtype=np.float32) # 第一條車道排隊超過 5 輛時切換
+    NumpyPolicy([kernel, bias]).save("policy_demo.npz")
+
+    rng = np.random.default_rng(0)
+    states = np.column_stack([rng.integers(0, 12, size=(300, 3)), rng.integers(0, 4, size=300) * 2,
+                              np.full(300, 30)]).astype(np.float32)
+    artifact = distill("demo", states, max_depth=4, min_leaf=5)
+    assert artifact["state_size"] == state_size
+    assert artifact["fidelity"]["tree_agreement"] == 1.0
+    assert artifact["fidelity"]["table_agreement"] == 1.0
+
+    agent = DistilledPolicyAgent(json.loads(json.dumps(artifact)), action_space=[0, 1])
+    agent.build_models()
+    assert agent.choose_actions([[2, 0, 0, 0, 30], [9, 0, 0, 0, 30]]) == [0, 1]
@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+
+
+def fill(buffer, count):
+    for i in range(count):
+        buffer.add([i, i + 0.5], i % 2, float(i), [i + 1, i + 1.5], i == count - 1)
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = ReplayBuffer(4, state_size=2, seed=0)
+    fill(buffer, 6)
+    assert len(buffer) == 4
+    assert buffer.pos == 2
+    assert sorted(buffer.rewards.tolist()) == [2.0, 3.0, 4.0, 5.0]
+    states, actions, rewards, next_states, dones = buffer.sample(4)
+    assert states.shape == (4, 2) and next_states.shape == (4, 2)
+    assert sorted(rewards.tolist()) == [2.0, 3.0, 4.0, 5.0]
+
+
+def test_memmap_round_trip(tmp_path):
+    storage = str(tmp_path / "replay")
+    buffer = ReplayBuffer(8, state_size=2, storage_dir=storage)
+    fill(buffer, 5)
+    buffer.flush()
+    expected = buffer.get(np.arange(5))
+    del buffer
+
+    restored = ReplayBuffer(8, state_size=2, storage_dir=storage)
+    assert restored.restored_meta is not None
+    assert (restored.pos, restored.size) == (5, 5)
+    for got, want in zip(restored.get(np.arange(5)), expected):
+        assert np.array_equal(got, want)
+
+
+def test_memmap_mismatched_shape_starts_over(tmp_path):
+    storage = str(tmp_path / "replay")
+    buffer = ReplayBuffer(8, state_size=2, storage_dir=storage)
+    fill(buffer, 3)
+    buffer.flush()
+    del buffer
+
+    restored = ReplayBuffer(8, state_size=3, storage_dir=storage)
+    assert restored.restored_meta is None
+    assert len(restored) == 0
+
+
+def test_prioritized_resume_from_uniform_buffer_reseeds_priorities(tmp_path):
+    storage = str(tmp_path / "replay")
+    buffer = ReplayBuffer(8, state_size=2, storage_dir=storage)
+    fill(buffer, 5)
+    buffer.flush()
+    del buffer
+    assert not os.path.exists(os.path.join(storage, "priorities.npy"))
+
+    prioritized = PrioritizedReplayBuffer(8, state_size=2, storage_dir=storage, seed=0)
+    assert prioritized.tree.total() == pytest.approx(5.0)
+    *_, indices, weights = prioritized.sample(4)
+    assert (indices < 5).all()
+    assert np.isfinite(weights).all()
+
+
+def test_prioritized_round_trip_keeps_priorities(tmp_path):
+    storage = str(tmp_path / "replay")
+    buffer = PrioritizedReplayBuffer(8, state_size=2, storage_dir=storage, alpha=1.0)
+    fill(buffer, 4)
+    buffer.update_priorities(np.arange(4), np.array([1.0, 2.0, 3.0, 4.0]))
+    buffer.sample(2)
+    total = buffer.tree.total()
+    buffer.flush()
+    del buffer
+
+    restored = PrioritizedReplayBuffer(8, state_size=2, storage_dir=storage, alpha=1.0)
+    assert restored.tree.total() == pytest.approx(total)
+    assert restored.sample_count == 1
+    with open(os.path.join(storage, "meta.json"), encoding="utf-8") as f:
+        assert json.load(f)["sample_count"] == 1
@@ -0,0 +1,53 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from RL_Agent import RLAgent, StateEncoder
+
+
+def test_encoder_assigns_indices_in_first_seen_order():
+    encoder = StateEncoder()
+    assert encoder.encode([(1, 2), (3, 4), (1, 2)]).tolist() == [0, 1, 0]
+    assert encoder.encode([(5, 6)], add=False).tolist() == [-1]
+    assert len(encoder) == 2
+    assert encoder.keys() == [(1, 2), (3, 4)]
+
+
+def test_encoder_bins_and_caps():
+    encoder = StateEncoder(bin_width=[2, 10], max_bin=3)
+    assert encoder.bins([(0, 9), (3, 10), (100, 25)]).tolist() == [[0, 0], [1, 1], [3, 2]]
+    assert encoder.encode([(0, 0), (1, 9)]).tolist() == [0, 0] # 同一格
+
+
+def test_learn_batch_matches_sequential_update():
+    agent = RLAgent([0, 1])
+    agent.learn((0, 0), 1, -10.0, (1, 0))
+    expected = 0.1 * (-10.0 + 0.9 * 0.0)
+    assert agent.q_values((0, 0)).tolist() == pytest.approx([0.0, expected])
+    assert agent.q_values((9, 9)).tolist() == [0.0, 0.0] # 沒見過的狀態不配發索引
+    assert len(agent) == 2
+
+
+def test_table_grows_past_initial_capacity():
+    agent = RLAgent([0, 1], initial_capacity=2)
+    states = [(i, 0) for i in range(5)]
+    agent.learn_batch(states, [0] * 5, [1.0] * 5, states)
+    assert len(agent) == 5
+    assert len(agent.q_table) >= 5
+    assert agent.q_values((4, 0))[0] == pytest.approx(0.1)
+
+
+def test_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "q_table.npz")
+    agent = RLAgent([0, 1], bin_width=[2, 5], max_bin=4)
+    agent.learn_batch([(3, 7), (9, 1)], [1, 0], [-4.0, 2.0], [(9, 1), (3, 7)])
+    agent.save(path)
+
+    restored = RLAgent([0, 1])
+    assert restored.load(path)
+    assert restored.encoder.keys() == agent.encoder.keys()
+    assert restored.encoder.max_bin == 4
+    assert restored.exploration_rate == pytest.approx(agent.exploration_rate)
+    for state in [(3, 7), (9, 1), (2, 9)]:
+        assert restored.q_values(state).tolist() == pytest.approx(agent.q_values(state).tolist())
+    assert not RLAgent([0, 1]).load(str(tmp_path / "missing.npz"))
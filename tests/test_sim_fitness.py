@@ -0,0 +1,68 @@
+import shutil
+import subprocess
+
+import pytest
+
+from sim_fitness import (average_ranks, spearman, statistic_output_options, total_time_loss, trip_statistics,
+                         trip_time_loss_so_far)
+
+
+def test_average_ranks_ties_share_mean_rank():
+    assert average_ranks([30.0, 10.0, 20.0]) == [3.0, 1.0, 2.0]
+    assert average_ranks([5, 1, 5, 3]) == [3.5, 1.0, 3.5, 2.0]
+    assert average_ranks([]) == []
+
+
+def test_spearman_monotonic_and_reversed():
+    assert spearman([1, 2, 3, 4], [10, 20, 30, 1000]) == pytest.approx(1.0)
+    assert spearman([1, 2, 3, 4], [4, 3, 2, 1]) == pytest.approx(-1.0)
+
+
+def test_spearman_with_ties():
+    # 名次 [1, 2.5, 2.5, 4] 與 [1, 2, 3, 4] 的 Pearson 相關
+    assert spearman([1, 2, 2, 3], [1, 2, 3, 4]) == pytest.approx(0.9486833, rel=1e-6)
+
+
+def test_spearman_undefined_cases():
+    assert spearman([1, 2], [2, 1]) is None # 少於 3 筆
+    assert spearman([7, 7, 7], [1, 2, 3]) is None # 名次沒有變化
+
+
+def test_total_time_loss_from_statistic_output(tmp_path):
+    path = tmp_path / "stats.xml"
+    path.write_text('<statistics><vehicleTripStatistics count="4" timeLoss="12.5" duration="100"/></statistics>',
+                    encoding="utf-8")
+    assert trip_statistics(str(path))["duration"] == 100.0
+    assert total_time_loss(str(path)) == pytest.approx(50.0)
+
+
+def _build_tiny_scenario(tmp_path):
+    """一條 500 公尺單車道路段，0~60 秒每 5 秒發一輛車"""
+    (tmp_path / "net.nod.xml").write_text(
+        '<nodes><node id="a" x="0" y="0"/><node id="b" x="500" y="0"/></nodes>', encoding="utf-8")
+    (tmp_path / "net.edg.xml").write_text(
+        '<edges><edge id="ab" from="a" to="b" numLanes="1" speed="13.9"/></edges>', encoding="utf-8")
+    (tmp_path / "r.rou.xml").write_text(
+        '<routes><flow id="f" begin="0" end="60" period="5" from="ab" to="ab"/></routes>', encoding="utf-8")
+    subprocess.run(["netconvert", "-n", str(tmp_path / "net.nod.xml"), "-e", str(tmp_path / "net.edg.xml"),
+                    "-o", str(tmp_path / "net.net.xml")], check=True, capture_output=True)
+    return str(tmp_path / "net.net.xml"), str(tmp_path / "r.rou.xml")
+
+
+@pytest.mark.skipif(shutil.which("sumo") is None or shutil.which("netconvert") is None, reason="需要 SUMO")
+def test_trip_time_loss_so_far_matches_statistic_output(tmp_path):
+    traci = pytest.importorskip("traci")
+    net, routes = _build_tiny_scenario(tmp_path)
+    stats_path = str(tmp_path / "stats.xml")
+    traci.start(["sumo", "-n", net, "-r", routes, "--no-step-log", "true"] + statistic_output_options(stats_path),
+                label="test_sim_fitness")
+    conn = traci.getConnection("test_sim_fitness")
+    try:
+        assert trip_time_loss_so_far(conn) == 0.0
+        while conn.simulation.getMinExpectedNumber() > 0:
+            conn.simulationStep()
+        so_far = trip_time_loss_so_far(conn)
+    finally:
+        conn.close()
+    assert so_far > 0
+    assert so_far == pytest.approx(total_time_loss(stats_path), rel=1e-4)
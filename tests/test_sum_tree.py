@@ -0,0 +1,51 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from replay_buffer import SumTree, PrioritizedReplayBuffer
+
+
+def test_leaf_count_rounds_up_to_power_of_two():
+    assert SumTree.leaf_count(1) == 1
+    assert SumTree.leaf_count(5) == 8
+    assert SumTree.leaf_count(8) == 8
+
+
+def test_update_keeps_internal_sums():
+    tree = SumTree(5)
+    tree.update([0, 1, 2, 3, 4], [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert tree.total() == pytest.approx(15.0)
+    tree.update([2], [0.5])
+    assert tree.total() == pytest.approx(12.5)
+    assert tree.leaves([0, 2, 4]).tolist() == [1.0, 0.5, 5.0]
+    assert tree.max_leaf(5) == 5.0
+    assert tree.max_leaf(0) == 0.0
+
+
+def test_find_maps_prefix_sums_to_leaves():
+    tree = SumTree(4)
+    tree.update([0, 1, 2, 3], [1.0, 2.0, 3.0, 4.0])
+    # 前綴和區間：[0,1) -> 0、[1,3) -> 1、[3,6) -> 2、[6,10) -> 3
+    assert tree.find([0.0, 0.99, 1.0, 2.5, 3.0, 5.99, 6.0, 9.99]).tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+
+
+def test_prioritized_sampling_prefers_high_priority():
+    buffer = PrioritizedReplayBuffer(8, state_size=2, alpha=1.0, seed=0)
+    for i in range(8):
+        buffer.add([i, i], 0, 0.0, [i, i], False)
+    buffer.update_priorities(np.arange(8), np.array([0, 0, 0, 0, 0, 0, 0, 100.0]))
+    *_, indices, weights = buffer.sample(4)
+    assert (indices == 7).sum() >= 3
+    assert weights.max() == pytest.approx(1.0)
+    assert np.isfinite(weights).all()
+
+
+def test_new_experience_gets_running_max_priority():
+    buffer = PrioritizedReplayBuffer(8, state_size=1, alpha=1.0, seed=0)
+    buffer.add([0], 0, 0.0, [0], False)
+    assert buffer.tree.leaves([0]).tolist() == [1.0]
+    buffer.update_priorities([0], np.array([4.0]))
+    buffer.update_priorities([0], np.array([0.5]))
+    # 最大優先度只增不減：舊經驗的優先度降低後，新經驗仍以曾經出現的最大值加入
+    i = buffer.add([1], 0, 0.0, [1], False)
+    assert buffer.tree.leaves([i])[0] == pytest.approx(4.0)
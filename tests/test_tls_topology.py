@@ -0,0 +1,14 @@
+from tls_topology import green_phases_by_tls
+
+
+def _tls(*states):
+    return {"phases": [{"state": s} for s in states], "controlled_lanes": []}
+
+
+def test_green_phases_follow_states_not_parity():
+    topology = {
+        "four": _tls("GGrr", "yyrr", "rrGG", "rryy"),
+        "three": _tls("GG", "yy", "rr"), # 相位 2 是全紅，不能當成綠燈
+    }
+    assert green_phases_by_tls(topology) == {"four": {0, 2}, "three": {0}}
+    assert green_phases_by_tls(topology, ["three"]) == {"three": {0}}
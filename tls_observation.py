@@ -0,0 +1,143 @@
+from traci import constants as tc
+
+
+class TLSObserver:
+    """
+    以 TraCI 訂閱 (subscription) 取得交通號誌觀測值的資料層。
+
+    啟動時對每條受控車道、每個號誌與模擬本身設定一次訂閱，之後每次
+    simulationStep 的回應就會附帶所有需要的數值；get_state / calculate_reward
+    只讀取本地快取，不再對每條車道、每輛車各發一次 socket 往返。
+    """
+
+    # 每條車道需要的數值 (排隊車輛數)
+    LANE_VARS = [tc.LAST_STEP_VEHICLE_HALTING_NUMBER]
+    # 車道的 context 訂閱：取得車道上每輛車的所在車道與等待時間
+    LANE_CONTEXT_VARS = [tc.VAR_LANE_ID, tc.VAR_WAITING_TIME]
+    # context 範圍 (公尺)；只是為了涵蓋車道本身，結果會再依 VAR_LANE_ID 過濾
+    LANE_CONTEXT_RANGE = 1.0
+    TLS_VARS = [tc.TL_CURRENT_PHASE, tc.TL_PHASE_DURATION, tc.TL_NEXT_SWITCH, tc.TL_RED_YELLOW_GREEN_STATE]
+    SIM_VARS = [tc.VAR_TIME, tc.VAR_MIN_EXPECTED_VEHICLES]
+
+    def __init__(self, tls_ids, conn=None, lanes_by_tls=None):
+        """
+        tls_ids: 要觀測的號誌 ID (字串或列表)
+        conn: traci 模組或 traci.Connection；預設使用 traci 的目前連線
+        lanes_by_tls: {tls_id: [lane, ...]}，若未提供則向 SUMO 查詢一次
+        """
+        if conn is None:
+            import traci
+            conn = traci
+        if isinstance(tls_ids, str):
+            tls_ids = [tls_ids]
+        self.conn = conn
+        self.tls_ids = list(tls_ids)
+
+        if lanes_by_tls is None:
+            lanes_by_tls = {}
+        self.lanes = {}
+        for tls_id in self.tls_ids:
+            lanes = lanes_by_tls.get(tls_id)
+            if lanes is None:
+                # 只在初始化時查詢一次；dict.fromkeys 去重並保持順序
+                lanes = list(dict.fromkeys(conn.trafficlight.getControlledLanes(tls_id)))
+            self.lanes[tls_id] = list(lanes)
+
+        self._lane_results = {}
+        self._lane_context_results = {}
+        self._tls_results = {}
+        self._sim_results = {}
+        # setPhase 之後、下一次 simulationStep 之前，訂閱值是舊的
+        self._stale_tls = set()
+
+    def all_lanes(self):
+        """所有被觀測的車道 (不重複)"""
+        lanes = []
+        for tls_id in self.tls_ids:
+            lanes.extend(self.lanes[tls_id])
+        return list(dict.fromkeys(lanes))
+
+    def subscribe(self):
+        """設定所有訂閱 (啟動或 traci.load 之後呼叫一次)"""
+        conn = self.conn
+        for lane in self.all_lanes():
+            conn.lane.subscribe(lane, self.LANE_VARS)
+            conn.lane.subscribeContext(lane, tc.CMD_GET_VEHICLE_VARIABLE,
+                                       self.LANE_CONTEXT_RANGE, self.LANE_CONTEXT_VARS)
+        for tls_id in self.tls_ids:
+            conn.trafficlight.subscribe(tls_id, self.TLS_VARS)
+        conn.simulation.subscribe(self.SIM_VARS)
+        self.update()
+
+    def update(self):
+        """從上一次 simulationStep 的回應讀取訂閱結果 (純本地操作，不產生往返)"""
+        conn = self.conn
+        self._lane_results = conn.lane.getAllSubscriptionResults()
+        self._lane_context_results = conn.lane.getAllContextSubscriptionResults()
+        self._tls_results = conn.trafficlight.getAllSubscriptionResults()
+        self._sim_results = conn.simulation.getSubscriptionResults()
+        self._stale_tls.clear()
+
+    def step(self):
+        """推進一步模擬並更新觀測值"""
+        self.conn.simulationStep()
+        self.update()
+
+    # --- 模擬層級 ---
+    def time(self):
+        return self._sim_results[tc.VAR_TIME]
+
+    def min_expected_number(self):
+        return self._sim_results[tc.VAR_MIN_EXPECTED_VEHICLES]
+
+    # --- 號誌層級 ---
+    def _tls_value(self, tls_id, var):
+        if tls_id in self._stale_tls:
+            # 剛切換過相位：直接向 SUMO 查詢 (只在切換時才發生)
+            getter = {
+                tc.TL_CURRENT_PHASE: self.conn.trafficlight.getPhase,
+                tc.TL_PHASE_DURATION: self.conn.trafficlight.getPhaseDuration,
+                tc.TL_NEXT_SWITCH: self.conn.trafficlight.getNextSwitch,
+                tc.TL_RED_YELLOW_GREEN_STATE: self.conn.trafficlight.getRedYellowGreenState,
+            }[var]
+            return getter(tls_id)
+        return self._tls_results[tls_id][var]
+
+    def phase(self, tls_id):
+        return self._tls_value(tls_id, tc.TL_CURRENT_PHASE)
+
+    def phase_duration(self, tls_id):
+        return self._tls_value(tls_id, tc.TL_PHASE_DURATION)
+
+    def next_switch(self, tls_id):
+        return self._tls_value(tls_id, tc.TL_NEXT_SWITCH)
+
+    def red_yellow_green_state(self, tls_id):
+        return self._tls_value(tls_id, tc.TL_RED_YELLOW_GREEN_STATE)
+
+    def set_phase(self, tls_id, phase):
+        """切換相位，並標記該號誌的訂閱值在下一步之前已過期"""
+        self.conn.trafficlight.setPhase(tls_id, phase)
+        self._stale_tls.add(tls_id)
+
+    # --- 車道層級 ---
+    def queue_lengths(self, tls_id):
+        """受控車道的排隊車輛數 (順序與 self.lanes[tls_id] 相同)"""
+        results = self._lane_results
+        return [results[lane][tc.LAST_STEP_VEHICLE_HALTING_NUMBER] for lane in self.lanes[tls_id]]
+
+    def total_queue_length(self, tls_id):
+        return sum(self.queue_lengths(tls_id))
+
+    def total_waiting_time(self, tls_id):
+        """受控車道上所有車輛的等待時間總和"""
+        total = 0.0
+        for lane in self.lanes[tls_id]:
+            vehicles = self._lane_context_results.get(lane)
+            if not vehicles:
+                continue
+            for values in vehicles.values():
+                # context 範圍可能涵蓋相鄰車道的車輛，依所在車道過濾
+                if values[tc.VAR_LANE_ID] == lane:
+                    total += values[tc.VAR_WAITING_TIME]
+        return total
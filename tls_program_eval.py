@@ -0,0 +1,69 @@
+"""
+不經過 TraCI 的固定時制評估：把號誌程式寫成 tlLogic 附加檔，直接以子行程執行 sumo。
+
+固定時制的候選解不需要逐步控制，整場模擬交給 sumo 自己跑完 (沒有 socket 往返、
+沒有 Python 逐步迴圈)，結束後從 statistic-output 讀出總延遲。
+"""
+import os
+import subprocess
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+from atomic_file import atomic_write
+from sim_fitness import statistic_output_options, total_time_loss
+
+
+def additional_files_from_sumocfg(sumocfg_path):
+    """從 .sumocfg 讀出 additional-files (相對於 sumocfg 所在目錄)"""
+    root = ET.parse(sumocfg_path).getroot()
+    base = os.path.dirname(os.path.abspath(sumocfg_path))
+    files = []
+    for elem in root.iter("additional-files"):
+        value = elem.attrib.get("value", "")
+        files.extend(os.path.join(base, f.strip()) for f in value.split(",") if f.strip())
+    return files
+
+
+def write_tl_logic(path, tls_id, program_id, phases):
+    """
+    phases: [(duration, state), ...]；寫成 static tlLogic 附加檔。
+    附加檔中最後載入的程式會成為該號誌的執行中程式，不需要再以 TraCI 切換。
+    """
+    lines = ['<additional>',
+             f'    <tlLogic id={quoteattr(tls_id)} programID={quoteattr(program_id)} type="static" offset="0">']
+    lines += [f'        <phase duration="{duration}" state={quoteattr(state)}/>' for duration, state in phases]
+    lines += ['    </tlLogic>', '</additional>', '']
+    with atomic_write(path) as f:
+        f.write("\n".join(lines))
+
+
+def run_fixed_time(sumocfg_path, tls_id, phases, work_prefix, seed=None, sim_options=(), max_steps=None,
+                   sumo_binary="sumo"):
+    """
+    以子行程跑完一次固定時制模擬，回傳總延遲 (所有完成旅程的 timeLoss 總和)。
+    sumocfg 原本的附加檔 (poly、站牌、輸出設定) 會一併載入；work_prefix 決定暫存檔名
+    (同時執行的評估必須各自不同)。失敗時拋出 RuntimeError。
+    不支援 --load-state：載入狀態檔會把號誌切回快照中的程式，附加檔的程式不會生效。
+    """
+    logic_path = f"{work_prefix}.tll.xml"
+    stats_path = f"{work_prefix}.stats.xml"
+    write_tl_logic(logic_path, tls_id, "ga_prog", phases)
+    cmd = [sumo_binary, "-c", sumocfg_path]
+    if seed is not None:
+        cmd += ["--seed", str(seed)]
+    cmd += list(sim_options)
+    cmd += ["--additional-files", ",".join(additional_files_from_sumocfg(sumocfg_path) + [os.path.abspath(logic_path)])]
+    cmd += statistic_output_options(stats_path)
+    cmd += ["--no-step-log", "true", "--verbose", "false"]
+    if max_steps is not None:
+        # 與 TraCI 迴圈相同：最多跑 max_steps 秒 (車輛全部離開時 sumo 會自行結束)
+        cmd += ["--end", str(max_steps)]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"sumo 結束碼 {result.returncode}: {result.stderr.strip()[-500:]}")
+        return total_time_loss(stats_path)
+    finally:
+        for path in (logic_path, stats_path):
+            if os.path.exists(path):
+                os.remove(path)
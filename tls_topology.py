@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import xml.etree.ElementTree as ET
+
+from atomic_file import atomic_write
+
+# 快取格式版本：修改索引內容時遞增，舊快取會自動失效
+TOPOLOGY_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = ".cache"
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    """計算檔案內容的 SHA1 (用來當作快取鍵)"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def net_file_from_sumocfg(sumocfg_path):
+    """從 .sumocfg 讀出 net-file 的路徑 (相對於 sumocfg 所在目錄)"""
+    root = ET.parse(sumocfg_path).getroot()
+    for elem in root.iter("net-file"):
+        value = elem.attrib.get("value")
+        if value:
+            return os.path.join(os.path.dirname(os.path.abspath(sumocfg_path)), value)
+    raise ValueError(f"'{sumocfg_path}' 中找不到 net-file 設定")
+
+
+def _parse_net(net_file):
+    """
+    以 iterparse 掃描一次路網檔，收集所有 tlLogic 與受號誌控制的 connection。
+    回傳 {tls_id: 索引 dict}。
+    """
+    tls = {}
+    links = {}
+    for _, elem in ET.iterparse(net_file, events=("end",)):
+        if elem.tag == "tlLogic":
+            phases = []
+            for p in elem.findall("phase"):
+                phase = {"duration": float(p.attrib["duration"]), "state": p.attrib["state"]}
+                for key in ("minDur", "maxDur"):
+                    if key in p.attrib:
+                        phase[key] = float(p.attrib[key])
+                phases.append(phase)
+            tls[elem.attrib["id"]] = {
+                "id": elem.attrib["id"],
+                "type": elem.attrib.get("type", "static"),
+                "programID": elem.attrib.get("programID", "0"),
+                "offset": float(elem.attrib.get("offset", 0)),
+                "phases": phases,
+            }
+            elem.clear()
+        elif elem.tag == "connection":
+            if "tl" in elem.attrib:
+                a = elem.attrib
+                links.setdefault(a["tl"], []).append({
+                    "linkIndex": int(a["linkIndex"]),
+                    "from": a["from"],
+                    "to": a["to"],
+                    "fromLane": int(a["fromLane"]),
+                    "toLane": int(a["toLane"]),
+                    "lane": f"{a['from']}_{a['fromLane']}",
+                    "dir": a.get("dir", ""),
+                })
+            elem.clear()
+        elif elem.tag in ("edge", "junction"):
+            # 這兩種元素佔路網檔大部分，讀完就釋放
+            elem.clear()
+
+    for tls_id, info in tls.items():
+        tls_links = sorted(links.get(tls_id, []), key=lambda l: l["linkIndex"])
+        info["links"] = tls_links
+        # 受控車道：依 linkIndex 排序後去重，順序固定 (與 getControlledLanes 的順序一致)
+        info["controlled_lanes"] = list(dict.fromkeys(l["lane"] for l in tls_links))
+        info["incoming_edges"] = list(dict.fromkeys(l["from"] for l in tls_links))
+        info["num_links"] = len(info["phases"][0]["state"]) if info["phases"] else len(tls_links)
+    return tls
+
+
+def load_topology(net_file="osm.net.xml", cache_dir=DEFAULT_CACHE_DIR):
+    """
+    載入路網的號誌拓撲索引。
+
+    索引依路網檔內容的 SHA1 快取在 cache_dir 中；路網沒變就直接讀 JSON，
+    路網一改動就重新解析。回傳 {tls_id: {"phases", "links", "controlled_lanes",
+    "incoming_edges", ...}}。
+    """
+    digest = file_sha1(net_file)
+    cache_path = os.path.join(cache_dir, f"tls_topology_{digest[:16]}.json")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("version") == TOPOLOGY_FORMAT_VERSION and cached.get("net_sha1") == digest:
+                return cached["tls"]
+        except (OSError, ValueError) as e:
+            print(f"警告：號誌拓撲快取 '{cache_path}' 無法讀取 ({e})，重新解析路網。")
+
+    tls = _parse_net(net_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 原子替換，避免多個行程同時寫入時讀到半個檔案
+    with atomic_write(cache_path) as f:
+        json.dump({"version": TOPOLOGY_FORMAT_VERSION, "net_sha1": digest,
+                   "net_file": os.path.basename(net_file), "tls": tls}, f)
+    print(f"✅ 已建立號誌拓撲索引 ({len(tls)} 個號誌): {cache_path}")
+    return tls
+
+
+def load_topology_for_sumocfg(sumocfg_path="osm.sumocfg", cache_dir=DEFAULT_CACHE_DIR):
+    """依 sumocfg 內的 net-file 載入拓撲索引"""
+    return load_topology(net_file_from_sumocfg(sumocfg_path), cache_dir=cache_dir)
+
+
+def lanes_by_tls(topology, tls_ids=None):
+    """{tls_id: 受控車道列表}，可直接傳給 TLSObserver"""
+    if tls_ids is None:
+        tls_ids = list(topology)
+    return {tls_id: list(topology[tls_id]["controlled_lanes"]) for tls_id in tls_ids}
+
+
+def green_phases_by_tls(topology, tls_ids=None):
+    """{tls_id: 主綠燈相位索引的 frozenset}，RL 只在這些相位做決策 (不能用相位索引的奇偶判斷，
+    例如 ['GG', 'yy', 'rr'] 的相位 2 是全紅)"""
+    if tls_ids is None:
+        tls_ids = list(topology)
+    return {tls_id: frozenset(green_phase_indices(topology[tls_id])) for tls_id in tls_ids}
+
+
+def green_phase_indices(tls_info):
+    """號誌程式中含綠燈且不含黃燈的相位索引 (即可給予綠燈時長的主相位)"""
+    indices = []
+    for i, phase in enumerate(tls_info["phases"]):
+        state = phase["state"]
+        if ("G" in state or "g" in state) and "y" not in state:
+            indices.append(i)
+    return indices